@@ -10,6 +10,7 @@ from app.orm.base import ModelBase
 from app.orm.user import User
 from app.orm.oauth2client import OAuth2Client
 from app.orm.oauth2token import OAuth2Token
+from app.orm.websession import WebSession
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
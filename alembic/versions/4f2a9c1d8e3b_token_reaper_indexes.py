@@ -0,0 +1,26 @@
+"""token reaper indexes
+
+Revision ID: 4f2a9c1d8e3b
+Revises: bb07d7c733b7
+Create Date: 2026-10-18 09:12:41.318207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f2a9c1d8e3b'
+down_revision = 'bb07d7c733b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_oauth2_tokens_refresh_token_expires_at', 'oauth2_tokens', ['refresh_token_expires_at'], unique=False)
+    op.create_index('ix_oauth2_tokens_revoked', 'oauth2_tokens', ['id'], unique=False, postgresql_where=sa.text('revoked'), sqlite_where=sa.text('revoked'))
+
+
+def downgrade():
+    op.drop_index('ix_oauth2_tokens_revoked', table_name='oauth2_tokens')
+    op.drop_index('ix_oauth2_tokens_refresh_token_expires_at', table_name='oauth2_tokens')
@@ -0,0 +1,31 @@
+"""web sessions
+
+Revision ID: 7c1e5b2a9d40
+Revises: 4f2a9c1d8e3b
+Create Date: 2026-10-18 11:02:17.584920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1e5b2a9d40'
+down_revision = '4f2a9c1d8e3b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('web_sessions',
+    sa.Column('id', sa.String(length=64), nullable=False),
+    sa.Column('data', sa.Text(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_web_sessions_expires_at'), 'web_sessions', ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_web_sessions_expires_at'), table_name='web_sessions')
+    op.drop_table('web_sessions')
@@ -0,0 +1,27 @@
+"""client rate limits
+
+Revision ID: a3d8f2c6b1e7
+Revises: 7c1e5b2a9d40
+Create Date: 2026-10-18 15:41:09.271834
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3d8f2c6b1e7'
+down_revision = '7c1e5b2a9d40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('oauth2_clients', sa.Column('rate_limit_per_minute', sa.Integer(), nullable=True))
+    op.add_column('oauth2_clients', sa.Column('rate_limit_burst', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('oauth2_clients') as batch_op:
+        batch_op.drop_column('rate_limit_burst')
+        batch_op.drop_column('rate_limit_per_minute')
@@ -1,39 +1,129 @@
 """
 Authentication / security tools
 """
+import asyncio
+import base64
+import os
 import secrets
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Any, Union, Optional
+from typing import Any, Deque, Dict, Union, Optional
 from jose import jwt # type: ignore
 from passlib.context import CryptContext # type: ignore
 from .config import settings
+from .metrics import Histogram
 
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 ALGORITHM = "HS256"
+# Audiences of the kinds of JWT signed with SECRET_KEY. Each kind is decoded
+# only with its own audience, so that one cannot be used as another.
+ACCESS_TOKEN_AUDIENCE = "webster:access"
+PASSWORD_RESET_AUDIENCE = "webster:password-reset"
+
+
+class RandomKeyPool():
+    """URL safe random keys, generated ahead in batches.
+
+    Each batch of keys of a size is made from a single read of the system
+    random source, rather than one read per key. Keys are the same as those
+    of secrets.token_urlsafe. The pool is emptied in forked child processes,
+    so that workers forked from one parent never share keys.
+
+    batch_size: keys generated per refill
+    """
+
+    def __init__(self, batch_size:int=256):
+        self.batch_size = batch_size
+        self._keys:Dict[int, Deque[str]] = {}
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.clear)
+
+    def get(self, nbytes:int) -> str:
+        """A key of nbytes random bytes."""
+        keys = self._keys.get(nbytes)
+        if keys:
+            try:
+                return keys.popleft()
+            except IndexError:
+                pass # taken by another thread
+        with self._lock:
+            keys = self._keys.setdefault(nbytes, deque())
+            while not keys:
+                self._fill(keys, nbytes)
+            return keys.popleft()
+
+    def prefill(self, *sizes:int):
+        """Generate a batch of keys of each of sizes (in bytes) now, e.g. at
+        startup, rather than on first use.
+        """
+        with self._lock:
+            for nbytes in sizes:
+                keys = self._keys.setdefault(nbytes, deque())
+                if not keys:
+                    self._fill(keys, nbytes)
+
+    def _fill(self, keys:Deque[str], nbytes:int):
+        data = secrets.token_bytes(nbytes * self.batch_size)
+        keys.extend(
+            base64.urlsafe_b64encode(data[i:i + nbytes]).rstrip(b'=').decode()
+            for i in range(0, len(data), nbytes))
+
+    def clear(self):
+        self._keys = {}
+        self._lock = threading.Lock()
+
+
+random_keys = RandomKeyPool(batch_size=max(1, settings.RANDOM_KEY_POOL_SIZE))
 
 
 def create_random_key(nbytes):
     """Create a URL safe secret token."""
+    if settings.RANDOM_KEY_POOL_SIZE:
+        return random_keys.get(nbytes)
     return secrets.token_urlsafe(nbytes)
 
 
 def create_access_token(
-    subject: Union[str, Any], expires_delta: timedelta = None
+    subject: Union[str, Any], expires_delta: timedelta = None,
+    expires_at: Optional[datetime] = None, **claims
 ) -> str:
-    """Create an access token"""
-    if expires_delta:
+    """Create a self-encoded (JWT) access token.
+
+    expires_at: expiry as a naive UTC datetime. Takes precedence over
+                expires_delta. Defaults to the OAuth2 access token timeout.
+    claims: additional claims to encode
+    """
+    if expires_at:
+        expire = expires_at
+    elif expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(
-            minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES
+            seconds=settings.OAUTH2_ACCESS_TOKEN_TIMEOUT_SECONDS
         )
-    to_encode = {"exp": expire, "sub": str(subject)}
+    to_encode = {**claims, "exp": expire, "sub": str(subject),
+        "aud": ACCESS_TOKEN_AUDIENCE}
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+def decode_access_token(token: str) -> Optional[dict]:
+    """Verify the signature, audience and expiry of a self-encoded access
+    token and return its claims, or None if it is invalid.
+    """
+    try:
+        return jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM],
+            audience=ACCESS_TOKEN_AUDIENCE, options={'require_aud': True})
+    except jwt.JWTError:
+        return None
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify password against hashed password."""
     return pwd_context.verify(plain_password, hashed_password)
@@ -44,6 +134,95 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+class HashQueueFull(Exception):
+    """Too many password hashing requests in flight."""
+
+
+class PasswordHasher():
+    """Runs password hashing and verification in an executor so that bcrypt
+    does not block the event loop.
+
+    executor: thread or process
+    workers: executor pool size. Defaults to the cpu count.
+    queue_limit: maximum number of hashes in flight (running or queued). When
+                 the limit is reached, further requests fail fast with
+                 HashQueueFull rather than queueing without bound.
+    """
+
+    HashQueueFull = HashQueueFull # pylint:disable=invalid-name
+
+    def __init__(self, executor:str='thread', workers:Optional[int]=None,
+            queue_limit:int=64):
+        if executor not in ('thread', 'process'):
+            raise ValueError(f'Invalid password hash executor: {executor}')
+        self.executor_type = executor
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor:Optional[Executor] = None
+        self.pending = 0
+        self.max_pending = 0
+        self.rejected = 0
+        self.latency = Histogram()
+
+    @property
+    def executor(self) -> Executor:
+        """The pool, created on first use."""
+        if self._executor is None:
+            if self.executor_type == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                    thread_name_prefix='password-hash')
+        return self._executor
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.queue_limit:
+            self.rejected += 1
+            raise HashQueueFull
+        self.pending += 1
+        self.max_pending = max(self.max_pending, self.pending)
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+            self.latency.observe(time.perf_counter() - start)
+
+    async def hash(self, password:str) -> str:
+        """Awaitable get_password_hash."""
+        return await self._run(get_password_hash, password)
+
+    async def verify(self, plain_password:str, hashed_password:str) -> bool:
+        """Awaitable verify_password."""
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    def stats(self) -> dict:
+        """Return queue depth and latency metrics. Latency includes time
+        spent queued for a worker.
+        """
+        return {
+            'executor': self.executor_type,
+            'queue_limit': self.queue_limit,
+            'pending': self.pending,
+            'max_pending': self.max_pending,
+            'rejected': self.rejected,
+            'latency': self.latency.snapshot(),
+        }
+
+    def shutdown(self):
+        """Shut down the pool. It is re-created if used again."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(
+    executor=settings.PASSWORD_HASH_EXECUTOR,
+    workers=settings.PASSWORD_HASH_WORKERS,
+    queue_limit=settings.PASSWORD_HASH_QUEUE_LIMIT)
+
+
 def generate_password_reset_token(email: str) -> str:
     """Generate a password reset token"""
     delta = timedelta(hours=settings.EMAIL_RESET_TOKEN_EXPIRE_HOURS)
@@ -51,7 +230,8 @@ def generate_password_reset_token(email: str) -> str:
     expires = now + delta
     exp = expires.timestamp()
     encoded_jwt = jwt.encode(
-        {"exp": exp, "nbf": now, "sub": email}, settings.SECRET_KEY, algorithm="HS256",
+        {"exp": exp, "nbf": now, "sub": email, "aud": PASSWORD_RESET_AUDIENCE},
+        settings.SECRET_KEY, algorithm="HS256",
     )
     return encoded_jwt
 
@@ -59,8 +239,9 @@ def generate_password_reset_token(email: str) -> str:
 def verify_password_reset_token(token: str) -> Optional[str]:
     """Verify a password reset token"""
     try:
-        decoded_token = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
+        decoded_token = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"],
+            audience=PASSWORD_RESET_AUDIENCE, options={'require_aud': True})
         return decoded_token["sub"]
-    except jwt.JWTError:
+    except (jwt.JWTError, KeyError):
         return None
 
@@ -0,0 +1,489 @@
+"""
+In-process caching utilities.
+
+LRUCache is a bounded, per-process mapping with least-recently-used eviction
+and optional per-entry expiry. It is used to keep hot lookups (e.g. bearer
+token validation) off the database. Being per-process, entries are not shared
+between workers, so anything cached here must either expire quickly or be
+explicitly invalidated by the code that mutates the underlying data.
+
+Invalidation is version based. Each invalidate() bumps the version of the key,
+and a reader that captures version() before loading from the database can pass
+it to set() so that a value loaded before a concurrent write is not cached:
+
+```
+version = cache.version(key)
+value = load_from_db(key)
+cache.set(key, value, version=version)
+```
+
+Cache is a namespace of the cache backend registered as
+Container.cache_backend, selected by CACHE_BACKEND, with the interface of
+LRUCache:
+
+ * memory: an LRUCache per namespace in each process (the default)
+ * mmap: a fixed size table in a memory-mapped file, shared by the processes
+   of one host. Values that do not fit in a slot are not cached.
+ * redis: shared by all processes through redis. Requires the redis package.
+   Tests may run it against a fake, e.g. RedisCacheBackend(client=
+   fakeredis.FakeRedis()).
+
+The shared backends pickle values with their expiry, under keys hashed from
+the namespace and key. The redis backend also keeps values in a near cache in
+each process, and broadcasts invalidations over pub/sub so that the other
+processes drop their copies and bump their versions. Versions are otherwise
+per process, so with the mmap backend a value loaded by one worker while
+another worker writes may be cached until it expires.
+"""
+import hashlib
+import itertools
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+from .config import settings
+
+
+_MISSING = object()
+
+
+class LRUCache():
+    """Bounded LRU cache with per-entry expiry and hit/miss counters.
+
+    maxsize: maximum number of entries held before the least recently used
+             entry is evicted
+    ttl: default time-to-live in seconds for entries set without an explicit
+         ttl. None means entries do not expire on their own.
+    """
+
+    def __init__(self, maxsize:int=1024, ttl:Optional[float]=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data:OrderedDict = OrderedDict()
+        self._versions:OrderedDict = OrderedDict()
+        self._generation = itertools.count(1)
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key:Hashable, default:Any=None) -> Any:
+        """Get the cached value for key, or default if missing or expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires = entry
+            if expires is not None and time.monotonic() >= expires:
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def version(self, key:Hashable) -> int:
+        """Get the current version of key. Versions change on invalidation."""
+        with self._lock:
+            return self._versions.get(key, 0)
+
+    def set(self, key:Hashable, value:Any, ttl:Optional[float]=None,
+            version:Optional[int]=None):
+        """Cache value for key.
+
+        ttl: seconds until the entry expires. Overrides the cache default. A
+             ttl <= 0 means the value is already expired and is not cached.
+        version: the version of key captured before value was loaded. If the
+                 key has been invalidated since, value is stale and is not
+                 cached.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        if ttl is not None and ttl <= 0:
+            with self._lock:
+                self._data.pop(key, None)
+            return
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            if version is not None and version != self._versions.get(key, 0):
+                return
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key:Hashable):
+        """Remove key from the cache if present and bump its version."""
+        with self._lock:
+            self._data.pop(key, None)
+            self._versions[key] = next(self._generation)
+            self._versions.move_to_end(key)
+            # Versions are bounded like entries. An evicted version reads as
+            # 0 again, so only a reader spanning maxsize other invalidations
+            # could cache a stale value (and the entry ttl still applies).
+            while len(self._versions) > self.maxsize:
+                self._versions.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries. Counters are not reset."""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """Return cache counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+def _digest(namespace:str, key:Hashable) -> bytes:
+    return hashlib.blake2b(repr(key).encode(), digest_size=16,
+        person=namespace.encode()[:16]).digest()
+
+
+class SharedCache():
+    """A namespace of a shared cache backend, with the interface of LRUCache.
+
+    Versions, and values if the backend broadcasts invalidations, are kept in
+    a per-process LRUCache of maxsize.
+    """
+
+    def __init__(self, backend, namespace:str, maxsize:int,
+            ttl:Optional[float]):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+        self.near = backend.broadcasts
+        self.local = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+        if self.near:
+            backend.subscribe(namespace, self.receive)
+
+    def key(self, key:Hashable) -> str:
+        """The backend key of key."""
+        return f'{self.namespace}:{_digest(self.namespace, key).hex()}'
+
+    def get(self, key:Hashable, default:Any=None) -> Any:
+        if self.near:
+            value = self.local.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+        version = self.local.version(key)
+        data = self.backend.get(self.key(key))
+        if data is not None:
+            value, expires = pickle.loads(data)
+            if expires is None or expires > time.time():
+                self.hits += 1
+                if self.near:
+                    self.local.set(key, value, version=version, ttl=None
+                        if expires is None else expires - time.time())
+                return value
+        self.misses += 1
+        return default
+
+    def version(self, key:Hashable) -> int:
+        return self.local.version(key)
+
+    def set(self, key:Hashable, value:Any, ttl:Optional[float]=None,
+            version:Optional[int]=None):
+        if ttl is None:
+            ttl = self.ttl
+        if ttl is not None and ttl <= 0:
+            self.local.set(key, value, ttl=0)
+            self.backend.delete(self.key(key))
+            return
+        if version is not None and version != self.local.version(key):
+            return
+        expires = time.time() + ttl if ttl is not None else None
+        self.backend.set(self.key(key),
+            pickle.dumps((value, expires), pickle.HIGHEST_PROTOCOL), ttl)
+        if self.near:
+            self.local.set(key, value, ttl=ttl, version=version)
+
+    def invalidate(self, key:Hashable):
+        self.local.invalidate(key)
+        self.backend.delete(self.key(key))
+        self.backend.publish(self.namespace, 'invalidate', key)
+
+    def clear(self):
+        self.local.clear()
+        self.backend.clear(self.namespace + ':')
+        self.backend.publish(self.namespace, 'clear', None)
+
+    def receive(self, action:str, key:Hashable):
+        """Apply an invalidation broadcast by another process."""
+        if action == 'clear':
+            self.local.clear()
+        else:
+            self.local.invalidate(key)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'local': self.local.stats(),
+        }
+
+
+class MemoryCacheBackend():
+    """Per-process cache backend."""
+
+    def namespace(self, name:str, maxsize:int, ttl:Optional[float]):
+        return LRUCache(maxsize=maxsize, ttl=ttl)
+
+
+class MmapCacheBackend():
+    """Cache backend on a memory-mapped file, shared by the processes that
+    map the same path.
+
+    The file is a table of slots of slot_size bytes, and a key is stored in
+    the slot of its hash, replacing any other key there. Each slot holds the
+    key digest, the expiry as a unix timestamp (0 for none), the value length
+    and the value. Slots are locked with fcntl locks between processes.
+    """
+
+    broadcasts = False
+    header = struct.Struct('<16sdI')
+
+    def __init__(self, path:str, slots:int, slot_size:int):
+        import fcntl # pylint:disable=import-outside-toplevel
+        self._fcntl = fcntl
+        self.slots = slots
+        self.slot_size = slot_size
+        size = slots * slot_size
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
+        self._lock = threading.Lock()
+        self.oversize = 0
+
+    def namespace(self, name:str, maxsize:int, ttl:Optional[float]):
+        return SharedCache(self, name, maxsize, ttl)
+
+    def _slot(self, key:str) -> Tuple[bytes, int]:
+        digest = bytes.fromhex(key.rsplit(':', 1)[1])
+        index = int.from_bytes(digest[:8], 'little') % self.slots
+        return digest, index * self.slot_size
+
+    def _locked(self, offset:int, exclusive:bool):
+        lock = self._fcntl.LOCK_EX if exclusive else self._fcntl.LOCK_SH
+        self._fcntl.lockf(self.fd, lock, self.slot_size, offset)
+
+    def _unlock(self, offset:int):
+        self._fcntl.lockf(self.fd, self._fcntl.LOCK_UN, self.slot_size, offset)
+
+    def get(self, key:str) -> Optional[bytes]:
+        digest, offset = self._slot(key)
+        with self._lock:
+            self._locked(offset, False)
+            try:
+                found, expires, length = self.header.unpack_from(
+                    self.map, offset)
+                if found != digest or not length \
+                        or expires and expires <= time.time():
+                    return None
+                start = offset + self.header.size
+                return self.map[start:start + length]
+            finally:
+                self._unlock(offset)
+
+    def set(self, key:str, data:bytes, ttl:Optional[float]):
+        if len(data) > self.slot_size - self.header.size:
+            self.oversize += 1
+            self.delete(key)
+            return
+        digest, offset = self._slot(key)
+        expires = time.time() + ttl if ttl is not None else 0.0
+        with self._lock:
+            self._locked(offset, True)
+            try:
+                start = offset + self.header.size
+                self.map[start:start + len(data)] = data
+                self.header.pack_into(self.map, offset, digest, expires,
+                    len(data))
+            finally:
+                self._unlock(offset)
+
+    def delete(self, key:str):
+        digest, offset = self._slot(key)
+        with self._lock:
+            self._locked(offset, True)
+            try:
+                if self.header.unpack_from(self.map, offset)[0] == digest:
+                    self.header.pack_into(self.map, offset, b'', 0.0, 0)
+            finally:
+                self._unlock(offset)
+
+    def clear(self, prefix:str):
+        """Empty all slots. Keys are stored as digests, so entries of other
+        namespaces are cleared too.
+        """
+        with self._lock:
+            self._fcntl.lockf(self.fd, self._fcntl.LOCK_EX)
+            try:
+                for offset in range(0, self.slots * self.slot_size,
+                        self.slot_size):
+                    self.header.pack_into(self.map, offset, b'', 0.0, 0)
+            finally:
+                self._fcntl.lockf(self.fd, self._fcntl.LOCK_UN)
+
+    def publish(self, namespace:str, action:str, key:Hashable):
+        pass # other processes read the same slots
+
+
+class RedisCacheBackend():
+    """Cache backend shared by all processes through redis. Requires the
+    redis package, unless a client (e.g. a fakeredis client) is given.
+
+    Invalidations are published on channel, with the id of the publishing
+    backend so that it ignores its own messages. They are received by a
+    thread started on first subscription in each process.
+    """
+
+    broadcasts = True
+    prefix = 'webster:cache:'
+    channel = 'webster:cache:invalidate'
+
+    def __init__(self, url:str, client=None):
+        if client is None:
+            try:
+                import redis # type: ignore # pylint:disable=import-outside-toplevel
+            except ImportError as e:
+                raise ImportError(
+                    'The redis cache backend requires the redis package'
+                ) from e
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.id = uuid.uuid4().bytes
+        self.listeners:dict = {}
+        self._listening = None # pid of the process running the listener
+
+    def namespace(self, name:str, maxsize:int, ttl:Optional[float]):
+        return SharedCache(self, name, maxsize, ttl)
+
+    def get(self, key:str) -> Optional[bytes]:
+        self.listen()
+        return self.client.get(self.prefix + key)
+
+    def set(self, key:str, data:bytes, ttl:Optional[float]):
+        self.client.set(self.prefix + key, data,
+            px=max(1, int(ttl * 1000)) if ttl is not None else None)
+
+    def delete(self, key:str):
+        self.client.delete(self.prefix + key)
+
+    def clear(self, prefix:str):
+        for key in self.client.scan_iter(self.prefix + prefix + '*'):
+            self.client.delete(key)
+
+    def publish(self, namespace:str, action:str, key:Hashable):
+        self.client.publish(self.channel,
+            pickle.dumps((self.id, namespace, action, key)))
+
+    def subscribe(self, namespace:str, callback:Callable[[str, Hashable], None]):
+        """Call callback with the action and key of invalidations of
+        namespace published by other processes.
+        """
+        self.listeners[namespace] = callback
+        self.listen()
+
+    def listen(self):
+        """Start the listener thread, if not running in this process. A
+        forked process starts its own.
+        """
+        if self._listening == os.getpid() or not self.listeners:
+            return
+        self._listening = os.getpid()
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{self.channel: self._receive})
+        pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def _receive(self, message:dict):
+        sender, namespace, action, key = pickle.loads(message['data'])
+        callback = self.listeners.get(namespace)
+        if sender != self.id and callback is not None:
+            callback(action, key)
+
+
+def get_backend():
+    """Create the cache backend selected in settings."""
+    if settings.CACHE_BACKEND == 'memory':
+        return MemoryCacheBackend()
+    if settings.CACHE_BACKEND == 'mmap':
+        return MmapCacheBackend(settings.CACHE_MMAP_PATH,
+            settings.CACHE_MMAP_SLOTS, settings.CACHE_MMAP_SLOT_BYTES)
+    if settings.CACHE_BACKEND == 'redis':
+        return RedisCacheBackend(settings.CACHE_REDIS_URL)
+    raise ValueError(f'Invalid cache backend: {settings.CACHE_BACKEND}')
+
+
+class Cache():
+    """A namespace of a cache backend, with the interface of LRUCache.
+
+    backend: callable returning the backend, e.g. Container.cache_backend.
+             It is called on first use, so the provider may be overridden
+             until then, or reset() called after overriding it.
+    """
+
+    def __init__(self, namespace:str, backend:Callable[[], Any],
+            maxsize:int=1024, ttl:Optional[float]=None):
+        self.namespace = namespace
+        self.backend = backend
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._store = None
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = self.backend().namespace(self.namespace,
+                self.maxsize, self.ttl)
+        return self._store
+
+    def reset(self):
+        """Take the backend from the provider again on next use."""
+        self._store = None
+
+    def get(self, key:Hashable, default:Any=None) -> Any:
+        return self.store.get(key, default)
+
+    def version(self, key:Hashable) -> int:
+        return self.store.version(key)
+
+    def set(self, key:Hashable, value:Any, ttl:Optional[float]=None,
+            version:Optional[int]=None):
+        self.store.set(key, value, ttl=ttl, version=version)
+
+    def invalidate(self, key:Hashable):
+        self.store.invalidate(key)
+
+    def clear(self):
+        self.store.clear()
+
+    def stats(self) -> dict:
+        return self.store.stats()
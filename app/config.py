@@ -3,9 +3,36 @@ from typing import Any, Dict, List, Optional, Union
 from pydantic import AnyHttpUrl, BaseSettings, EmailStr, PostgresDsn, validator, ValidationError, AnyUrl
 
 
+def async_database_uri(uri:str) -> str:
+    """The asyncio driver URI of a database URI."""
+    scheme, sep, rest = uri.partition("://")
+    drivers = {
+        "sqlite": "sqlite+aiosqlite",
+        "postgres": "postgresql+asyncpg",
+        "postgresql": "postgresql+asyncpg",
+        "mysql": "mysql+aiomysql",
+    }
+    return drivers.get(scheme.split("+")[0], scheme) + sep + rest
+
+
 class Settings(BaseSettings):
     DEBUG: bool = False
     LOG_SQL: bool = False
+    # Per-request SQL instrumentation: query count and time of each request in
+    # a Server-Timing header, statements slower than SQL_SLOW_QUERY_SECONDS
+    # logged with their route, and statements executed
+    # SQL_REPEATED_QUERY_THRESHOLD times or more in one request logged as
+    # likely N+1 queries. The Server-Timing header reveals database timings to
+    # clients, so it defaults to DEBUG.
+    SQL_INSTRUMENTATION: bool = True
+    SQL_SERVER_TIMING: Optional[bool] = None
+    SQL_SLOW_QUERY_SECONDS: float = 0.1
+    SQL_REPEATED_QUERY_THRESHOLD: int = 10
+
+    @validator("SQL_SERVER_TIMING", always=True)
+    def default_sql_server_timing(cls, v: Optional[bool], values: Dict[str, Any]) -> bool:
+        return values.get("DEBUG", False) if v is None else v
+
     MOCK_CLASSIFIERS: bool = False
     API_V1_STR: str = "/api/v1"
     SECRET_KEY: str = secrets.token_urlsafe(32)
@@ -13,6 +40,10 @@ class Settings(BaseSettings):
     SESSION_COOKIE: str = 'session'
     SESSION_EXPIRE_SECONDS: int = 60 * 60 * 24 * 10
     SESSION_SAME_SITE: str = 'lax' # lax, strict, or none
+    # cookie: the whole session in a signed cookie. memory, sql or sqlite:
+    # server side, with only the session id in the cookie.
+    SESSION_BACKEND: str = 'cookie'
+    SESSION_SQLITE_PATH: str = 'sessions.sqlite' # for the sqlite backend
     # ACCESS_TOKEN_EXPIRE_MINUTES: int = 30 # 60 * 24 * 8
     SERVER_NAME: str
     SERVER_HOST: AnyHttpUrl = 'http://localhost:8000'
@@ -36,6 +67,38 @@ class Settings(BaseSettings):
     # not other DSN types. We want to at least support sqlite here, so just
     # making this a non-validated string for now.
     SQLALCHEMY_DATABASE_URI: str = None
+    # asyncio driver URI. Derived from SQLALCHEMY_DATABASE_URI if not set.
+    SQLALCHEMY_ASYNC_DATABASE_URI: str = None # type: ignore # set by the validator
+
+    @validator("SQLALCHEMY_ASYNC_DATABASE_URI", always=True)
+    def assemble_async_database_uri(cls, v: Optional[str], values: Dict[str, Any]) -> Optional[str]:
+        if v or not values.get("SQLALCHEMY_DATABASE_URI"):
+            return v
+        return async_database_uri(values["SQLALCHEMY_DATABASE_URI"])
+
+    # Read replicas, see containers.RoutingSession. Only the SELECTs of ORM
+    # methods decorated with orm.db.replica_reads go to a replica, chosen by
+    # round_robin or least_connections, and not within
+    # SQLALCHEMY_READ_YOUR_WRITES_SECONDS after a commit that wrote.
+    SQLALCHEMY_REPLICA_URIS: List[str] = []
+    SQLALCHEMY_REPLICA_BALANCING: str = 'round_robin'
+    SQLALCHEMY_READ_YOUR_WRITES_SECONDS: float = 5
+
+    # Connection pool. Not applied to sqlite, which uses SQLAlchemy's
+    # default sqlite pools.
+    SQLALCHEMY_POOL_SIZE: int = 5
+    SQLALCHEMY_MAX_OVERFLOW: int = 10
+    SQLALCHEMY_POOL_TIMEOUT: float = 30 # seconds to wait for a connection
+    SQLALCHEMY_POOL_RECYCLE: int = -1 # seconds; -1 to never recycle
+    # always: ping on every checkout. on_error: ping only for
+    # SQLALCHEMY_POOL_PRE_PING_WINDOW_SECONDS after a disconnect error.
+    # never: rely on disconnect detection alone.
+    SQLALCHEMY_POOL_PRE_PING: str = 'on_error'
+    SQLALCHEMY_POOL_PRE_PING_WINDOW_SECONDS: int = 60
+
+    # Share one session per engine across each request. See
+    # containers.RequestSessions.
+    REQUEST_SCOPED_DB_SESSIONS: bool = True
 
     SMTP_TLS: bool = True
     SMTP_PORT: Optional[int] = None
@@ -48,6 +111,20 @@ class Settings(BaseSettings):
     # OAUTH
     OAUTH2_ACCESS_TOKEN_TIMEOUT_SECONDS: int = 30 # 300
     OAUTH2_REFRESH_TOKEN_TIMEOUT_SECONDS: int = 600
+    OAUTH2_TOKEN_CACHE_SIZE: int = 10000 # max bearer tokens cached per process
+    OAUTH2_TOKEN_BATCH_MAX_SIZE: int = 1000 # tokens per batch request
+    # Keys generated per batch by auth.create_random_key. 0 generates each
+    # key on its own.
+    RANDOM_KEY_POOL_SIZE: int = 256
+    # opaque: random access tokens validated against the database
+    # jwt: signed self-encoded access tokens validated by signature
+    OAUTH2_ACCESS_TOKEN_FORMAT: str = 'opaque'
+    OAUTH2_REVOCATION_REFRESH_SECONDS: int = 15 # jwt mode revocation list
+    # Expired and revoked token reaper
+    OAUTH2_TOKEN_REAPER_ENABLED: bool = True # run as a startup task
+    OAUTH2_TOKEN_REAPER_INTERVAL_SECONDS: int = 300 # between sweeps
+    OAUTH2_TOKEN_REAPER_BATCH_SIZE: int = 1000 # tokens deleted per batch
+    OAUTH2_TOKEN_REAPER_BATCHES_PER_SECOND: float = 5 # rate limit, 0 for none
 
     @validator("EMAILS_FROM_NAME")
     def get_project_name(cls, v: Optional[str], values: Dict[str, Any]) -> str:
@@ -55,6 +132,12 @@ class Settings(BaseSettings):
             return values["PROJECT_NAME"]
         return v
 
+    # Password hashing executor. bcrypt releases the GIL, so threads are
+    # usually sufficient; use process for CPU isolation from the workers.
+    PASSWORD_HASH_EXECUTOR: str = 'thread' # thread or process
+    PASSWORD_HASH_WORKERS: Optional[int] = None # defaults to cpu count
+    PASSWORD_HASH_QUEUE_LIMIT: int = 64 # max in-flight hashes per process
+
     EMAIL_RESET_TOKEN_EXPIRE_HOURS: int = 48
     EMAIL_TEMPLATES_DIR: str = "templates/email"
     EMAILS_ENABLED: bool = False
@@ -69,6 +152,55 @@ class Settings(BaseSettings):
 
     EMAIL_TEST_USER: EmailStr = "test@example.com"  # type: ignore
     USERS_OPEN_REGISTRATION: bool = False
+    USER_CACHE_SIZE: int = 10000 # max users cached per process
+    USER_CACHE_TTL_SECONDS: int = 300 # bounds staleness from other processes
+    # Backend of the user and token caches, see app.cache.Cache. memory:
+    # per-process LRU. mmap: a table in CACHE_MMAP_PATH shared by the
+    # processes of a host. redis: shared, requires the redis package.
+    CACHE_BACKEND: str = 'memory'
+    CACHE_REDIS_URL: str = 'redis://localhost:6379/0'
+    CACHE_MMAP_PATH: str = 'cache.mmap' # for the mmap backend
+    CACHE_MMAP_SLOTS: int = 16384
+    CACHE_MMAP_SLOT_BYTES: int = 4096 # larger values are not cached (mmap)
+    # Rendered page cache. memory: per-process LRU. redis: shared, requires
+    # the redis package.
+    RESPONSE_CACHE_BACKEND: str = 'memory'
+    RESPONSE_CACHE_SIZE: int = 1000 # max pages cached per process (memory)
+    RESPONSE_CACHE_TTL_SECONDS: int = 60
+    RESPONSE_CACHE_REDIS_URL: str = 'redis://localhost:6379/0'
+    FRAGMENT_CACHE_SIZE: int = 1000 # max template fragments per process
+    # API response validation. always: validate every response and respond
+    # 500 to invalid ones (use in development and tests). sample: validate
+    # API_RESPONSE_VALIDATION_SAMPLE_RATE of responses and only log invalid
+    # ones; streamed responses are not validated. never: do not validate
+    # responses. Defaults to always with DEBUG, otherwise sample.
+    API_RESPONSE_VALIDATION: str = None # type: ignore # set by the validator
+    API_RESPONSE_VALIDATION_SAMPLE_RATE: float = 0.01
+
+    @validator("API_RESPONSE_VALIDATION", always=True)
+    def default_api_response_validation(cls, v: Optional[str], values: Dict[str, Any]) -> str:
+        if v is None:
+            return 'always' if values.get("DEBUG", False) else 'sample'
+        return v
+    # OpenAPI spec and redoc page, encoded once and served with an ETag.
+    # OPENAPI_SPEC_FILE: spec prebuilt with `tools openapi`, instead of
+    # generating it at startup.
+    OPENAPI_SPEC_FILE: Optional[str] = None
+    API_DOCS_MAX_AGE_SECONDS: int = 60 * 60 * 24
+    # API rate limits, see starletteframework.ratelimit. memory: per-process
+    # buckets. redis: shared, requires the redis package. Clients may
+    # override the per-client limit with their rate_limit_* columns.
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: str = 'memory'
+    RATE_LIMIT_SIZE: int = 100000 # max buckets per process (memory)
+    RATE_LIMIT_REDIS_URL: str = 'redis://localhost:6379/0'
+    RATE_LIMIT_PER_MINUTE: int = 600 # per client or session user
+    RATE_LIMIT_BURST: int = 100
+    RATE_LIMIT_IP_PER_MINUTE: int = 60 # token endpoints and anonymous requests
+    RATE_LIMIT_IP_BURST: int = 20
+    # all requests of an address, before authentication
+    RATE_LIMIT_ADDRESS_PER_MINUTE: int = 1200
+    RATE_LIMIT_ADDRESS_BURST: int = 200
     DOCSET: str = 'full' # some docs are flagged only to show in full mode
 
     class Config:
@@ -1,16 +1,242 @@
-from typing import Generator
+import itertools
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Dict, Generator, List, Optional, Tuple
 from dependency_injector import containers, providers
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.orm.scoping import scoped_session
-from sqlalchemy import create_engine
-from .config import settings
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from . import cache
+from .config import async_database_uri, settings
+from .metrics import PoolMetrics
 
 
-### SQLAlchemy sessions ###
+### SQLAlchemy engines ###
+
+PRE_PING_STRATEGIES = ('always', 'on_error', 'never')
+if settings.SQLALCHEMY_POOL_PRE_PING not in PRE_PING_STRATEGIES:
+    raise ValueError(
+        f'Invalid pre-ping strategy: {settings.SQLALCHEMY_POOL_PRE_PING}')
+
+"""
+Pool telemetry. See PoolMetrics.snapshot and the admin pool metrics view.
+"""
+pool_metrics = {
+    'sync': PoolMetrics(),
+    'async': PoolMetrics(),
+}
+
+
+def pool_options(uri:str, metrics:PoolMetrics, pool_class) -> dict:
+    """Engine pool arguments from settings. sqlite keeps its default pool."""
+    options:Dict[str, Any] = {
+        'pool_pre_ping': settings.SQLALCHEMY_POOL_PRE_PING == 'always',
+    }
+    if uri.startswith('sqlite'):
+        return options
+    options.update({
+        'poolclass': metrics.pool_class(pool_class),
+        'pool_size': settings.SQLALCHEMY_POOL_SIZE,
+        'max_overflow': settings.SQLALCHEMY_MAX_OVERFLOW,
+        'pool_timeout': settings.SQLALCHEMY_POOL_TIMEOUT,
+        'pool_recycle': settings.SQLALCHEMY_POOL_RECYCLE,
+    })
+    return options
+
+
+def ping_after_disconnect(sync_engine, window:float):
+    """Pre-ping checked out connections for window seconds after a
+    disconnect error, instead of on every checkout.
+
+    On a disconnect, SQLAlchemy invalidates the connection and the pool's
+    older connections. Pinging for a while afterwards catches connections
+    that were dropped in the same outage (e.g. a database restart) before a
+    query fails on them. A failed ping makes the pool retry the checkout with
+    a new connection.
+    """
+    ping_until = 0.0
+
+    @event.listens_for(sync_engine, 'handle_error')
+    def receive_handle_error(context):
+        nonlocal ping_until
+        if context.is_disconnect:
+            ping_until = time.monotonic() + window
+
+    @event.listens_for(sync_engine, 'checkout')
+    def receive_checkout(dbapi_connection, connection_record, connection_proxy):
+        if time.monotonic() >= ping_until:
+            return
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute('SELECT 1')
+        except Exception as e:
+            raise exc.DisconnectionError() from e
+        finally:
+            cursor.close()
+
+
+### Read replicas ###
+
+"""
+With SQLALCHEMY_REPLICA_URIS set, sessions are RoutingSessions, which send
+the SELECTs of ORM methods decorated with orm.db.replica_reads to a replica
+engine. Everything else goes to the primary engine: writes, locking reads,
+reads in a transaction that has written, and all reads for
+SQLALCHEMY_READ_YOUR_WRITES_SECONDS after a commit that wrote, in the current
+request (and the next requests with the same credentials, see
+DBSessionMiddleware) or, outside of a request, the current context.
+"""
+BALANCING_STRATEGIES = ('round_robin', 'least_connections')
+if settings.SQLALCHEMY_REPLICA_BALANCING not in BALANCING_STRATEGIES:
+    raise ValueError(
+        f'Invalid replica balancing: {settings.SQLALCHEMY_REPLICA_BALANCING}')
+
+
+class ReplicaSet():
+    """Replica engines, chosen by round robin or by the fewest connections
+    checked out.
+
+    engines: sync engines (for async engines, their sync_engine)
+    """
+
+    def __init__(self, engines:List, strategy:str='round_robin'):
+        self.engines = engines
+        self.strategy = strategy
+        self.checked_out = {engine: 0 for engine in engines}
+        self._cycle = itertools.cycle(engines)
+        for engine in engines:
+            self._count_connections(engine)
+
+    def _count_connections(self, engine):
+        @event.listens_for(engine, 'checkout')
+        def receive_checkout(dbapi_connection, connection_record,
+                connection_proxy):
+            self.checked_out[engine] += 1
+
+        @event.listens_for(engine, 'checkin')
+        def receive_checkin(dbapi_connection, connection_record):
+            self.checked_out[engine] -= 1
+
+    def choose(self):
+        """The engine for the next read."""
+        if self.strategy == 'least_connections':
+            return min(self.engines, key=self.checked_out.__getitem__)
+        return next(self._cycle)
+
+
+read_replica:ContextVar[bool] = ContextVar('read_replica', default=False)
+primary_until:ContextVar[float] = ContextVar('primary_until', default=0.0)
+
 
-# async not generally available yet. Watch for SQLAlchemy v1.4 or v2.0
-#from sqlalchemy.ext.asyncio import create_async_engine
-#from sqlalchemy.ext.asyncio import AsyncSession
+def pin_primary():
+    """Send reads to the primary for SQLALCHEMY_READ_YOUR_WRITES_SECONDS."""
+    until = time.monotonic() + settings.SQLALCHEMY_READ_YOUR_WRITES_SECONDS
+    scope = request_sessions.get()
+    if scope is not None:
+        scope.primary_until = until
+    else:
+        primary_until.set(until)
+
+
+def primary_pinned() -> bool:
+    """True if reads must go to the primary after a recent write."""
+    scope = request_sessions.get()
+    until = scope.primary_until if scope is not None else primary_until.get()
+    return until > time.monotonic()
+
+
+class RoutingSession(Session):
+    """Session that sends replica_reads SELECTs to a replica. The replica is
+    chosen once per transaction, so that its reads are consistent.
+
+    replicas: ReplicaSet to read from, or None to use only the primary
+    """
+
+    def __init__(self, *args, replicas:Optional[ReplicaSet]=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replicas = replicas
+        self._replica = None
+        self._wrote = False
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or clause is not None and not clause.is_select:
+            self._wrote = True
+        elif self.replicas is not None and clause is not None \
+                and read_replica.get() and not self._wrote \
+                and clause._for_update_arg is None and not primary_pinned():
+            if self._replica is None:
+                self._replica = self.replicas.choose()
+            return self._replica
+        return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+    def _end_transaction(self):
+        self._replica = None
+        self._wrote = False
+
+    def commit(self):
+        super().commit()
+        if self._wrote:
+            pin_primary()
+        self._end_transaction()
+
+    def rollback(self):
+        super().rollback()
+        self._end_transaction()
+
+    def close(self):
+        super().close()
+        self._end_transaction()
+
+
+class RoutingAsyncSession(AsyncSession):
+    """AsyncSession proxying a RoutingSession. AsyncSession.__init__ always
+    creates a plain Session, so it is not called; this sets up the same
+    attributes with a RoutingSession instead.
+    """
+
+    def __init__(self, bind=None, replicas:Optional[ReplicaSet]=None, # pylint:disable=super-init-not-called
+            **kwargs):
+        self.bind = bind
+        self.sync_session = self._proxied = RoutingSession(
+            bind=bind.sync_engine, replicas=replicas, future=True, **kwargs)
+
+
+replica_metrics = [{'sync': PoolMetrics(), 'async': PoolMetrics()}
+    for uri in settings.SQLALCHEMY_REPLICA_URIS]
+replica_engines = [
+    create_engine(uri, echo=settings.LOG_SQL, future=True,
+        **pool_options(uri, metrics['sync'], QueuePool))
+    for uri, metrics in zip(settings.SQLALCHEMY_REPLICA_URIS, replica_metrics)
+]
+async_replica_engines = [
+    create_async_engine(async_database_uri(uri), echo=settings.LOG_SQL,
+        **pool_options(uri, metrics['async'], AsyncAdaptedQueuePool))
+    for uri, metrics in zip(settings.SQLALCHEMY_REPLICA_URIS, replica_metrics)
+]
+for metrics, _engine, _async_engine in zip(replica_metrics, replica_engines,
+        async_replica_engines):
+    metrics['sync'].listen(_engine)
+    metrics['async'].listen(_async_engine.sync_engine)
+if settings.SQLALCHEMY_POOL_PRE_PING == 'on_error':
+    for _engine in replica_engines + [
+            e.sync_engine for e in async_replica_engines]:
+        ping_after_disconnect(_engine,
+            settings.SQLALCHEMY_POOL_PRE_PING_WINDOW_SECONDS)
+replicas = async_replicas = None
+if replica_engines:
+    replicas = ReplicaSet(replica_engines,
+        settings.SQLALCHEMY_REPLICA_BALANCING)
+    async_replicas = ReplicaSet(
+        [e.sync_engine for e in async_replica_engines],
+        settings.SQLALCHEMY_REPLICA_BALANCING)
+
+
+### SQLAlchemy sessions ###
 
 """
 Use scope_session for thread-local scoping to avoid session leaks.
@@ -19,30 +245,260 @@ engine = create_engine(
     settings.SQLALCHEMY_DATABASE_URI,
     echo=settings.LOG_SQL,
     future=True, # SQLAlchemy 2.0 compatibility
-    pool_pre_ping=True)
+    **pool_options(settings.SQLALCHEMY_DATABASE_URI,
+        pool_metrics['sync'], QueuePool))
 SessionLocal = sessionmaker(
-    autocommit=False, autoflush=False, bind=engine, expire_on_commit=False)
+    autocommit=False, autoflush=False, bind=engine, expire_on_commit=False,
+    **({'class_': RoutingSession, 'replicas': replicas} if replicas else {}))
 #SessionLocal = scoped_session(sessionmaker(
 #    autocommit=False, autoflush=False, bind=engine, expire_on_commit=False))
 
 
+"""
+Asyncio engine and sessions for use from async views, so that queries do not
+block the event loop. As with SessionLocal, expire_on_commit=False keeps
+returned objects usable after the session is closed. Note that lazy loading
+of relationships is not available on async sessions; load what is needed in
+the query.
+"""
+async_engine = create_async_engine(
+    settings.SQLALCHEMY_ASYNC_DATABASE_URI,
+    echo=settings.LOG_SQL,
+    **pool_options(settings.SQLALCHEMY_ASYNC_DATABASE_URI,
+        pool_metrics['async'], AsyncAdaptedQueuePool))
+
+pool_metrics['sync'].listen(engine)
+pool_metrics['async'].listen(async_engine.sync_engine)
+if settings.SQLALCHEMY_POOL_PRE_PING == 'on_error':
+    for _engine in (engine, async_engine.sync_engine):
+        ping_after_disconnect(_engine,
+            settings.SQLALCHEMY_POOL_PRE_PING_WINDOW_SECONDS)
+
+
+def pool_stats() -> dict:
+    """Pool metrics and current pool state for the sync and async engines,
+    and for those of each read replica.
+    """
+    stats:Dict[str, Any] = {
+        'sync': pool_metrics['sync'].snapshot(engine.pool),
+        'async': pool_metrics['async'].snapshot(async_engine.sync_engine.pool),
+    }
+    if replica_engines:
+        stats['replicas'] = [{
+            'sync': metrics['sync'].snapshot(_engine.pool),
+            'async': metrics['async'].snapshot(_async_engine.sync_engine.pool),
+        } for metrics, _engine, _async_engine in zip(replica_metrics,
+            replica_engines, async_replica_engines)]
+    return stats
+
+
+AsyncSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, bind=async_engine,
+    expire_on_commit=False,
+    **({'class_': RoutingAsyncSession, 'replicas': async_replicas}
+        if async_replicas else {'class_': AsyncSession}))
+
+
 """
 SQLAlchemy connection count provided for testing and debugging purposes.
+connection_count is the number of connections currently checked out of the
+sync and async pools. checkout_count is the total number of checkouts, so the
+difference across a request is the number of checkouts it made.
 """
-from sqlalchemy import event
 connection_count = 0
+checkout_count = 0
 
 
-@event.listens_for(engine, 'checkin')
 def receive_checkin(dbapi_connection, connection_record):
     global connection_count
     connection_count -= 1
 
 
-@event.listens_for(engine, 'checkout')
 def receive_checkout(dbapi_connection, connection_record, connection_proxy):
-    global connection_count
+    global connection_count, checkout_count
     connection_count += 1
+    checkout_count += 1
+
+
+all_engines = [engine, async_engine.sync_engine] + replica_engines \
+    + [e.sync_engine for e in async_replica_engines]
+for _engine in all_engines:
+    event.listen(_engine, 'checkin', receive_checkin)
+    event.listen(_engine, 'checkout', receive_checkout)
+
+
+"""
+Per-request SQL instrumentation. While a request is handled under
+starletteframework.middleware.QueryInstrumentationMiddleware, the statements
+executed on either engine are counted and timed into the request's
+RequestQueries. Statements slower than SQL_SLOW_QUERY_SECONDS are logged with
+their route, in or out of a request.
+"""
+logger = logging.getLogger(__name__)
+
+
+class RequestQueries():
+    """The SQL statements executed while handling a request.
+
+    scope: the ASGI scope of the request, which names the route in logs
+    """
+
+    def __init__(self, scope:dict):
+        self.scope = scope
+        self.count = 0
+        self.time = 0.0
+        self.statements:Counter = Counter()
+
+    @property
+    def route(self) -> str:
+        path = self.scope.get('root_path', '') + self.scope.get('path', '')
+        route = f'{self.scope.get("method")} {path}'
+        endpoint = self.scope.get('endpoint') # set by the router
+        if endpoint is not None:
+            route += f' ({getattr(endpoint, "__qualname__", endpoint)})'
+        return route
+
+    def record(self, statement:str, elapsed:float):
+        self.count += 1
+        self.time += elapsed
+        self.statements[statement] += 1
+
+    def repeated(self, threshold:int) -> List[Tuple[str, int]]:
+        """Statements executed threshold times or more, with their counts.
+        Repeats of the same statement with different parameters usually mean
+        a query in a loop (N+1) that should be a single query or a join.
+        """
+        return [(statement, n) for statement, n in self.statements.items()
+            if n >= threshold]
+
+    def server_timing(self) -> str:
+        """The Server-Timing header value."""
+        return f'db;dur={self.time * 1e3:.1f};desc="{self.count} queries"'
+
+
+request_queries:ContextVar[Optional[RequestQueries]] = ContextVar(
+    'request_queries', default=None)
+
+
+def instrument_queries(sync_engine):
+    """Time the statements executed on sync_engine into the current request's
+    RequestQueries, and log slow ones.
+    """
+
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def receive_before_cursor_execute(conn, cursor, statement, parameters,
+            context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def receive_after_cursor_execute(conn, cursor, statement, parameters,
+            context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        queries = request_queries.get()
+        if queries is not None:
+            queries.record(statement, elapsed)
+        if elapsed >= settings.SQL_SLOW_QUERY_SECONDS:
+            logger.warning('Slow query (%.1f ms) in %s: %s', elapsed * 1e3,
+                queries.route if queries is not None else 'no request',
+                statement)
+
+    @event.listens_for(sync_engine, 'handle_error')
+    def receive_handle_error(context):
+        # after_cursor_execute does not fire for failed statements
+        if context.connection is not None:
+            starts = context.connection.info.get('query_start')
+            if starts:
+                starts.pop()
+
+
+if settings.SQL_INSTRUMENTATION:
+    for _engine in all_engines:
+        instrument_queries(_engine)
+
+
+"""
+Request-scoped sessions. While a request is handled under
+starletteframework.middleware.DBSessionMiddleware, the db, closed_db and
+async_db providers all return the sessions of the current request, so that the
+auth backend, handlers and ORM calls share one session (and one pooled
+connection) per engine. The sessions are committed once, before the response
+starts, and closed when the request is done. Explicit commits in the ORM layer
+still commit as they go.
+"""
+class RequestSessions():
+    """The sync and async sessions of one request, created on first use."""
+
+    def __init__(self):
+        self._db:Optional[Session] = None
+        self._async_db:Optional[AsyncSession] = None
+        # reads go to the primary until this time.monotonic(), after a write
+        self.primary_until = 0.0
+
+    @property
+    def db(self) -> Session:
+        if self._db is None:
+            self._db = SessionLocal()
+        return self._db
+
+    @property
+    def async_db(self) -> AsyncSession:
+        if self._async_db is None:
+            self._async_db = AsyncSessionLocal()
+        return self._async_db
+
+    def owns(self, db) -> bool:
+        """True if db is one of the sessions of this request."""
+        return db is not None and db in (self._db, self._async_db)
+
+    async def commit(self):
+        if self._db is not None:
+            self._db.commit()
+        if self._async_db is not None:
+            await self._async_db.commit()
+
+    async def rollback(self):
+        if self._db is not None:
+            self._db.rollback()
+        if self._async_db is not None:
+            await self._async_db.rollback()
+
+    async def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        if self._async_db is not None:
+            await self._async_db.close()
+            self._async_db = None
+
+
+request_sessions:ContextVar[Optional[RequestSessions]] = ContextVar(
+    'request_sessions', default=None)
+
+
+def is_request_session(db) -> bool:
+    """True if db is a session of the current request, which is committed and
+    closed by the request rather than by the caller.
+    """
+    scope = request_sessions.get()
+    return scope is not None and scope.owns(db)
+
+
+def get_db() -> Session:
+    """The current request's session, or a new session outside of a request.
+    """
+    scope = request_sessions.get()
+    if scope is not None:
+        return scope.db
+    return SessionLocal()
+
+
+def get_async_db() -> AsyncSession:
+    """The current request's async session, or a new one outside of a request.
+    """
+    scope = request_sessions.get()
+    if scope is not None:
+        return scope.async_db
+    return AsyncSessionLocal()
 
 
 def get_closed_db() -> Generator:
@@ -71,6 +527,10 @@ def get_closed_db() -> Generator:
     that do not really need to be committed. Thus, a no-commit option is not
     provided.
     """
+    scope = request_sessions.get()
+    if scope is not None:
+        yield scope.db # committed and closed with the request
+        return
     db = SessionLocal()
     yield db
     db.commit()
@@ -82,8 +542,8 @@ class Container(containers.DeclarativeContainer):
     config = providers.Configuration()
 
     # Do not use this with the Closing directive
-    db = providers.Factory(
-        SessionLocal
+    db = providers.Callable(
+        get_db
     )
 
     # For use with Closing.
@@ -91,3 +551,21 @@ class Container(containers.DeclarativeContainer):
     closed_db = providers.Resource(
         get_closed_db
     )
+
+    # Provides an AsyncSession. Use via orm.db.async_session_scope or the
+    # orm.db.async_db_session decorator, which handle commit and close.
+    async_db = providers.Callable(
+        get_async_db
+    )
+
+    # Sessions for one request. Set into request_sessions by
+    # DBSessionMiddleware.
+    request_sessions = providers.Factory(
+        RequestSessions
+    )
+
+    # Backend of the app.cache.Cache namespaces (user and token caches),
+    # selected by CACHE_BACKEND. One per process.
+    cache_backend = providers.Singleton(
+        cache.get_backend
+    )
@@ -49,22 +49,32 @@ class LoginForm(CSRFForm):
         self.user = None
         super().__init__(*args, **kwargs)
 
-    def validate_password(form, field):
-        _user = User.objects.authenticate(
-            email=form.email.data,
-            password=field.data
-        )
+    async def avalidate(self):
+        """Validate the form and authenticate the user. Password verification
+        is awaited so that it does not block the event loop.
+
+        Returns the authenticated user, or None.
+        """
+        if not super().validate():
+            return None
+        try:
+            _user = await User.objects.aauthenticate(
+                email=self.email.data,
+                password=self.password.data
+            )
+        except User.HashQueueFull:
+            self.password.errors.append(
+                'Too many sign in attempts in progress. Please try again.')
+            return None
         if _user is None:
-            raise validators.ValidationError('Incorrect email or password')
+            self.password.errors.append('Incorrect email or password')
         elif not _user.is_active:
-            raise validators.ValidationError(
+            self.password.errors.append(
                 'This account has been administratively deactivated. '\
                 'Please contact technical support.')
-        form.user = _user
-
-    def validate(self):
-        super().validate()
-        return self.user   
+        else:
+            self.user = _user
+        return self.user
 
 
 class PublicUserForm(CSRFForm):
@@ -127,9 +137,23 @@ class PasswordForm(CSRFForm):
         self.user = user
         super().__init__(*args, **kwargs)
 
-    def validate_current_password(form, field):
-        if not form.user.verify_user_password(field.data):
-            raise validators.ValidationError('Incorrect password')
+    async def avalidate(self):
+        """Validate the form, including the awaited check of the current
+        password.
+        """
+        if not super().validate():
+            return False
+        try:
+            verified = await self.user.averify_user_password(
+                self.current_password.data)
+        except User.HashQueueFull:
+            self.current_password.errors.append(
+                'Too many requests in progress. Please try again.')
+            return False
+        if not verified:
+            self.current_password.errors.append('Incorrect password')
+            return False
+        return True
 
     def validate_retype_password(form, field):
         if field.data != form.new_password.data:
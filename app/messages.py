@@ -21,7 +21,8 @@ def clear_messages(request, key=None):
         key = f'messages__{key}'
     else:
         key = 'messages'
-    request.session[key]= []
+    if request.session.get(key):
+        request.session[key] = []
     return ''
 
 
@@ -31,12 +32,11 @@ def add_message(request, message, key:str=None, classes:List[str]=None):
         key = f'messages__{key}'
     else:
         key = 'messages'
-    if not key in request.session:
-        request.session[key] = []
     msg = { 'text': message }
     if classes:
         msg['class'] = ' '.join(classes)
-    request.session[key].append(msg)
+    # Reassign rather than append, so that the session is marked modified.
+    request.session[key] = request.session.get(key, []) + [msg]
 
 
 def add(*args, **kwargs):
@@ -0,0 +1,158 @@
+"""
+Lightweight in-process metrics.
+
+These are per-process counters intended for debugging, capacity planning and
+for exposing through an admin endpoint. They are not a replacement for a
+metrics system, but have no dependencies and negligible overhead.
+"""
+import bisect
+import threading
+import time
+from typing import Sequence
+
+
+# Seconds. Spans sub-millisecond cache hits through multi-second stalls.
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+    2.5, 5.0, 10.0)
+
+
+class Histogram():
+    """Fixed-bucket histogram of observed values.
+
+    buckets: sorted upper bounds. Values above the last bound are counted in
+             an overflow bucket.
+    """
+
+    def __init__(self, buckets:Sequence[float]=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value:float):
+        """Record a value."""
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, q:float) -> float:
+        """Estimate the q quantile as the upper bound of its bucket."""
+        with self._lock:
+            if not self.count:
+                return 0.0
+            rank = q * self.count
+            seen = 0
+            for i, n in enumerate(self.counts):
+                seen += n
+                if seen >= rank:
+                    return self.buckets[i] if i < len(self.buckets) \
+                        else self.max
+            return self.max
+
+    def snapshot(self) -> dict:
+        """Return the histogram as a dictionary."""
+        buckets = {str(b): n for b, n in zip(self.buckets, self.counts)}
+        buckets['+Inf'] = self.counts[-1]
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'buckets': buckets,
+        }
+
+
+class PoolMetrics():
+    """Connection pool telemetry for a SQLAlchemy engine.
+
+    Counts connects, checkouts, checkins and invalidations from the pool
+    events, and records how long checkouts take. wait is the time spent
+    waiting for a pooled connection to become available. checkout is the
+    whole checkout, including any new connection and pre-ping.
+    """
+
+    def __init__(self):
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait = Histogram()
+        self.checkout = Histogram()
+
+    def listen(self, engine):
+        """Count pool events of engine (a sync Engine)."""
+        from sqlalchemy import event
+
+        @event.listens_for(engine, 'connect')
+        def receive_connect(dbapi_connection, connection_record):
+            self.connects += 1
+
+        @event.listens_for(engine, 'checkout')
+        def receive_checkout(dbapi_connection, connection_record,
+                connection_proxy):
+            self.checkouts += 1
+
+        @event.listens_for(engine, 'checkin')
+        def receive_checkin(dbapi_connection, connection_record):
+            self.checkins += 1
+
+        @event.listens_for(engine, 'invalidate')
+        def receive_invalidate(dbapi_connection, connection_record, exception):
+            self.invalidations += 1
+
+    def pool_class(self, base):
+        """Subclass the pool class base to time connection waits and
+        checkouts into these metrics.
+        """
+        from sqlalchemy import exc
+        metrics = self
+
+        class TimedPool(base):
+
+            def connect(self):
+                start = time.perf_counter()
+                try:
+                    return super().connect()
+                finally:
+                    metrics.checkout.observe(time.perf_counter() - start)
+
+            def _do_get(self):
+                start = time.perf_counter()
+                try:
+                    return super()._do_get()
+                except exc.TimeoutError:
+                    metrics.timeouts += 1
+                    raise
+                finally:
+                    metrics.wait.observe(time.perf_counter() - start)
+
+        TimedPool.__name__ = f'Timed{base.__name__}'
+        return TimedPool
+
+    def snapshot(self, pool=None) -> dict:
+        """Return the metrics, with the current state of pool if given."""
+        data = {
+            'connects': self.connects,
+            'checkouts': self.checkouts,
+            'checkins': self.checkins,
+            'invalidations': self.invalidations,
+            'timeouts': self.timeouts,
+            'wait': self.wait.snapshot(),
+            'checkout': self.checkout.snapshot(),
+        }
+        if pool is not None:
+            data['pool'] = type(pool).__name__
+            for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+                if hasattr(pool, name):
+                    data[name] = getattr(pool, name)()
+        return data
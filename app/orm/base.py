@@ -8,15 +8,25 @@ not solve the problem of no `id` property existing on Base.
 Details about use of typing in FastAPI are here:
 https://fastapi.tiangolo.com/python-types/
 """
+import base64
 import dataclasses
-from typing import Any, Dict, Generic, List, Optional, Protocol
-from typing import Type, TypeVar, Union
-from sqlalchemy.orm import Session, declarative_base
-from sqlalchemy import exc
+import datetime
+import itertools
+import json
+import operator
+from typing import Any, ClassVar, Dict, Generic, Iterable, Iterator, List
+from typing import NamedTuple, Optional, Protocol, Sequence, Type, TypeVar
+from typing import Union
+from sqlalchemy.orm import Session, declarative_base, object_session
+from sqlalchemy import and_, exc, insert, or_, select, DateTime
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm.decl_api import DeclarativeMeta
 from dependency_injector.wiring import Provide, Closing
 import pydantic
+from .. import serialization
 from ..containers import Container
+from .db import async_db_session, replica_reads
 
 
 ModelBase = declarative_base()
@@ -30,11 +40,16 @@ class Exists(Exception):
     """Object already exists."""
 
 
+class InvalidCursor(Exception):
+    """Pagination cursor could not be decoded."""
+
+
 class ModelExceptions():
     """Exceptions mixin for models."""
 
     DoesNotExist = DoesNotExist
     Exists = Exists
+    InvalidCursor = InvalidCursor
 
 
 class DefaultSchema(pydantic.BaseModel):
@@ -50,6 +65,18 @@ class DefaultSchema(pydantic.BaseModel):
 class DataModel(ModelExceptions):
     """Subclasses should be @dataclass annotated."""
     default_schema = DefaultSchema
+    # Optional app.cache.Cache of instances keyed by id. Cached entries are
+    # invalidated when an instance is saved or deleted.
+    cache:ClassVar[Any] = None
+
+    def invalidate_cache(self, id:Any=None):
+        """Invalidate any cached copy of this instance. Pass the id if the
+        instance may be expired, e.g. after a rollback.
+        """
+        if id is None:
+            id = getattr(self, 'id', None)
+        if self.cache is not None and id:
+            self.cache.invalidate(id)
 
     def data_model(self, model=None):
         """Get the data of this instance, constructed as the specified model."""
@@ -60,22 +87,58 @@ class DataModel(ModelExceptions):
         return data
 
     def dict(self, model=None):
-        """Return the validated data as a dictionary."""
+        """Return the data as a dictionary of the specified model's fields.
+
+        Uses the compiled serializer of the model if it has one, otherwise
+        validates the data into the model. See app.serialization.
+        """
+        if model is None:
+            model = self.default_schema
+        serialize = serialization.get_serializer(type(self), model)
+        if serialize is not None:
+            return serialize(self)
         _d = self.data_model(model=model)
         return _d.dict()
 
     def json(self, model=None):
-        """Return the validated data as a JSON string."""
-        _d = self.data_model(model=model)
-        return _d.json()
+        """Return the data as a JSON string."""
+        return serialization.dumps(self.dict(model=model)).decode()
 
     def save(self, *,
             db:Session = Closing[Provide[Container.closed_db]]):
-        """Update the data in the database."""
+        """Update the data in the database. The cached copy is invalidated
+        whether or not the update succeeds. Raises Exists if the update
+        violates a unique constraint.
+        """
         if not hasattr(self, 'id') or not self.id:
             raise Exception('Unable to save model without id')
-        db.add(self)
-        db.commit()
+        id = self.id
+        try:
+            db.add(self)
+            db.commit()
+        except exc.IntegrityError as e:
+            db.rollback()
+            raise self.Exists from e
+        finally:
+            self.invalidate_cache(id)
+        detach(self)
+        return self
+
+    @async_db_session
+    async def asave(self, *, db:AsyncSession):
+        """Awaitable save."""
+        if not hasattr(self, 'id') or not self.id:
+            raise Exception('Unable to save model without id')
+        id = self.id
+        try:
+            db.add(self)
+            await db.commit()
+        except exc.IntegrityError as e:
+            await db.rollback()
+            raise self.Exists from e
+        finally:
+            self.invalidate_cache(id)
+        detach(self)
         return self
 
 ModelTypeVar = TypeVar("ModelTypeVar", bound=DeclarativeMeta, covariant=True)
@@ -83,6 +146,9 @@ ModelTypeVar = TypeVar("ModelTypeVar", bound=DeclarativeMeta, covariant=True)
 class ModelTypeInterface(Protocol[ModelTypeVar]):
     """Interface for ModelType."""
     id:int
+    __table__:Any
+    cache:Any
+    Exists:Type[Exception]
 
 ModelType = TypeVar("ModelType", bound=ModelTypeInterface)
 
@@ -93,6 +159,131 @@ UpdateSchemaType = TypeVar(
     "UpdateSchemaType", bound=pydantic.BaseModel)
 
 
+class Page(NamedTuple):
+    """A page of results from keyset pagination.
+
+    next_cursor is None on the last page.
+    """
+    items: List[Any]
+    next_cursor: Optional[str]
+
+
+def encode_cursor(values:List[Any]) -> str:
+    """Encode keyset values as an opaque, URL safe cursor."""
+    values = [v.isoformat() if isinstance(v, datetime.datetime) else v
+        for v in values]
+    data = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def _cursor_value(column, value):
+    """Convert a decoded cursor value to the python type of column. Raises
+    ValueError if it is not a value of the column.
+    """
+    if value is None:
+        if column.nullable:
+            return None
+        raise ValueError(value)
+    if isinstance(column.type, DateTime):
+        if not isinstance(value, str):
+            raise ValueError(value)
+        return datetime.datetime.fromisoformat(value)
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type is float and isinstance(value, int) \
+            and not isinstance(value, bool):
+        return float(value)
+    # bool is an int, but not a valid value of an integer column
+    if not isinstance(value, python_type) \
+            or isinstance(value, bool) and python_type is not bool:
+        raise ValueError(value)
+    return value
+
+
+def decode_cursor(cursor:str, columns:List[Any]) -> List[Any]:
+    """Decode a cursor created by encode_cursor for the given columns.
+    Raises InvalidCursor if it is malformed or its values do not match the
+    types of the columns.
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(data)
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError(cursor)
+        return [_cursor_value(c, v) for c, v in zip(columns, values)]
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(cursor) from e
+
+
+class Conflict(NamedTuple):
+    """A row rejected by a bulk operation.
+
+    position: index of the row in the input
+    """
+    position: int
+    row: Dict[str, Any]
+    error: str
+
+
+@dataclasses.dataclass
+class BulkResult():
+    """Result of a bulk operation."""
+    written: int = 0
+    conflicts: List[Conflict] = dataclasses.field(default_factory=list)
+
+
+def _last_by_key(positions, chunk, key, conflicts):
+    """Keep the last row of a chunk for each key, reporting earlier rows with
+    the same key as conflicts. Returns the positions and rows kept.
+    """
+    last = {key(row): i for i, row in enumerate(chunk)}
+    if len(last) == len(chunk):
+        return positions, chunk
+    kept = []
+    for i, row in enumerate(chunk):
+        if last[key(row)] == i:
+            kept.append((positions[i], row))
+        else:
+            conflicts.append(Conflict(positions[i], row,
+                f'duplicate of row {positions[last[key(row)]]}'))
+    return [i for i, row in kept], [row for i, row in kept]
+
+
+def _rowcount(cursor, default:int) -> int:
+    """Rows affected by a statement, or default if the driver does not report
+    it for executemany (e.g. psycopg2 in 'batch' executemany mode).
+    """
+    if default == 1 or cursor.supports_sane_multi_rowcount():
+        return cursor.rowcount
+    return default
+
+
+def detach(*objs):
+    """Expunge objects from the session that holds them, if any.
+
+    Sessions may live for a whole request, so objects that are shared beyond
+    it (e.g. cached) are detached first. Loaded attributes remain usable since
+    sessions do not expire on commit.
+    """
+    for obj in objs:
+        if obj is not None:
+            db = object_session(obj)
+            if db is not None:
+                db.expunge(obj)
+
+
+def iter_chunks(iterable:Iterable[Any], size:int) -> Iterator[List[Any]]:
+    """Yield lists of up to size items from iterable."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
 class CRUDManager(Generic[ModelType]):
     """Basic CRUD management."""
 
@@ -105,12 +296,14 @@ class CRUDManager(Generic[ModelType]):
         """
         self.model = model
 
+    @replica_reads(primary_on_miss=True)
     def get(self, id:Any,
             *, db:Session = Closing[Provide[Container.closed_db]]
     ) -> Optional[ModelType]:
         """Get an instance of ModelType by id."""
         return db.query(self.model).filter(self.model.id == id).first()
 
+    @replica_reads
     def fetch(
             self, *, skip:int = 0, limit:int = 100,
             db:Session = Closing[Provide[Container.closed_db]]
@@ -122,6 +315,56 @@ class CRUDManager(Generic[ModelType]):
         """
         return db.query(self.model).offset(skip).limit(limit).all()
 
+    @replica_reads
+    def paginate(
+            self, *, cursor:Optional[str] = None, limit:int = 100,
+            order_by=None, where=None,
+            db:Session = Closing[Provide[Container.closed_db]]
+        ) -> Page:
+        """Get a page of instances of ModelType using keyset pagination.
+
+        Rather than an offset, the query seeks past the last row of the
+        previous page, so every page costs the same as the first.
+
+        cursor: next_cursor of the previous Page, or None for the first page
+        limit: maximum number of items to return
+        order_by: an indexed column to order by. Defaults to the primary key.
+                  Ties are broken by the primary key.
+        where: optional list of filter criteria
+        """
+        stmt, columns = self._page_statement(cursor, limit, order_by, where)
+        items = db.execute(stmt).scalars().all()
+        return self._page(items, limit, columns)
+
+    def _page_statement(self, cursor, limit, order_by, where):
+        pk = self.model.id
+        if order_by is None or order_by is pk:
+            columns = [pk]
+        else:
+            columns = [order_by, pk]
+        stmt = select(self.model)
+        if where is not None:
+            stmt = stmt.where(*where)
+        if cursor:
+            values = decode_cursor(cursor, columns)
+            if len(columns) == 1:
+                stmt = stmt.where(pk > values[0])
+            else:
+                stmt = stmt.where(or_(order_by > values[0],
+                    and_(order_by == values[0], pk > values[1])))
+        # fetch one extra row to learn whether there is a next page
+        stmt = stmt.order_by(*columns).limit(limit + 1)
+        return stmt, columns
+
+    @staticmethod
+    def _page(items, limit, columns) -> Page:
+        if len(items) <= limit:
+            return Page(items, None)
+        items = items[:limit]
+        last = items[-1]
+        return Page(items, encode_cursor(
+            [getattr(last, c.key) for c in columns]))
+
     def query(self, *, db:Session = Closing[Provide[Container.closed_db]]
         ) -> List[ModelType]:
         """Get a query of this model type
@@ -139,6 +382,90 @@ class CRUDManager(Generic[ModelType]):
             raise self.model.Exists from e
         return obj
 
+    def bulk_create(self, rows:Iterable[Dict[str, Any]], *,
+            chunk_size:int = 1000,
+            db:Session = Closing[Provide[Container.closed_db]]) -> BulkResult:
+        """Insert rows (dictionaries of column values) in chunks.
+
+        Each chunk is inserted with a single executemany INSERT (batched into
+        multi-row VALUES by drivers that support it) and committed. If a chunk
+        violates a constraint, it is retried row by row so that only the
+        offending rows are rejected and reported in BulkResult.conflicts.
+
+        Rows in a chunk must have the same keys. Python-side column defaults
+        are applied, but no ORM events fire and instances are not returned.
+        """
+        return self._bulk(insert(self.model.__table__), rows, chunk_size, db)
+
+    def bulk_upsert(self, rows:Iterable[Dict[str, Any]], *,
+            index_elements:Sequence[str] = ('id',),
+            update_columns:Optional[Sequence[str]] = None,
+            chunk_size:int = 1000,
+            db:Session = Closing[Provide[Container.closed_db]]) -> BulkResult:
+        """Insert rows, updating existing rows that conflict on
+        index_elements (which must have a unique index).
+
+        update_columns: columns to update on conflict. Defaults to all given
+                        columns other than index_elements. If empty,
+                        conflicting rows are left unchanged and are not
+                        counted in BulkResult.written.
+
+        Uses INSERT .. ON CONFLICT DO UPDATE, supported on PostgreSQL and
+        SQLite. Chunking and conflict reporting are as for bulk_create. A
+        statement cannot affect the same row twice, so if a chunk repeats a
+        key only its last row is written and the earlier ones are reported
+        as conflicts.
+        """
+        dialects = {'postgresql': postgresql, 'sqlite': sqlite}
+        dialect = dialects.get(db.get_bind().dialect.name)
+        if dialect is None:
+            raise NotImplementedError(
+                f'bulk_upsert not supported for {db.get_bind().dialect.name}')
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return BulkResult()
+        if update_columns is None:
+            update_columns = [k for k in first if k not in index_elements]
+        stmt = dialect.insert(self.model.__table__)
+        if update_columns:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=index_elements,
+                set_={c: stmt.excluded[c] for c in update_columns})
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+        result = self._bulk(stmt, itertools.chain([first], rows),
+            chunk_size, db, key=operator.itemgetter(*index_elements))
+        if self.model.cache is not None:
+            # updated ids are not known, so drop all cached instances
+            self.model.cache.clear()
+        return result
+
+    def _bulk(self, stmt, rows, chunk_size, db, key=None) -> BulkResult:
+        result = BulkResult()
+        offset = 0
+        for chunk in iter_chunks(rows, chunk_size):
+            positions = range(offset, offset + len(chunk))
+            offset += len(chunk)
+            if key is not None:
+                positions, chunk = _last_by_key(positions, chunk, key,
+                    result.conflicts)
+            try:
+                written = _rowcount(db.execute(stmt, chunk), len(chunk))
+                db.commit()
+                result.written += written
+            except exc.IntegrityError:
+                db.rollback()
+                for i, row in zip(positions, chunk):
+                    try:
+                        written = _rowcount(db.execute(stmt, [row]), 1)
+                        db.commit()
+                        result.written += written
+                    except exc.IntegrityError as e:
+                        db.rollback()
+                        result.conflicts.append(Conflict(i, row, str(e.orig)))
+        return result
+
     def delete(
             self, *, id: int,
             db:Session = Closing[Provide[Container.closed_db]]) -> ModelType:
@@ -146,4 +473,50 @@ class CRUDManager(Generic[ModelType]):
         obj = db.query(self.model).get(id)
         db.delete(obj)
         db.commit()
+        obj.invalidate_cache()
+        return obj
+
+    @replica_reads(primary_on_miss=True)
+    @async_db_session
+    async def aget(self, id:Any, *, db:AsyncSession) -> Optional[ModelType]:
+        """Awaitable get."""
+        return await db.get(self.model, id)
+
+    @replica_reads
+    @async_db_session
+    async def afetch(self, *, skip:int = 0, limit:int = 100,
+            db:AsyncSession) -> List[ModelType]:
+        """Awaitable fetch."""
+        result = await db.execute(
+            select(self.model).offset(skip).limit(limit))
+        return result.scalars().all()
+
+    @replica_reads
+    @async_db_session
+    async def apaginate(self, *, cursor:Optional[str] = None, limit:int = 100,
+            order_by=None, where=None, db:AsyncSession) -> Page:
+        """Awaitable paginate."""
+        stmt, columns = self._page_statement(cursor, limit, order_by, where)
+        result = await db.execute(stmt)
+        return self._page(result.scalars().all(), limit, columns)
+
+    @async_db_session
+    async def acreate(self, properties, *, db:AsyncSession) -> ModelType:
+        """Awaitable create."""
+        obj = self.model(**properties)
+        try:
+            db.add(obj)
+            await db.commit()
+        except exc.IntegrityError as e:
+            await db.rollback()
+            raise self.model.Exists from e
+        return obj
+
+    @async_db_session
+    async def adelete(self, *, id:int, db:AsyncSession) -> ModelType:
+        """Awaitable delete."""
+        obj = await db.get(self.model, id)
+        await db.delete(obj)
+        await db.commit()
+        obj.invalidate_cache()
         return obj
@@ -1,9 +1,13 @@
 """
 Database/db-session  management resources
 """
-from contextlib import contextmanager
+from contextlib import contextmanager, asynccontextmanager
 import functools
+import inspect
+from typing import Callable, Union
+from sqlalchemy import event
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from dependency_injector.wiring import Provide
 from .. import containers
 
@@ -15,7 +19,17 @@ def session_scope(db:Session=Provide[containers.Container.db]):
     There does not seem to be any performance penalty to not committing
     sessions that do not need to be committed. Thus, a no-commit option is not
     provided.
+
+    Within a request, db is the request's session, which is committed and
+    closed when the request is done rather than here.
     """
+    if containers.is_request_session(db):
+        try:
+            yield db
+        except:
+            db.rollback()
+            raise
+        return
     try:
         yield db
         db.commit()
@@ -26,7 +40,50 @@ def session_scope(db:Session=Provide[containers.Container.db]):
         db.close()
 
 
-# TODO: do we need async and non-async versions of this decorator?
+@asynccontextmanager
+async def async_session_scope(
+        db:AsyncSession=Provide[containers.Container.async_db]):
+    """Provides a transactional async db session scope as an async context
+    block. Commits on exit, rolls back on exceptions, and always closes.
+    Within a request, the request's session is used and left open.
+    """
+    if containers.is_request_session(db):
+        try:
+            yield db
+        except:
+            await db.rollback()
+            raise
+        return
+    try:
+        yield db
+        await db.commit()
+    except:
+        await db.rollback()
+        raise
+    finally:
+        await db.close()
+
+
+def on_commit(db:Union[Session, AsyncSession], f:Callable[[], None]):
+    """Call f after the current transaction of db commits, or not at all if
+    it rolls back. For invalidating cached copies of rows the transaction
+    changes: invalidated before the commit, they could be cached again from
+    the old rows by other requests in the meantime.
+    """
+    session = getattr(db, 'sync_session', db)
+    session.info.setdefault('on_commit', []).append(f)
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_on_commit(session):
+    for f in session.info.pop('on_commit', ()):
+        f()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_commit(session):
+    session.info.pop('on_commit', None)
+
 
 def db_session(f):
     """Provided an async Sessions or SessionLocal instance to the function as
@@ -44,3 +101,62 @@ def db_session(f):
         with session_scope() as db:
             return await f(*args, db=db, **kwargs)
     return wrapped_f
+
+
+def async_db_session(f):
+    """Provide an AsyncSession to the coroutine function as the db parameter.
+
+    Usable on async views and on async ORM methods. Implements the optional
+    session parameter pattern: if the caller passes db, that session is used
+    and the caller is responsible for commit and close. Otherwise, a session is
+    created for the call with async_session_scope, and committed and closed
+    when the function returns.
+    """
+    @functools.wraps(f)
+    async def wrapped_f(*args, db:AsyncSession=None, **kwargs):
+        if db is not None:
+            return await f(*args, db=db, **kwargs)
+        async with async_session_scope() as db:
+            return await f(*args, db=db, **kwargs)
+    return wrapped_f
+
+
+def replica_reads(f=None, *, primary_on_miss:bool=False):
+    """Allow the SELECTs of the decorated ORM method, sync or async, to go to
+    a read replica (see containers.RoutingSession). Apply below classmethod
+    and above async_db_session.
+
+    primary_on_miss: if the method returns None, call it again on the primary.
+                     For lookups of rows that may have just been written
+                     elsewhere, e.g. a token issued by another request, and
+                     not replicated yet.
+    """
+    if f is None:
+        return functools.partial(replica_reads, primary_on_miss=primary_on_miss)
+
+    if inspect.iscoroutinefunction(f):
+        @functools.wraps(f)
+        async def async_wrapped_f(*args, **kwargs):
+            token = containers.read_replica.set(True)
+            try:
+                result = await f(*args, **kwargs)
+            finally:
+                containers.read_replica.reset(token)
+            if result is None and primary_on_miss \
+                    and containers.replicas is not None:
+                result = await f(*args, **kwargs)
+            return result
+        return async_wrapped_f
+
+    @functools.wraps(f)
+    def sync_wrapped_f(*args, **kwargs):
+        token = containers.read_replica.set(True)
+        try:
+            result = f(*args, **kwargs)
+        finally:
+            containers.read_replica.reset(token)
+        if result is None and primary_on_miss \
+                and containers.replicas is not None:
+            result = f(*args, **kwargs)
+        return result
+    return sync_wrapped_f
@@ -4,17 +4,19 @@ https://docs.authlib.org/en/latest/flask/2/authorization-server.html
 import datetime
 import secrets
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from dependency_injector.wiring import Provide, Closing
 from sqlalchemy import Column, Integer, ForeignKey, String, DateTime
 from sqlalchemy.orm import relationship, Session
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import UniqueConstraint, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from . import base
 from . import user
 from . import OAUTH2_CLIENT_ID_MAX_CHARS, OAUTH2_CLIENT_SECRET_MAX_CHARS
 from . import OAUTH2_CLIENT_ID_BYTES, OAUTH2_CLIENT_SECRET_BYTES
 from ..auth import create_random_key
 from ..containers import Container
+from .db import async_db_session, replica_reads
 
 
 class InvalidOAuth2Client(Exception):
@@ -39,6 +41,10 @@ class OAuth2Client(base.ModelBase, base.DataModel):
     created_at:datetime.datetime = Column(DateTime, nullable=False,
         default=datetime.datetime.utcnow)
     secret_expires_at:datetime.datetime = Column(Integer, nullable=True)
+    # API rate limit of the client. None uses the RATE_LIMIT_PER_MINUTE and
+    # RATE_LIMIT_BURST settings. See starletteframework.ratelimit.
+    rate_limit_per_minute:Optional[int] = Column(Integer, nullable=True)
+    rate_limit_burst:Optional[int] = Column(Integer, nullable=True)
     user_id:int = Column(
         Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     user = relationship('User') # type: ignore
@@ -56,15 +62,28 @@ class OAuth2Client(base.ModelBase, base.DataModel):
 class OAuth2ClientManager(base.CRUDManager[OAuth2Client]):
     """OAuth2 API object manager."""
 
-    def create(self, properties,
-            db:Session=Closing[Provide[Container.closed_db]]) -> base.ModelType:
+    @staticmethod
+    def _with_credentials(properties):
+        """Generate client credentials not given in properties."""
         if 'client_id' not in properties:
             properties['client_id'] = create_random_key(OAUTH2_CLIENT_ID_BYTES)
         if 'client_secret' not in properties:
             properties['client_secret'] = create_random_key(OAUTH2_CLIENT_SECRET_BYTES)
+        return properties
+
+    def create(self, properties,
+            db:Session=Closing[Provide[Container.closed_db]]) -> base.ModelType:
+        properties = self._with_credentials(properties)
         return super(OAuth2ClientManager, self).create(properties, db=db)
 
+    async def acreate(self, properties, *, db:AsyncSession=None
+        ) -> base.ModelType:
+        """Awaitable create."""
+        properties = self._with_credentials(properties)
+        return await super(OAuth2ClientManager, self).acreate(properties, db=db)
+
     @classmethod
+    @replica_reads(primary_on_miss=True)
     def get_by_client_id(cls, client_id: str, *,
             db:Session=Closing[Provide[Container.closed_db]]
         ) -> Optional[OAuth2Client]:
@@ -82,6 +101,7 @@ class OAuth2ClientManager(base.CRUDManager[OAuth2Client]):
             OAuth2Client.user == user).one_or_none()
 
     @classmethod
+    @replica_reads
     def fetch_for_user(cls, user:user.User, *,
             db:Session=Closing[Provide[Container.closed_db]]
         ) -> List[OAuth2Client]:
@@ -92,16 +112,86 @@ class OAuth2ClientManager(base.CRUDManager[OAuth2Client]):
     def delete_for_user(cls, user:user.User, client_id:str, *,
             db:Session=Closing[Provide[Container.closed_db]]
         ) -> bool:
-        """Delete the specified API client."""
+        """Delete the specified API client and its tokens. The access tokens
+        are removed from the token cache once the deletion commits.
+        """
         obj = db.query(OAuth2Client).filter(
             OAuth2Client.client_id == client_id,
             OAuth2Client.user==user).one_or_none()
         if obj:
+            # oauth2token imports this module
+            from .oauth2token import OAuth2Token # pylint:disable=import-outside-toplevel
+            OAuth2Token.objects.delete_for_client(obj.id, db=db)
             db.delete(obj)
             return True
         else:
             return False
 
+    @classmethod
+    @async_db_session
+    async def aget_rate_limit(cls, id:int, *, db:AsyncSession
+        ) -> Tuple[Optional[int], Optional[int]]:
+        """The rate_limit_per_minute and rate_limit_burst of the client with
+        primary key id, or None for each if the client does not exist.
+        """
+        result = await db.execute(select(OAuth2Client.rate_limit_per_minute,
+            OAuth2Client.rate_limit_burst).where(OAuth2Client.id == id))
+        row = result.first()
+        if row is None:
+            return None, None
+        return row.rate_limit_per_minute, row.rate_limit_burst
+
+    @classmethod
+    @replica_reads(primary_on_miss=True)
+    @async_db_session
+    async def aget_by_client_id(cls, client_id: str, *, db:AsyncSession
+        ) -> Optional[OAuth2Client]:
+        """Awaitable get_by_client_id."""
+        result = await db.execute(select(OAuth2Client).where(
+            OAuth2Client.client_id == client_id))
+        return result.scalars().one_or_none()
+
+    @classmethod
+    @async_db_session
+    async def aget_for_user(cls, user:user.User, client_id: str, *,
+            db:AsyncSession) -> Optional[OAuth2Client]:
+        """Awaitable get_for_user."""
+        result = await db.execute(select(OAuth2Client).where(
+            OAuth2Client.client_id == client_id,
+            OAuth2Client.user_id == user.id))
+        return result.scalars().one_or_none()
+
+    @classmethod
+    @replica_reads
+    @async_db_session
+    async def afetch_for_user(cls, user:user.User, *, db:AsyncSession
+        ) -> List[OAuth2Client]:
+        """Awaitable fetch_for_user."""
+        result = await db.execute(select(OAuth2Client).where(
+            OAuth2Client.user_id == user.id))
+        return result.scalars().all()
+
+    async def afetch_page_for_user(self, user:user.User, *,
+            cursor:Optional[str]=None, limit:int=100, db:AsyncSession=None
+        ) -> base.Page:
+        """Get a page of the API clients for the user."""
+        return await self.apaginate(cursor=cursor, limit=limit,
+            where=[OAuth2Client.user_id == user.id], db=db)
+
+    @classmethod
+    @async_db_session
+    async def adelete_for_user(cls, user:user.User, client_id:str, *,
+            db:AsyncSession) -> bool:
+        """Awaitable delete_for_user."""
+        obj = await cls.aget_for_user(user, client_id, db=db)
+        if obj:
+            from .oauth2token import OAuth2Token # pylint:disable=import-outside-toplevel
+            await OAuth2Token.objects.adelete_for_client(obj.id, db=db)
+            await db.delete(obj)
+            return True
+        else:
+            return False
+
     @classmethod
     def exists(cls, user:user.User, name:str, *,
             db:Session=Closing[Provide[Container.closed_db]]
@@ -2,22 +2,90 @@
 https://docs.authlib.org/en/latest/flask/2/authorization-server.html
 """
 import datetime
+import functools
+import time
 from dataclasses import dataclass
-from typing import Optional
+from typing import Dict, FrozenSet, List, Optional, Tuple
 from dependency_injector.wiring import Provide, Closing
 from sqlalchemy import Column, Integer, ForeignKey, String, DateTime, Text, Boolean
-from sqlalchemy.orm import relationship, Session
+from sqlalchemy import Index, and_, delete, insert, or_, select, text, update
+from sqlalchemy.orm import joinedload, relationship, Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from . import base
 from ..containers import Container
+from .db import async_db_session, on_commit, replica_reads
 from ..schemas import oauth2token
 from . import oauth2client
+from . import user
 from . import OAUTH2_ACCESS_TOKEN_MAX_CHARS, OAUTH2_REFRESH_TOKEN_MAX_CHARS
 from . import OAUTH2_ACCESS_TOKEN_BYTES, OAUTH2_REFRESH_TOKEN_BYTES
-from ..auth import create_random_key
+from ..auth import create_random_key, create_access_token
+from ..cache import Cache
 from ..config import settings
 
 DEFAULT_ACCESS_LIFETIME = settings.OAUTH2_ACCESS_TOKEN_TIMEOUT_SECONDS,
 DEFAULT_REFRESH_LIFETIME = settings.OAUTH2_REFRESH_TOKEN_TIMEOUT_SECONDS,
+BATCH_INSERT_ROWS = 100 # rows per INSERT of batch token issuance
+
+"""
+Cache of valid tokens keyed by access token string. Entries expire at the
+token's access_token_expires_at and are explicitly invalidated once the
+refresh of a token, or the deletion of its client, commits.
+"""
+token_cache = Cache('token', Container.cache_backend,
+    maxsize=settings.OAUTH2_TOKEN_CACHE_SIZE)
+
+
+class RevocationSet():
+    """Access token ids (jti) of revoked, unexpired self-encoded tokens.
+
+    Self-encoded tokens are validated without a database query, so
+    revocation is checked against this in-memory set, which is reloaded from
+    the database at most every refresh_seconds. Tokens rotated by a refresh in
+    this process are added locally right away. Other processes learn of
+    revocations on their next reload; rotated tokens are not recorded in the
+    database, so elsewhere they remain valid until they expire, which is why
+    self-encoded access tokens should be short lived.
+    """
+
+    def __init__(self, refresh_seconds:float):
+        self.refresh_seconds = refresh_seconds
+        self._revoked:FrozenSet[str] = frozenset()
+        self._local:Dict[str, datetime.datetime] = {}
+        self._loaded_at:Optional[float] = None
+        self._loading = False
+
+    def add(self, jti:str, expires_at:datetime.datetime):
+        """Revoke jti in this process until expires_at."""
+        self._local[jti] = expires_at
+
+    @property
+    def stale(self) -> bool:
+        return self._loaded_at is None or \
+            time.monotonic() - self._loaded_at > self.refresh_seconds
+
+    async def contains(self, jti:str) -> bool:
+        """Return True if jti is revoked, reloading the set first if stale."""
+        if self.stale and not self._loading:
+            await self.areload()
+        return jti in self._revoked or jti in self._local
+
+    @async_db_session
+    async def areload(self, *, db:AsyncSession):
+        """Reload revoked token ids from the database."""
+        self._loading = True
+        try:
+            now = datetime.datetime.utcnow()
+            result = await db.execute(select(OAuth2Token.access_token).where(
+                OAuth2Token.revoked == True, # pylint:disable=singleton-comparison
+                OAuth2Token.access_token_expires_at > now))
+            self._revoked = frozenset(result.scalars().all())
+            self._local = {jti: exp for jti, exp in self._local.items()
+                if exp > now}
+            self._loaded_at = time.monotonic()
+        finally:
+            self._loading = False
+
 
 class InvalidGrantType(Exception):
     """Invalid token auth grant-type."""
@@ -40,6 +108,13 @@ class OAuth2Token(base.ModelBase, base.DataModel):
     """OAuth2 token model with access and refresh data."""
 
     __tablename__ = 'oauth2_tokens'
+    __table_args__ = (
+        # support the expired and revoked token reaper
+        Index('ix_oauth2_tokens_refresh_token_expires_at',
+            'refresh_token_expires_at'),
+        Index('ix_oauth2_tokens_revoked', 'id',
+            postgresql_where=text('revoked'), sqlite_where=text('revoked')),
+    )
 
     id:int = Column(Integer, primary_key=True)
     client_id:int = Column(
@@ -64,16 +139,69 @@ class OAuth2Token(base.ModelBase, base.DataModel):
     Revoked = Revoked # pylint:disable=invalid-name
     Expired = Expired # pylint:disable=invalid-name
 
+    @property
+    def bearer_token(self) -> str:
+        """The access token as issued to the client: the self-encoded token if
+        one was created, otherwise the opaque access token.
+        """
+        return getattr(self, 'encoded_access_token', None) or self.access_token
+
+    @classmethod
+    def from_claims(cls, claims:dict) -> 'OAuth2Token':
+        """Build a transient token from the claims of a self-encoded token
+        without a database query.
+        """
+        return cls(
+            client_id=claims['cid'],
+            access_token=claims['jti'],
+            token_type='Bearer',
+            revoked=False,
+            access_token_expires_at=datetime.datetime.utcfromtimestamp(
+                claims['exp']))
+
     def get_user(self, db:Session=Closing[Provide[Container.closed_db]]):
         """Get the user associated with this token."""
         return db.query(oauth2client.OAuth2Client).filter(
             oauth2client.OAuth2Client.id == self.client_id).first().user
 
+    @async_db_session
+    async def aget_user(self, *, db:AsyncSession):
+        """Awaitable get_user."""
+        result = await db.execute(select(user.User).join(
+            oauth2client.OAuth2Client,
+            oauth2client.OAuth2Client.user_id == user.User.id).where(
+            oauth2client.OAuth2Client.id == self.client_id))
+        return result.scalars().first()
+
+
+def is_self_encoded() -> bool:
+    """True if access tokens are issued as self-encoded (JWT) tokens."""
+    return settings.OAUTH2_ACCESS_TOKEN_FORMAT == 'jwt'
+
+
+def _self_encode(token:OAuth2Token, user_id:int):
+    """In jwt mode, sign a self-encoded access token for token. The opaque
+    access token is kept in the database as the token id (jti) for
+    revocation, and the refresh token remains opaque.
+    """
+    if is_self_encoded():
+        token.encoded_access_token = create_access_token(user_id,
+            expires_at=token.access_token_expires_at,
+            jti=token.access_token,
+            cid=token.client_id)
+
+
+def _is_postgresql(db) -> bool:
+    """True if the sync or async session db is bound to PostgreSQL."""
+    session = getattr(db, 'sync_session', db)
+    return session.get_bind().dialect.name == 'postgresql'
+
 
 class OAuth2TokenManager(base.CRUDManager[OAuth2Token]):
     """OAuth2 Token object manager."""
 
     @classmethod
+    @replica_reads(primary_on_miss=True)
     def get_by_access_token(cls, access_token: str, *,
             db:Session=Closing[Provide[Container.closed_db]]
         ) -> Optional[OAuth2Token]:
@@ -81,6 +209,68 @@ class OAuth2TokenManager(base.CRUDManager[OAuth2Token]):
         return db.query(OAuth2Token).filter(
             OAuth2Token.access_token == access_token).one_or_none()
 
+    @classmethod
+    @replica_reads(primary_on_miss=True)
+    @async_db_session
+    async def aget_by_access_token(cls, access_token: str, *,
+            db:AsyncSession) -> Optional[OAuth2Token]:
+        """Awaitable get_by_access_token. The owning client and user are
+        loaded in the same query.
+        """
+        result = await db.execute(select(OAuth2Token).options(
+            joinedload(OAuth2Token.client).joinedload(
+                oauth2client.OAuth2Client.user)).where(
+            OAuth2Token.access_token == access_token))
+        return result.scalars().one_or_none()
+
+    @classmethod
+    async def aget_cached_by_access_token(cls, access_token: str
+        ) -> Optional[OAuth2Token]:
+        """Get a token by the access token string, checking the token cache
+        before the database.
+
+        Only unrevoked, unexpired tokens are cached. Cached entries expire with
+        the access token.
+        """
+        token = token_cache.get(access_token)
+        if token is None:
+            token = await cls._aload_and_cache(access_token)
+        return token
+
+    @classmethod
+    async def _aload_and_cache(cls, access_token: str
+        ) -> Optional[OAuth2Token]:
+        token = await cls.aget_by_access_token(access_token)
+        if token is not None and token.client is None:
+            return None # the client was deleted
+        if token is not None and not token.revoked:
+            ttl = (token.access_token_expires_at
+                - datetime.datetime.utcnow()).total_seconds()
+            base.detach(token, token.client, token.client.user)
+            token_cache.set(access_token, token, ttl=ttl)
+        return token
+
+    @classmethod
+    async def aget_cached_principal(cls, access_token: str
+        ) -> Tuple[Optional[OAuth2Token], Optional[user.User]]:
+        """Get a token and the user it was issued to by the access token
+        string.
+
+        On a token cache miss, the token, client and user are loaded in a
+        single query. On a hit, the user is resolved through the user cache so
+        that changes to the user are not masked by the token cache. Either
+        way the user is a new instance, not shared with the cached token.
+        """
+        token = token_cache.get(access_token)
+        if token is not None:
+            return token, await user.User.objects.aget_cached(
+                token.client.user_id)
+        token = await cls._aload_and_cache(access_token)
+        if token is None:
+            return None, None
+        users = user.User.objects
+        return token, users.from_snapshot(users.snapshot(token.client.user))
+
     @classmethod
     def get_by_refresh_token(cls, refresh_token: str, *,
             db:Session=Closing[Provide[Container.closed_db]]
@@ -89,6 +279,16 @@ class OAuth2TokenManager(base.CRUDManager[OAuth2Token]):
         return db.query(OAuth2Token).filter(
             OAuth2Token.refresh_token == refresh_token).one_or_none()
 
+    @classmethod
+    @async_db_session
+    async def aget_by_refresh_token(cls, refresh_token: str, *,
+            db:AsyncSession) -> Optional[OAuth2Token]:
+        """Awaitable get_by_refresh_token."""
+        result = await db.execute(select(OAuth2Token).options(
+            joinedload(OAuth2Token.client)).where(
+            OAuth2Token.refresh_token == refresh_token))
+        return result.scalars().one_or_none()
+
     @classmethod
     def create_for_client(cls, grant_type, client_id, client_secret,
             scope='api', token_type=None,
@@ -149,12 +349,75 @@ class OAuth2TokenManager(base.CRUDManager[OAuth2Token]):
         if grant_type != 'client_credentials':
             raise InvalidGrantType(grant_type)
         client = oauth2client.oauth2_clients.get_by_client_id(client_id, db=db)
+        token = cls._new_token(client, client_secret, scope, token_type,
+            access_token_expires_at, refresh_token_expires_at)
+        db.add(token)
+        return token
+
+    @classmethod
+    @async_db_session
+    async def acreate_for_client(cls, grant_type, client_id, client_secret,
+            scope='api', token_type=None,
+            access_token_expires_at=None,
+            refresh_token_expires_at=None, *,
+            db:AsyncSession) -> OAuth2Token:
+        """Awaitable create_for_client."""
+        if grant_type != 'client_credentials':
+            raise InvalidGrantType(grant_type)
+        client = await oauth2client.oauth2_clients.aget_by_client_id(
+            client_id, db=db)
+        token = cls._new_token(client, client_secret, scope, token_type,
+            access_token_expires_at, refresh_token_expires_at)
+        db.add(token)
+        return token
+
+    @classmethod
+    def create_batch_for_client(cls, grant_type, client_id, client_secret,
+            count:int, scope='api', token_type=None, *,
+            db:Session=Closing[Provide[Container.closed_db]]
+        ) -> List[OAuth2Token]:
+        """Issue count tokens to one client, e.g. for a fleet of workers that
+        share the client. The client is authenticated once, and the tokens
+        are inserted with multi-row INSERTs in the caller's transaction.
+        """
+        if grant_type != 'client_credentials':
+            raise InvalidGrantType(grant_type)
+        client = oauth2client.oauth2_clients.get_by_client_id(client_id, db=db)
+        cls._authenticate(client, client_secret, scope)
+        rows = cls._batch_rows(client, scope, token_type, count)
+        for chunk in base.iter_chunks(rows, BATCH_INSERT_ROWS):
+            db.execute(insert(OAuth2Token.__table__).values(chunk))
+        return cls._batch_tokens(client, rows)
+
+    @classmethod
+    @async_db_session
+    async def acreate_batch_for_client(cls, grant_type, client_id,
+            client_secret, count:int, scope='api', token_type=None, *,
+            db:AsyncSession) -> List[OAuth2Token]:
+        """Awaitable create_batch_for_client."""
+        if grant_type != 'client_credentials':
+            raise InvalidGrantType(grant_type)
+        client = await oauth2client.oauth2_clients.aget_by_client_id(
+            client_id, db=db)
+        cls._authenticate(client, client_secret, scope)
+        rows = cls._batch_rows(client, scope, token_type, count)
+        for chunk in base.iter_chunks(rows, BATCH_INSERT_ROWS):
+            await db.execute(insert(OAuth2Token.__table__).values(chunk))
+        return cls._batch_tokens(client, rows)
+
+    @staticmethod
+    def _authenticate(client, client_secret, scope):
         if not client:
             raise oauth2client.OAuth2Client.DoesNotExist
         if not client.compare_secret(client_secret):
             raise oauth2client.OAuth2Client.InvalidOAuth2Client
         if scope != 'api':
             raise InvalidScope
+
+    @staticmethod
+    def _token_params(client, scope, token_type, access_token_expires_at=None,
+            refresh_token_expires_at=None) -> dict:
+        """Column values of a new token for client."""
         params = {
             'client_id': client.id, # for foreign key use the client object pk, not the app ID
             'token_type': token_type,
@@ -172,10 +435,40 @@ class OAuth2TokenManager(base.CRUDManager[OAuth2Token]):
                 + datetime.timedelta(seconds=refresh_lifetime)
         params['access_token_expires_at'] = access_token_expires_at
         params['refresh_token_expires_at'] = refresh_token_expires_at
-        token = OAuth2Token(**params)
-        db.add(token)
+        return params
+
+    @classmethod
+    def _new_token(cls, client, client_secret, scope, token_type,
+            access_token_expires_at, refresh_token_expires_at) -> OAuth2Token:
+        """Authenticate the client and build a new token for it."""
+        cls._authenticate(client, client_secret, scope)
+        token = OAuth2Token(**cls._token_params(client, scope, token_type,
+            access_token_expires_at, refresh_token_expires_at))
+        _self_encode(token, client.user_id)
         return token
 
+    @classmethod
+    def _batch_rows(cls, client, scope, token_type, count:int) -> List[dict]:
+        """Rows of count new tokens. Column defaults are filled in, since
+        they are not applied to multi-row INSERTs.
+        """
+        now = datetime.datetime.utcnow()
+        rows = []
+        for _ in range(count):
+            row = cls._token_params(client, scope, token_type)
+            row.update(revoked=False, created_at=now, refreshed_at=now)
+            rows.append(row)
+        return rows
+
+    @staticmethod
+    def _batch_tokens(client, rows:List[dict]) -> List[OAuth2Token]:
+        tokens = []
+        for row in rows:
+            token = OAuth2Token(**row)
+            _self_encode(token, client.user_id)
+            tokens.append(token)
+        return tokens
+
     @classmethod
     def refresh(cls, grant_type, refresh_token,
             access_lifetime=DEFAULT_ACCESS_LIFETIME,
@@ -206,26 +499,257 @@ class OAuth2TokenManager(base.CRUDManager[OAuth2Token]):
         """
         if grant_type != 'refresh_token':
             raise InvalidGrantType(grant_type)
-        token = cls.get_by_refresh_token(refresh_token, db=db)
+        now = datetime.datetime.utcnow()
+        values = cls._rotated_values(now)
+        if _is_postgresql(db):
+            row = db.execute(
+                cls._refresh_statement(refresh_token, values, now)).first()
+            if row is None:
+                cls._raise_unrefreshable(db.execute(
+                    cls._refresh_check_statement(refresh_token)).first(), now)
+            return cls._refreshed(row._mapping, values, db)
+        row = db.execute(cls._refresh_lock_statement(refresh_token)).first()
+        cls._check_refreshable(row, now)
+        result = db.execute(cls._refresh_update_statement(
+            row.id, refresh_token, values, now))
+        if result.rowcount != 1:
+            cls._raise_unrefreshable(row, now)
+        return cls._refreshed(row._mapping, values, db)
+
+    @classmethod
+    @async_db_session
+    async def arefresh(cls, grant_type, refresh_token,
+            access_lifetime=DEFAULT_ACCESS_LIFETIME,
+            refresh_lifetime=DEFAULT_REFRESH_LIFETIME, *,
+            db:AsyncSession) -> OAuth2Token:
+        """Awaitable refresh."""
+        if grant_type != 'refresh_token':
+            raise InvalidGrantType(grant_type)
+        now = datetime.datetime.utcnow()
+        values = cls._rotated_values(now)
+        if _is_postgresql(db):
+            row = (await db.execute(
+                cls._refresh_statement(refresh_token, values, now))).first()
+            if row is None:
+                cls._raise_unrefreshable((await db.execute(
+                    cls._refresh_check_statement(refresh_token))).first(), now)
+            return cls._refreshed(row._mapping, values, db)
+        row = (await db.execute(
+            cls._refresh_lock_statement(refresh_token))).first()
+        cls._check_refreshable(row, now)
+        result = await db.execute(cls._refresh_update_statement(
+            row.id, refresh_token, values, now))
+        if result.rowcount != 1:
+            cls._raise_unrefreshable(row, now)
+        return cls._refreshed(row._mapping, values, db)
+
+    """
+    Refresh is a single conditional UPDATE of the row that still has the
+    refresh token, is not revoked and has not expired, so two concurrent
+    refreshes with the same refresh token cannot both succeed: the first
+    replaces the refresh token, and the second then matches no row.
+
+    On PostgreSQL this is one statement. A CTE locks the row (FOR UPDATE) and
+    provides the old access token, which must be invalidated, and the user id
+    for self-encoded tokens, and the UPDATE returns the new row. A refresh
+    that waited on the lock re-checks the row and finds the refresh token
+    gone. Elsewhere (e.g. SQLite, which has no UPDATE ... RETURNING in this
+    SQLAlchemy version and serializes writes), the row is selected first, then
+    updated with the same conditions, and the update's row count tells
+    whether this refresh won.
+    """
+
+    @staticmethod
+    def _rotated_values(now:datetime.datetime) -> dict:
+        """New access and refresh tokens and expiry times."""
+        return {
+            'access_token': create_random_key(OAUTH2_ACCESS_TOKEN_BYTES),
+            'refresh_token': create_random_key(OAUTH2_REFRESH_TOKEN_BYTES),
+            'access_token_expires_at': now + datetime.timedelta(
+                seconds=settings.OAUTH2_ACCESS_TOKEN_TIMEOUT_SECONDS),
+            'refresh_token_expires_at': now + datetime.timedelta(
+                seconds=settings.OAUTH2_REFRESH_TOKEN_TIMEOUT_SECONDS),
+            'refreshed_at': now,
+        }
+
+    @staticmethod
+    def _refreshable(refresh_token:str, now:datetime.datetime):
+        return and_(
+            OAuth2Token.refresh_token == refresh_token,
+            OAuth2Token.revoked.isnot(True), # type: ignore[attr-defined]
+            OAuth2Token.refresh_token_expires_at > now)
+
+    @classmethod
+    def _refresh_statement(cls, refresh_token:str, values:dict,
+            now:datetime.datetime):
+        """PostgreSQL: lock, check and rotate the token in one statement."""
+        old = select(
+            OAuth2Token.id,
+            OAuth2Token.access_token.label('old_access_token'), # type: ignore[attr-defined]
+            OAuth2Token.access_token_expires_at.label('old_expires_at'), # type: ignore[attr-defined]
+            oauth2client.OAuth2Client.user_id
+        ).join(OAuth2Token.client).where(
+            cls._refreshable(refresh_token, now)
+        ).with_for_update(of=OAuth2Token).cte('old')
+        return update(OAuth2Token.__table__).where(
+            OAuth2Token.id == old.c.id).values(**values).returning(
+            *OAuth2Token.__table__.columns, old.c.old_access_token,
+            old.c.old_expires_at, old.c.user_id)
+
+    @staticmethod
+    def _refresh_check_statement(refresh_token:str):
+        """Why a token could not be refreshed."""
+        return select(OAuth2Token.revoked,
+            OAuth2Token.refresh_token_expires_at).where(
+            OAuth2Token.refresh_token == refresh_token)
+
+    @staticmethod
+    def _refresh_lock_statement(refresh_token:str):
+        """Select the token to refresh, locking it where supported."""
+        return select(
+            *OAuth2Token.__table__.columns,
+            OAuth2Token.access_token.label('old_access_token'), # type: ignore[attr-defined]
+            OAuth2Token.access_token_expires_at.label('old_expires_at'), # type: ignore[attr-defined]
+            oauth2client.OAuth2Client.user_id
+        ).join(OAuth2Token.client).where(
+            OAuth2Token.refresh_token == refresh_token
+        ).with_for_update(of=OAuth2Token)
+
+    @classmethod
+    def _refresh_update_statement(cls, token_id:int, refresh_token:str,
+            values:dict, now:datetime.datetime):
+        return update(OAuth2Token.__table__).where(
+            OAuth2Token.id == token_id,
+            cls._refreshable(refresh_token, now)
+        ).values(**values)
+
+    @classmethod
+    def _check_refreshable(cls, row, now:datetime.datetime):
+        if row is None or row.revoked or row.refresh_token_expires_at is None \
+                or row.refresh_token_expires_at <= now:
+            cls._raise_unrefreshable(row, now)
+
+    @staticmethod
+    def _raise_unrefreshable(row, now:datetime.datetime):
+        """Raise the error for a token that could not be refreshed. row has
+        its revoked and refresh_token_expires_at columns, or is None if there
+        is no token with the refresh token. A token that looks refreshable
+        was refreshed concurrently, so its refresh token no longer exists.
+        """
         # TODO: ensure scope request is not expanded
         # TODO: do we need to check client auth? requests does not include
         #       client_id or secret in a refresh request
-        if not token:
+        if row is None:
             raise OAuth2Token.DoesNotExist
-        if token.revoked:
+        if row.revoked:
             raise OAuth2Token.Revoked
-        if datetime.datetime.now() > token.refresh_token_expires_at:
+        if row.refresh_token_expires_at is None \
+                or row.refresh_token_expires_at <= now:
             raise OAuth2Token.Expired
-        token.access_token = create_random_key(OAUTH2_ACCESS_TOKEN_BYTES)
-        token.refresh_token = create_random_key(OAUTH2_REFRESH_TOKEN_BYTES)
-        access_lifetime = settings.OAUTH2_ACCESS_TOKEN_TIMEOUT_SECONDS
-        token.access_token_expires_at = datetime.datetime.utcnow() \
-                + datetime.timedelta(seconds=access_lifetime)
-        refresh_lifetime = settings.OAUTH2_REFRESH_TOKEN_TIMEOUT_SECONDS
-        token.refresh_token_expires_at = datetime.datetime.utcnow() \
-                + datetime.timedelta(seconds=refresh_lifetime)
-        db.add(token)
+        raise OAuth2Token.DoesNotExist
+
+    @classmethod
+    def _refreshed(cls, row, values:dict, db) -> OAuth2Token:
+        """Build the refreshed token from the row of the refresh statement
+        and the new values, and invalidate its old access token once the
+        refresh commits.
+        """
+        on_commit(db, functools.partial(cls._invalidate,
+            [(row['old_access_token'], row['old_expires_at'])]))
+        token = OAuth2Token(**{column.key: row[column.key]
+            for column in OAuth2Token.__table__.columns})
+        for key, value in values.items():
+            setattr(token, key, value)
+        _self_encode(token, row['user_id'])
         return token
 
+    @staticmethod
+    def _invalidate(tokens:List[Tuple[str, datetime.datetime]]):
+        """Invalidate access tokens, given with their expiry, in the token
+        cache and, for self-encoded tokens, in this process's revocation set.
+        """
+        for access_token, expires_at in tokens:
+            token_cache.invalidate(access_token)
+            if is_self_encoded():
+                revoked_tokens.add(access_token, expires_at)
+
+    @staticmethod
+    def _client_tokens_statement(client_id:int):
+        return select(OAuth2Token.access_token,
+            OAuth2Token.access_token_expires_at).where(
+            OAuth2Token.client_id == client_id)
+
+    @classmethod
+    def delete_for_client(cls, client_id:int, *,
+            db:Session=Closing[Provide[Container.closed_db]]):
+        """Delete the tokens of a client, e.g. one being deleted (the foreign
+        key cascade is not enforced on every backend), and invalidate their
+        access tokens once the current transaction of db commits.
+        """
+        tokens = db.execute(cls._client_tokens_statement(client_id)).all()
+        db.execute(delete(OAuth2Token).where(
+            OAuth2Token.client_id == client_id))
+        on_commit(db, functools.partial(cls._invalidate,
+            [tuple(row) for row in tokens]))
+
+    @classmethod
+    @async_db_session
+    async def adelete_for_client(cls, client_id:int, *, db:AsyncSession):
+        """Awaitable delete_for_client."""
+        tokens = (await db.execute(
+            cls._client_tokens_statement(client_id))).all()
+        await db.execute(delete(OAuth2Token).where(
+            OAuth2Token.client_id == client_id))
+        on_commit(db, functools.partial(cls._invalidate,
+            [tuple(row) for row in tokens]))
+
+    @staticmethod
+    def _reapable(now:datetime.datetime):
+        """Criteria for tokens that can no longer be used or refreshed."""
+        return or_(
+            OAuth2Token.refresh_token_expires_at < now,
+            OAuth2Token.revoked == True, # pylint:disable=singleton-comparison
+            and_(OAuth2Token.refresh_token_expires_at == None, # pylint:disable=singleton-comparison
+                 OAuth2Token.access_token_expires_at < now))
+
+    @classmethod
+    def reap_batch(cls, batch_size:int=1000,
+            now:Optional[datetime.datetime]=None, *,
+            db:Session=Closing[Provide[Container.closed_db]]) -> int:
+        """Delete up to batch_size expired or revoked tokens and commit.
+
+        Returns the number of tokens deleted. Ids are selected first so that
+        the delete is a bounded primary key lookup on every backend.
+        """
+        if now is None:
+            now = datetime.datetime.utcnow()
+        ids = db.execute(select(OAuth2Token.id).where(
+            cls._reapable(now)).limit(batch_size)).scalars().all()
+        if ids:
+            db.execute(delete(OAuth2Token).where(
+                OAuth2Token.id.in_(ids)), # type: ignore[attr-defined]
+                execution_options={'synchronize_session': False})
+            db.commit()
+        return len(ids)
+
+    @classmethod
+    @async_db_session
+    async def areap_batch(cls, batch_size:int=1000,
+            now:Optional[datetime.datetime]=None, *, db:AsyncSession) -> int:
+        """Awaitable reap_batch."""
+        if now is None:
+            now = datetime.datetime.utcnow()
+        result = await db.execute(select(OAuth2Token.id).where(
+            cls._reapable(now)).limit(batch_size))
+        ids = result.scalars().all()
+        if ids:
+            await db.execute(delete(OAuth2Token).where(
+                OAuth2Token.id.in_(ids)), # type: ignore[attr-defined]
+                execution_options={'synchronize_session': False})
+            await db.commit()
+        return len(ids)
+
+
 oauth2_tokens = OAuth2TokenManager(OAuth2Token)
+revoked_tokens = RevocationSet(settings.OAUTH2_REVOCATION_REFRESH_SECONDS)
 OAuth2Token.objects = oauth2_tokens
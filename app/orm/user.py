@@ -4,21 +4,41 @@ from dataclasses import dataclass
 from typing import Optional
 from dependency_injector.wiring import Closing, Provide
 from sqlalchemy import Boolean, Column, Integer, String, JSON
-from sqlalchemy.orm import Session
-from sqlalchemy import exc
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy import exc, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from . import base
 from ..auth import get_password_hash, verify_password, create_random_key
+from ..auth import password_hasher, HashQueueFull
+from ..cache import Cache
+from ..config import settings
 from ..schemas.user import UserCreate, UserUpdateRequest, UserProfileResponse
 from ..containers import Container
+from .db import async_db_session, replica_reads
 
 AUTO_PASSWORD_BYTES = 16
 
+"""
+Cache of users keyed by id, with ('email', email) keys mapping to user ids.
+Users are invalidated on save and delete.
+
+Entries are snapshots of the user's column values rather than instances, and
+each lookup builds its own instance from the snapshot, so that changes a
+request makes to its user (e.g. before a save that fails) are not seen by
+other requests.
+"""
+user_cache = Cache('user', Container.cache_backend,
+    maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL_SECONDS)
+
 @dataclass
 class User(base.ModelBase, base.DataModel):
     """User model."""
 
     __tablename__ = "users"
     default_schema = UserProfileResponse
+    cache = user_cache
+
+    HashQueueFull = HashQueueFull # pylint:disable=invalid-name
 
     id:int = Column(Integer, primary_key=True)
     full_name:str = Column(String, index=True)
@@ -45,9 +65,28 @@ class User(base.ModelBase, base.DataModel):
         else:
             return False
 
+    async def averify_user_password(self, password):
+        """Verify password in the password hashing executor."""
+        return await password_hasher.verify(password, self.hashed_password)
+
+    async def achange_password(self, current_password, new_password):
+        """Awaitable change_password."""
+        if await self.averify_user_password(current_password):
+            await self.aset_password(new_password)
+            return True
+        else:
+            return False
+
+    async def aset_password(self, password):
+        """Hash password in the password hashing executor and save."""
+        self.hashed_password = await password_hasher.hash(password)
+        await self.asave()
+
     def set_password(self, password, db=None):
         """TODO: Can we add dependency injenction instrumentation to tools so
         we don't need this janky db session handling?
+
+        Saving invalidates the cached user.
         """
         self.hashed_password = get_password_hash(password)
         if db:
@@ -60,11 +99,65 @@ class UserManager(base.CRUDManager[User]):
     """User object manager."""
 
     @classmethod
+    @replica_reads(primary_on_miss=True)
     def get_by_email(cls, email: str, *,
             db:Session = Closing[Provide[Container.closed_db]]) -> Optional[User]:
         """Get user by email address."""
         return db.query(User).filter(User.email == email).first()
 
+    @classmethod
+    @replica_reads(primary_on_miss=True)
+    @async_db_session
+    async def aget_by_email(cls, email: str, *,
+            db:AsyncSession) -> Optional[User]:
+        """Awaitable get_by_email."""
+        result = await db.execute(select(User).where(User.email == email))
+        return result.scalars().first()
+
+    @staticmethod
+    def snapshot(user:User) -> dict:
+        """The column values of user, as cached in user_cache."""
+        return {c.key: copy.deepcopy(getattr(user, c.key))
+            for c in User.__table__.columns}
+
+    @staticmethod
+    def from_snapshot(data:dict) -> User:
+        """A new detached user from a snapshot. Saving it updates only the
+        attributes changed since.
+        """
+        user = User(**copy.deepcopy(data))
+        make_transient_to_detached(user)
+        return user
+
+    async def aget_cached(self, id:int) -> Optional[User]:
+        """Get user by id, checking the user cache before the database. The
+        user is a new instance on every call.
+        """
+        data = user_cache.get(id)
+        if data is not None:
+            return self.from_snapshot(data)
+        version = user_cache.version(id)
+        user = await self.aget(id)
+        if user is not None:
+            base.detach(user)
+            user_cache.set(id, self.snapshot(user), version=version)
+        return user
+
+    async def aget_cached_by_email(self, email:str) -> Optional[User]:
+        """Get user by email address, checking the user cache before the
+        database.
+        """
+        user_id = user_cache.get(('email', email))
+        if user_id is not None:
+            user = await self.aget_cached(user_id)
+            if user is not None and user.email == email:
+                return user
+        version = user_cache.version(('email', email))
+        user = await self.aget_by_email(email)
+        if user is not None:
+            user_cache.set(('email', email), user.id, version=version)
+        return user
+
     @classmethod
     def authenticate(cls, email: str, password: str, *,
             db:Session = Closing[Provide[Container.closed_db]]) -> Optional[User]:
@@ -76,6 +169,30 @@ class UserManager(base.CRUDManager[User]):
             return None
         return user
 
+    @classmethod
+    async def aauthenticate(cls, email: str, password: str) -> Optional[User]:
+        """Awaitable authenticate. Password verification runs in the password
+        hashing executor.
+        """
+        user = await cls.aget_by_email(email)
+        if not user:
+            return None
+        if not await user.averify_user_password(password):
+            return None
+        return user
+
+    async def acreate(self, properties, *, db:AsyncSession=None
+        ) -> Optional[User]:
+        """Awaitable create. Password hashing runs in the password hashing
+        executor.
+        """
+        properties = copy.copy(properties)
+        password = properties.pop('password', None)
+        if not password:
+            password = create_random_key(AUTO_PASSWORD_BYTES)
+        properties['hashed_password'] = await password_hasher.hash(password)
+        return await super().acreate(properties, db=db)
+
     def create(self, properties, db:Session=Closing[Provide[Container.closed_db]]) -> Optional[User]:
         properties = copy.copy(properties)
         if properties.get('password'):
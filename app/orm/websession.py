@@ -0,0 +1,20 @@
+"""
+Server-side web session storage for the sql session backend. See
+starletteframework.sessions.
+"""
+import datetime
+from dataclasses import dataclass
+from sqlalchemy import Column, DateTime, String, Text
+from . import base
+
+
+@dataclass
+class WebSession(base.ModelBase):
+    """Web session data keyed by the opaque id in the session cookie."""
+
+    __tablename__ = 'web_sessions'
+
+    id:str = Column(String(64), primary_key=True)
+    data:str = Column(Text, nullable=False)
+    expires_at:datetime.datetime = Column(DateTime, nullable=False,
+        index=True)
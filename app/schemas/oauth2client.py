@@ -3,7 +3,7 @@ Schema for OAuth2 application client
 """
 import datetime
 from typing import List, Optional
-from pydantic import BaseModel, validator
+from pydantic import BaseModel
 
 
 class OAuth2ClientRequest(BaseModel):
@@ -24,23 +24,8 @@ class OAuth2ClientResponse(BaseModel):
     client_secret: str
     secret_expires_at: Optional[datetime.datetime]
 
-    @validator('created_at')
-    @classmethod
-    def serialize_created_at(cls, v):
-        """Convert the created_at field to a string."""
-        if v:
-            return v.isoformat()
-        return None
-
-    @validator('secret_expires_at')
-    @classmethod
-    def serialize_secret_expires_at(cls, v):
-        """Convert the secret_expires_at field to a string."""
-        if v:
-            return v.isoformat()
-        return None
-
 
 class OAuth2ClientListResponse(BaseModel):
     """Client list schema"""
     clients: List[OAuth2ClientResponse]
+    next_cursor: Optional[str]
@@ -3,10 +3,11 @@ Schema for OAuth2 tokens
 """
 import datetime
 from enum import Enum
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel, validator
 from ..orm.oauth2client import OAuth2Client
 from ..auth import create_random_key
+from ..config import settings
 from ..orm import OAUTH2_ACCESS_TOKEN_BYTES, OAUTH2_REFRESH_TOKEN_BYTES
 
 
@@ -23,6 +24,20 @@ class NewTokenRequest(BaseModel):
     client_secret: str
 
 
+class NewTokenBatchRequest(NewTokenRequest):
+    """Request for count tokens for one client."""
+    count: int
+
+    @validator('count')
+    @classmethod
+    def check_count(cls, v):
+        """Check that the batch size is within the limit."""
+        if 1 <= v <= settings.OAUTH2_TOKEN_BATCH_MAX_SIZE:
+            return v
+        raise ValueError('count must be between 1 and '
+            f'{settings.OAUTH2_TOKEN_BATCH_MAX_SIZE}')
+
+
 class TokenRefreshRequest(BaseModel):
     """Validate token refresh request."""
     grant_type: GrantTypes
@@ -65,6 +80,11 @@ class TokenResponse(BaseModel):
         return v
 
 
+class TokenBatchResponse(BaseModel):
+    """Tokens issued by a batch request."""
+    tokens: List[TokenResponse]
+
+
 class ScopedTokenResponse(TokenResponse):
     """
     Scope of response is required if granted scope is different from
@@ -0,0 +1,13 @@
+"""
+Schema for keyset paginated requests
+"""
+from typing import Optional
+from pydantic import BaseModel, conint
+
+
+class PageRequest(BaseModel):
+    """Page request query parameters. Pass the next_cursor of a response as
+    cursor to get the following page.
+    """
+    cursor: Optional[str]
+    limit: conint(ge=1, le=100) = 100 # type: ignore
@@ -3,7 +3,6 @@ Schema for User
 """
 from typing import Optional
 from pydantic import BaseModel, EmailStr, validator
-from ..auth import get_password_hash, create_random_key
 
 
 class UserCreate(BaseModel):
@@ -40,14 +39,15 @@ class AdministrativeUserUpdateRequest(BaseModel):
     is_superuser: bool = False
     full_name: Optional[str] = None
     password: Optional[str]
-    hashed_password: Optional[str]
 
-    @validator('hashed_password', always=True)
+    @validator('password', always=True)
     @classmethod
-    def hash_password(cls, v, values):
-        """Hash the password"""
-        if values.get('password'):
-            return get_password_hash(values['password'])
+    def check_password(cls, v):
+        """Require a password. Hashing is left to the caller, which should
+        await auth.password_hasher rather than hash on the event loop.
+        """
+        if v:
+            return v
         raise ValueError('Invalid password')
 
 
@@ -55,14 +55,13 @@ class UserPasswordUpdateRequest(BaseModel):
     """Password update schema"""
 
     password: Optional[str]
-    hashed_password: Optional[str]
 
-    @validator('hashed_password', always=True)
+    @validator('password', always=True)
     @classmethod
-    def hash_password(cls, v, values):
-        """Hash the password"""
-        if values.get('password'):
-            return get_password_hash(values['password'])
+    def check_password(cls, v):
+        """Require a password. Hashing is left to the caller."""
+        if v:
+            return v
         raise ValueError('Invalid password')
 
 
@@ -0,0 +1,111 @@
+"""
+Fast serialization of ORM objects to response schemas.
+
+DataModel.dict(model=...) used to copy every field of the object with
+dataclasses.asdict, validate the copy into the pydantic schema, and then dump
+the schema. For response schemas that only select and rename attributes, this
+is a lot of work to produce the same dictionary. compile_serializer builds a
+function, once per (model class, schema), that reads just the schema's fields
+from the object.
+
+Schemas with validators, nested models or root validators may transform
+values, and schemas that allow extra fields do not list their fields, so these
+are not compiled and continue to go through pydantic. Neither are schemas
+with a field whose type differs from that of the model's column (e.g. a
+datetime field for an integer timestamp column), which pydantic would coerce.
+
+Values are left as Python objects (e.g. datetimes), to be encoded with
+orjson. See starletteframework.responses.
+"""
+import threading
+from operator import attrgetter
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+import orjson
+from pydantic import BaseModel, Extra
+from sqlalchemy import inspect
+
+
+Serializer = Callable[[Any], Dict[str, Any]]
+
+_serializers:Dict[Tuple[type, Type[BaseModel]], Optional[Serializer]] = {}
+_lock = threading.Lock()
+
+
+def _compilable(schema:Type[BaseModel]) -> bool:
+    if schema.__config__.extra == Extra.allow:
+        return False # fields are not known in advance
+    if schema.__validators__ or schema.__pre_root_validators__ \
+            or schema.__post_root_validators__:
+        return False
+    for field in schema.__fields__.values():
+        if field.sub_fields or isinstance(field.type_, type) \
+                and issubclass(field.type_, BaseModel):
+            return False
+    return True
+
+
+def _column_types_match(cls:type, schema:Type[BaseModel]) -> bool:
+    """Whether each field of schema mapped to a column of cls accepts the
+    column's values as they are.
+    """
+    mapper = inspect(cls, raiseerr=False)
+    if mapper is None:
+        return True
+    for name, field in schema.__fields__.items():
+        column = mapper.columns.get(name)
+        if column is None or not isinstance(field.type_, type):
+            continue
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            continue
+        if not issubclass(field.type_, python_type):
+            return False
+    return True
+
+
+def compile_serializer(schema:Type[BaseModel], cls:Optional[type]=None
+        ) -> Optional[Serializer]:
+    """Build a serializer that reads the fields of schema from an object (of
+    class cls, if given) as attributes, or return None if schema cannot be
+    compiled.
+    """
+    if not _compilable(schema):
+        return None
+    if cls is not None and not _column_types_match(cls, schema):
+        return None
+    getters = []
+    for name, field in schema.__fields__.items():
+        getters.append((field.alias, attrgetter(name), field.default))
+
+    def serialize(obj) -> Dict[str, Any]:
+        data = {}
+        for key, getter, default in getters:
+            try:
+                data[key] = getter(obj)
+            except AttributeError:
+                data[key] = default
+        return data
+
+    serialize.__qualname__ = f'serialize_{schema.__name__}'
+    return serialize
+
+
+def get_serializer(cls:type, schema:Type[BaseModel]) -> Optional[Serializer]:
+    """The compiled serializer of schema for objects of class cls, or None if
+    schema is not compilable.
+    """
+    key = (cls, schema)
+    try:
+        return _serializers[key]
+    except KeyError:
+        pass
+    with _lock:
+        if key not in _serializers:
+            _serializers[key] = compile_serializer(schema, cls)
+        return _serializers[key]
+
+
+def dumps(data:Any) -> bytes:
+    """Encode data as JSON with orjson."""
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
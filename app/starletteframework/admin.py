@@ -1,8 +1,9 @@
 from starlette.authentication import requires
-from starlette.responses import RedirectResponse
+from starlette.responses import JSONResponse, RedirectResponse
 from starlette.routing import Route, Router
-from .templates import render
-from .. import messages
+from .caching import cached_response
+from .templates import render, templates
+from .. import containers, messages
 from ..auth import generate_password_reset_token
 from ..config import settings
 from ..forms import UserForm, AdminPasswordForm, UserDeleteForm
@@ -22,15 +23,20 @@ async def admin_users(request):
     if request.method == 'POST' and new_user_form.validate():
         try:
             properties = UserCreate(**new_user_form.data).dict()
-            user = User.objects.create(properties)
+            user = await User.objects.acreate(properties)
             return RedirectResponse(url=f'/admin/users/{user.id}', status_code=302)
         except User.Exists:
             new_user_form.email.errors = \
                 ['A user with that email address already exists']
-    users = User.objects.fetch()
+    try:
+        page = await User.objects.apaginate(
+            cursor=request.query_params.get('cursor'))
+    except User.InvalidCursor:
+        return RedirectResponse(url=request.url.path, status_code=302)
     return render('admin/user-list.html', {
         'form': new_user_form,
-        'users': users
+        'users': page.items,
+        'next_cursor': page.next_cursor
     })
 
 
@@ -65,7 +71,7 @@ async def admin_user(request):
                 meta={ 'csrf_context': request.session })
             valid = password_form.validate()
             if valid:
-                user.set_password(password_form.new_password.data)
+                await user.aset_password(password_form.new_password.data)
                 messages.add(request,
                     f'Password changed for user: {user.email}',
                     classes=['info'])
@@ -94,14 +100,29 @@ async def admin_user(request):
 
 
 @requires('admin_auth', status_code=403)
+@cached_response(vary=('user', 'superuser'))
 async def admin(request):
     return render('admin/admin.html', {})
 
 
+@requires('admin_auth', status_code=403)
+async def pool_metrics(request):
+    """Connection pool metrics for this worker process."""
+    return JSONResponse(containers.pool_stats())
+
+
+@requires('admin_auth', status_code=403)
+async def template_metrics(request):
+    """Template render times for this worker process."""
+    return JSONResponse(templates.stats())
+
+
 router = Router(
     routes = [
         Route('/users/{user_id:int}', admin_user, name='user', methods=['GET', 'POST']),
         Route('/users', admin_users, name='users', methods=['GET', 'POST']),
+        Route('/metrics/pool', pool_metrics, name='pool_metrics', methods=['GET']),
+        Route('/metrics/templates', template_metrics, name='template_metrics', methods=['GET']),
         Route('/', admin, name='home', methods=['GET']),
     ]
 )
@@ -7,18 +7,28 @@ from ...schemas.oauth2client import (
     OAuth2ClientResponse,
     OAuth2ClientRequest,
     OAuth2ClientListResponse)
-from ...orm.db import db_session
+from ...schemas.page import PageRequest
+from ...orm.db import async_db_session
+from ...serialization import dumps, get_serializer
+from ..responses import JSONListStreamingResponse, ORJSONResponse
 #from .routes import _api, APIMessage, APIExceptionResponse
 #from . import ValidationErrorList
+import functools
+import inspect
+import random
+from collections import namedtuple
 from typing import List
+import orjson
 from pydantic import BaseModel, validator, ValidationError
 from spectree import SpecTree
 from spectree.plugins.starlette_plugin import StarlettePlugin
 from sqlalchemy import exc
 from starlette.exceptions import HTTPException
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, StreamingResponse
 from starlette.routing import Route, Router
-from ..templates import render
+from ...config import settings
+from ..responses import StaticDocument
+from ..templates import templates
 
 
 class APIMessage(BaseModel):
@@ -51,13 +61,113 @@ exception_handlers = {
 #                         # authentication and potentially csrf
 #}
 
+# request.context of validated routes. form is the form data of the request,
+# validated with the model given to form_body.
+Context = namedtuple('Context', ['query', 'json', 'headers', 'cookies', 'form'])
+
+RESPONSE_VALIDATION_MODES = ('always', 'sample', 'never')
+
+
+def form_body(model):
+    """Validate the form data of requests to the route with model, into
+    request.context.form. SpecTree only validates JSON bodies, and the OAuth2
+    token routes take form data. Apply below _app.validate.
+    """
+    def decorator(f):
+        f.form_model = model
+        return f
+    return decorator
+
+
 class CustomPlugin(StarlettePlugin):
+    """Validate requests once, into request.context, so that handlers use the
+    parsed models rather than parsing the request again. Responses are
+    validated according to API_RESPONSE_VALIDATION.
+    """
 
+    def __init__(self, spectree):
+        super().__init__(spectree)
+        if settings.API_RESPONSE_VALIDATION not in RESPONSE_VALIDATION_MODES:
+            raise ValueError('Invalid response validation mode: '
+                f'{settings.API_RESPONSE_VALIDATION}')
 
     def register_route(self, app):
         """Use standard routing."""
         self.app = app
 
+    async def request_validation(self, request, query, json, headers,
+            cookies, form=None):
+        body = None
+        if json is not None and request.method not in ('GET', 'HEAD'):
+            body = json.parse_obj(orjson.loads(await request.body() or b'{}'))
+        form_data = None
+        if form is not None:
+            form_data = form.parse_obj(dict(await request.form()))
+        request.context = Context(
+            query.parse_obj(request.query_params) if query else None,
+            body,
+            headers.parse_obj(request.headers) if headers else None,
+            cookies.parse_obj(request.cookies) if cookies else None,
+            form_data)
+
+    def should_validate_response(self, response) -> bool:
+        mode = settings.API_RESPONSE_VALIDATION
+        if mode == 'sample':
+            # validating a stream builds the whole document, which streaming
+            # avoids
+            return (not isinstance(response, StreamingResponse) and
+                random.random() < settings.API_RESPONSE_VALIDATION_SAMPLE_RATE)
+        return mode == 'always'
+
+    def validate_response(self, model, response):
+        """Validate the content of response with model. Raises
+        ValidationError.
+        """
+        content = getattr(response, 'content', None)
+        if isinstance(content, model):
+            return # validated when it was created
+        if content is None:
+            content = orjson.loads(response.body)
+        model.validate(content)
+
+    async def validate(self, func, query, json, headers, cookies, resp,
+            before, after, *args, **kwargs):
+        # NOTE: If func is a `HTTPEndpoint`, it should have '.' in its
+        # ``__qualname__``, as in StarlettePlugin.validate.
+        instance = args[0] if '.' in func.__qualname__ else None
+        request = args[1] if '.' in func.__qualname__ else args[0]
+        try:
+            await self.request_validation(request, query, json, headers,
+                cookies, getattr(func, 'form_model', None))
+        except ValidationError as err:
+            response = ORJSONResponse(err.errors(), status_code=422)
+            before(request, response, err, instance)
+            return response
+        except orjson.JSONDecodeError as err:
+            self.logger.info('422 Validation Error',
+                extra={'spectree_json_decode_error': str(err)})
+            response = ORJSONResponse({'error_msg': str(err)}, status_code=422)
+            before(request, response, None, instance)
+            return response
+        before(request, None, None, instance)
+
+        if inspect.iscoroutinefunction(func):
+            response = await func(*args, **kwargs)
+        else:
+            response = func(*args, **kwargs)
+
+        resp_validation_error = None
+        model = resp and resp.find_model(response.status_code)
+        if model and self.should_validate_response(response):
+            try:
+                self.validate_response(model, response)
+            except ValidationError as err:
+                resp_validation_error = err
+                if settings.API_RESPONSE_VALIDATION == 'always':
+                    response = ORJSONResponse(err.errors(), status_code=500)
+        after(request, response, resp_validation_error, instance)
+        return response
+
     #def _register_route(self, app):
     #    self.app = app
     #    try:
@@ -133,36 +243,88 @@ PREFIX = '/v0.1'
 SPEC_URL = '/docs/openapi.json'
 
 
+# The spec and the redoc page do not change while the app runs, so they are
+# encoded and compressed once, by build_documents.
+_documents:dict = {}
+
+
+def spec_bytes() -> bytes:
+    """Generate the OpenAPI spec as JSON."""
+    return dumps(_app.spec)
+
+
+def build_documents():
+    """Build the spec and redoc page documents. Called at startup, and on
+    first use if startup did not run. The spec is read from
+    OPENAPI_SPEC_FILE if set, and generated otherwise.
+    """
+    if settings.OPENAPI_SPEC_FILE:
+        with open(settings.OPENAPI_SPEC_FILE, 'rb') as f:
+            spec = f.read()
+    else:
+        spec = spec_bytes()
+    page = templates.get_template('redoc.html').render(
+        spec_url=PREFIX + SPEC_URL).encode()
+    max_age = settings.API_DOCS_MAX_AGE_SECONDS
+    _documents['spec'] = StaticDocument(spec, 'application/json', max_age)
+    _documents['redoc'] = StaticDocument(page, 'text/html', max_age)
+
+
+def _document(name:str) -> StaticDocument:
+    if name not in _documents:
+        build_documents()
+    return _documents[name]
+
+
+def openapi_spec(request):
+    return _document('spec').response(request)
+
+
 def docs(request):
-    return render('redoc.html', { 'spec_url': PREFIX + SPEC_URL })
+    return _document('redoc').response(request)
 
 
 
 @requires('api_auth', status_code=403)
-@_app.validate(resp=Response(HTTP_200=OAuth2ClientListResponse,
-                             HTTP_403=APIExceptionResponse), tags=['clients'])
-@db_session
+@_app.validate(query=PageRequest,
+               resp=Response(HTTP_200=OAuth2ClientListResponse,
+                             HTTP_403=APIExceptionResponse,
+                             HTTP_422=ValidationErrorList), tags=['clients'])
+@async_db_session
 async def clients_list(request, db):
-    """Get available clients."""
-    user=request.scope['token'].get_user(db=db)
-    clients = OAuth2Client.objects.fetch_for_user(user, db=db)
-    r = OAuth2ClientListResponse(clients=[c.dict(model=OAuth2ClientResponse)
-        for c in clients])
-    return JSONResponse(r.dict(), status_code=200)
+    """Get available clients.
+
+    Results are paginated. Pass next_cursor as the cursor parameter to get the
+    next page.
+    """
+    page_request = request.context.query
+    user = request.user
+    try:
+        page = await OAuth2Client.objects.afetch_page_for_user(user,
+            cursor=page_request.cursor, limit=page_request.limit, db=db)
+    except OAuth2Client.InvalidCursor:
+        return JSONResponse([ { 'loc': ['cursor'],
+            'msg': 'Invalid cursor.',
+            'type': 'value_error.cursor' }],
+            status_code=422)
+    serialize = get_serializer(OAuth2Client, OAuth2ClientResponse) \
+        or functools.partial(OAuth2Client.dict, model=OAuth2ClientResponse)
+    return JSONListStreamingResponse('clients', page.items, serialize,
+        extra={'next_cursor': page.next_cursor})
 
 
 @requires('api_auth', status_code=403)
 @_app.validate(resp=Response(HTTP_200=OAuth2ClientResponse,
                              HTTP_403=APIExceptionResponse,
                              HTTP_404=APIExceptionResponse), tags=['clients'])
-@db_session
+@async_db_session
 async def clients_get(request, db):
     """Get a specified client."""
     client_id = request.path_params.get('client_id')
-    user=request.scope['token'].get_user(db=db)
-    client = OAuth2Client.objects.get_for_user(user, client_id, db=db)
+    user = request.user
+    client = await OAuth2Client.objects.aget_for_user(user, client_id, db=db)
     if client:
-        return JSONResponse(client.dict(model=OAuth2ClientResponse), status_code=200)
+        return ORJSONResponse(client.dict(model=OAuth2ClientResponse), status_code=200)
     raise HTTPException(404, detail="Not found")
 
 
@@ -170,14 +332,14 @@ async def clients_get(request, db):
 @_app.validate(resp=Response(HTTP_200=APIMessage,
                              HTTP_403=APIExceptionResponse,
                              HTTP_404=APIExceptionResponse), tags=['clients'])
-@db_session
+@async_db_session
 async def clients_delete(request, db):
     """Delete a client."""
     client_id = request.path_params.get('client_id')
-    user=request.scope['token'].get_user(db=db)
-    r = OAuth2Client.objects.delete_for_user(user, client_id, db=db)
+    user = request.user
+    r = await OAuth2Client.objects.adelete_for_user(user, client_id, db=db)
     if r:
-        return JSONResponse(APIMessage(msg='Deleted', status=200).dict(),
+        return ORJSONResponse(APIMessage(msg='Deleted', status=200),
             status_code=200)
     raise HTTPException(404, detail="Not found")
 
@@ -192,34 +354,37 @@ from ...orm import OAUTH2_CLIENT_ID_BYTES, OAUTH2_CLIENT_SECRET_BYTES
                              HTTP_422=ValidationErrorList), tags=['clients'])
 async def clients_post(request):
     """Create a client."""
-    data = await request.json()
+    data = request.context.json
     try:
-        user = request.scope['token'].get_user()
-        _client = OAuth2Client.objects.create({
-            'user': user,
-            'name': data['name']})
+        user = request.user
+        _client = await OAuth2Client.objects.acreate({
+            'user_id': user.id,
+            'name': data.name})
     except OAuth2Client.Exists:
         return JSONResponse([ { 'loc': ['name'],
             'msg': 'Client name already exists for account.',
             'type': 'value_error.name_exists' }],
             status_code=409)
-    return JSONResponse(_client.dict(model=OAuth2ClientResponse), status_code=201)
+    return ORJSONResponse(_client.dict(model=OAuth2ClientResponse), status_code=201)
 
 
+# The views of tokens and users import this module, and mypy cannot
+# determine their types within the import cycle.
 router = Router(
     routes = [
         #Route('/user', user_profile, methods=['POST']),
-        Route('/profile', users.profile, methods=['GET', 'PUT']),
-        Route('/password', users.password, methods=['PUT']),
+        Route('/profile', users.profile, methods=['GET', 'PUT']), # type: ignore[has-type]
+        Route('/password', users.password, methods=['PUT']), # type: ignore[has-type]
         # clients
         Route('/clients/{client_id:str}', clients_get, methods=['GET']),
         Route('/clients/{client_id:str}', clients_delete, methods=['DELETE']),
         Route('/clients', clients_list, methods=['GET']),
         Route('/clients', clients_post, methods=['POST']),
         # tokens
-        Route('/token', tokens.token_create, methods=['POST']),
-        Route('/token-refresh', tokens.token_refresh, methods=['POST']),
-        Route(SPEC_URL, lambda request:JSONResponse(_app.spec)),
+        Route('/token', tokens.token_create, methods=['POST']), # type: ignore[has-type]
+        Route('/token/batch', tokens.token_batch_create, methods=['POST']), # type: ignore[has-type]
+        Route('/token-refresh', tokens.token_refresh, methods=['POST']), # type: ignore[has-type]
+        Route(SPEC_URL, openapi_spec, methods=['GET']),
         Route('/docs/api', docs, name='api_docs', methods=['GET']),
         #Route('/docs/api', lambda request, ui='redoc': HTMLResponse(
         #    PAGES['redoc'].format(PREFIX+SPEC_URL)))
@@ -1,16 +1,31 @@
 from spectree import Response
 from starlette.exceptions import HTTPException
-from starlette.responses import JSONResponse
 from ...config import settings
 from ...orm.oauth2client import OAuth2Client
 from ...orm.oauth2token import OAuth2Token
 from ...schemas.oauth2token import TokenResponse, TokenRefreshRequest, NewTokenRequest
-from .clients import _app, ValidationErrorList, APIExceptionResponse
+from ...schemas.oauth2token import NewTokenBatchRequest, TokenBatchResponse
+from .clients import _app, form_body, ValidationErrorList, APIExceptionResponse
+from ..responses import ORJSONResponse
 
 
 # OAuth2 spec seems to mandate form data (not json) for a token request:
 # https://github.com/requests/requests-oauthlib/issues/244
-# SpecTree does not have form validation, so we validate inside the function.
+# SpecTree does not have form validation, so form_body validates the form into
+# request.context.form.
+
+
+def _token_data(token):
+    """The token as issued to the client. For self-encoded tokens, the access
+    token is the signed JWT rather than the stored token id.
+    """
+    data = token.dict(model=TokenResponse)
+    data['access_token'] = token.bearer_token
+    return data
+
+
+def _token_response(token, status_code=200):
+    return ORJSONResponse(_token_data(token), status_code=status_code)
 
 @_app.validate(json=None,
                resp=Response(HTTP_201=TokenResponse,
@@ -18,18 +33,18 @@ from .clients import _app, ValidationErrorList, APIExceptionResponse
                              HTTP_403=APIExceptionResponse,
                              HTTP_409=ValidationErrorList,
                              HTTP_422=ValidationErrorList), tags=['tokens'])
+@form_body(TokenRefreshRequest)
 async def token_refresh(request):
-    data = dict(await request.form())
-    validated = TokenRefreshRequest(**data)
     try:
-        token = OAuth2Token.objects.refresh(**validated.dict())
+        token = await OAuth2Token.objects.arefresh(
+            **request.context.form.dict())
     except OAuth2Token.DoesNotExist:
         raise HTTPException(404, "Not found")
     except OAuth2Token.Revoked:
         raise HTTPException(401, "Invalid token")
     except OAuth2Token.Expired:
         raise HTTPException(403, "Expired token")
-    return JSONResponse(token.dict(model=TokenResponse))
+    return _token_response(token)
 
 
 @_app.validate(json=None,
@@ -38,14 +53,35 @@ async def token_refresh(request):
                              HTTP_403=APIExceptionResponse,
                              HTTP_409=ValidationErrorList,
                              HTTP_422=ValidationErrorList), tags=['tokens'])
+@form_body(NewTokenRequest)
 async def token_create(request):
-    data = dict(await request.form())
-    validated = NewTokenRequest(**data)
     try:
-        token = OAuth2Token.objects.create_for_client(**validated.dict())
+        token = await OAuth2Token.objects.acreate_for_client(
+            **request.context.form.dict())
     except (OAuth2Client.DoesNotExist, OAuth2Client.InvalidOAuth2Client):
         raise HTTPException(401, "Unauthorized")
     except OAuth2Token.InvalidGrantType:
         raise HTTPException(403, "Invalid grant type")
-    return JSONResponse(token.dict(model=TokenResponse), status_code=201)
+    return _token_response(token, status_code=201)
 
+
+
+@_app.validate(json=None,
+               resp=Response(HTTP_201=TokenBatchResponse,
+                             HTTP_401=APIExceptionResponse,
+                             HTTP_403=APIExceptionResponse,
+                             HTTP_422=ValidationErrorList), tags=['tokens'])
+@form_body(NewTokenBatchRequest)
+async def token_batch_create(request):
+    """Issue count tokens to one client in a single transaction, e.g. for a
+    fleet of workers that share the client's credentials.
+    """
+    try:
+        tokens = await OAuth2Token.objects.acreate_batch_for_client(
+            **request.context.form.dict())
+    except (OAuth2Client.DoesNotExist, OAuth2Client.InvalidOAuth2Client):
+        raise HTTPException(401, "Unauthorized")
+    except OAuth2Token.InvalidGrantType:
+        raise HTTPException(403, "Invalid grant type")
+    return ORJSONResponse({'tokens': [_token_data(token) for token in tokens]},
+        status_code=201)
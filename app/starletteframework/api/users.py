@@ -5,34 +5,39 @@ from ...orm.user import User, UserProfileResponse
 from ...schemas.user import UserUpdateRequest, UserPasswordUpdateRequest
 from .clients import _app, APIExceptionResponse, APIMessage
 from .clients import ValidationErrorList
-from pydantic import ValidationError
+from ..responses import ORJSONResponse
 
 
 @requires('api_auth', status_code=401)
 @_app.validate(json=UserUpdateRequest,
                resp=Response(HTTP_200=UserProfileResponse,
                              HTTP_401=APIExceptionResponse,
+                             HTTP_409=ValidationErrorList,
                              HTTP_422=ValidationErrorList), tags=['user'])
 async def profile(request):
-    user=request.scope['token'].get_user()
+    user = request.user
     if request.method == 'PUT':
-        data = await request.json()
-        obj = UserUpdateRequest(**data)
-        User.objects.update(db_obj=user, obj_in=obj)
-    return JSONResponse(user.dict(model=UserProfileResponse), status_code=200)
+        user = await User.objects.aget(user.id)
+        for key, value in request.context.json.dict(exclude_unset=True).items():
+            setattr(user, key, value)
+        try:
+            await user.asave()
+        except User.Exists:
+            return JSONResponse([ { 'loc': ['email'],
+                'msg': 'Email address already in use.',
+                'type': 'value_error.email_exists' }],
+                status_code=409)
+    return ORJSONResponse(user.dict(model=UserProfileResponse), status_code=200)
 
 
 
 @requires('api_auth', status_code=401)
-@_app.validate(json=UserUpdateRequest,
+@_app.validate(json=UserPasswordUpdateRequest,
                resp=Response(HTTP_200=APIMessage,
                              HTTP_401=APIExceptionResponse,
                              HTTP_422=ValidationErrorList), tags=['user'])
 async def password(request):
-    user=request.scope['token'].get_user()
-    data = await request.json()
-    obj = UserPasswordUpdateRequest(**data)
-    User.objects.update(db_obj=user, obj_in=obj)
-    return JSONResponse(
-        APIMessage(msg='Updated', status=200).dict(),
+    user = request.user
+    await user.aset_password(request.context.json.password)
+    return ORJSONResponse(APIMessage(msg='Updated', status=200),
         status_code=200)
@@ -11,7 +11,7 @@ async def login(request):
     data = await request.form()
     form = LoginForm(request, formdata=data, meta={ 'csrf_context': request.session })
     if request.method == 'POST':
-        user = form.validate()
+        user = await form.avalidate()
         if user:
             request.session['username'] = user.email
             request.session['user_id'] = user.id
@@ -39,9 +39,14 @@ async def reset_password(request):
         messages.add(request,
             'Invalid password reset token. Please contact adminstrator.',
             classes=['error'])
-    if request.method == 'POST' and form.validate():
-        user = User.objects.get_by_email(email)
-        user.set_password(form.new_password.data)
+    if request.method == 'POST' and email is not None and form.validate():
+        user = await User.objects.aget_by_email(email)
+        if user is None:
+            messages.add(request,
+                'Invalid password reset token. Please contact adminstrator.',
+                classes=['error'])
+            return RedirectResponse(url='/auth/login', status_code=302)
+        await user.aset_password(form.new_password.data)
         messages.add(request,
             'You may now sign in with your new password.',
             classes=['info']
@@ -1,6 +1,7 @@
 import copy
 import datetime
 from starlette.authentication import AuthenticationBackend, AuthCredentials
+from ..auth import decode_access_token
 from ..orm import oauth2token
 from ..orm.user import User
 
@@ -8,20 +9,24 @@ from ..orm.user import User
 class SessionAuthBackend(AuthenticationBackend):
 
     async def authenticate(self, request):
+        if hasattr(request.session, 'aload'):
+            await request.session.aload() # server-side session
         if 'user_id' in request.session:
             user_id = request.session['user_id']
-            user = User.objects.get(user_id)
+            user = await User.objects.aget_cached(user_id)
             creds = ['app_auth']
             if user.is_superuser:
                 creds.append('admin_auth')
             if user.user_data and 'asUser' in user.user_data:
                 if request.url.path == '/auth/logout':
+                    user = await User.objects.aget(user_id)
                     data = copy.copy(user.user_data)
-                    del data['asUser']
+                    data.pop('asUser', None)
                     user.user_data = data
-                    user.save() 
+                    await user.asave()
                 else:
-                    spoof_user = User.objects.get_by_email(user.user_data['asUser'])
+                    spoof_user = await User.objects.aget_cached_by_email(
+                        user.user_data['asUser'])
                     return AuthCredentials(creds), spoof_user
             return AuthCredentials(creds), user
         if request.headers.get('authorization'):
@@ -29,11 +34,29 @@ class SessionAuthBackend(AuthenticationBackend):
             if bearer[0] != 'Bearer':
                 return
             bearer = bearer[1]
-            token = oauth2token.OAuth2Token.objects.get_by_access_token(bearer)
-            if token is None or token.revoked:
+            if oauth2token.is_self_encoded() and bearer.count('.') == 2:
+                token, user = await self.self_encoded_token(bearer)
+            else:
+                tokens = oauth2token.OAuth2Token.objects
+                token, user = await tokens.aget_cached_principal(bearer)
+            if token is None or token.revoked or user is None:
                 return # return without authorization
             if datetime.datetime.utcnow() > token.access_token_expires_at:
                 return # return without authorization
             # passed all tests
             request.scope['token'] = token
-            return AuthCredentials(['api_auth']), None
+            return AuthCredentials(['api_auth']), user
+
+    @staticmethod
+    async def self_encoded_token(bearer):
+        """Validate a self-encoded access token by its signature, expiry and
+        the revocation set, without a database query. Returns the token and
+        the user it was issued to.
+        """
+        claims = decode_access_token(bearer)
+        if not claims or 'jti' not in claims or 'cid' not in claims:
+            return None, None
+        if await oauth2token.revoked_tokens.contains(claims['jti']):
+            return None, None
+        user = await User.objects.aget_cached(int(claims['sub']))
+        return oauth2token.OAuth2Token.from_claims(claims), user
@@ -0,0 +1,231 @@
+"""
+Response caching for rendered HTML views.
+
+Decorate a view with cached_response to cache its rendered page by path,
+query string and the vary keys of the view, and to answer conditional requests
+with 304 Not Modified using an ETag of the page:
+
+```
+@requires('app_auth')
+@cached_response(vary=('user',))
+async def docs(request):
+    ...
+```
+
+Pages are only cached for GET and HEAD requests with a 200 response, and are
+never served from or written to the cache while the session has messages,
+since rendering messages also clears them. Views that render CSRF-bearing
+forms must not be cached, or must be excluded with cache_if for the requests
+that show a form.
+
+Templates can cache fragments with the cache tag of FragmentCacheExtension.
+The fragment is cached by the values given to the tag, which must include
+everything the fragment depends on:
+
+```
+{% cache 'nav', request.user.is_authenticated, request.user.full_name %}
+...
+{% endcache %}
+```
+"""
+import functools
+import hashlib
+import pickle
+import typing
+from jinja2 import nodes # type: ignore
+from jinja2.ext import Extension # type: ignore
+from starlette.requests import Request
+from starlette.responses import Response
+from ..cache import LRUCache
+from ..config import settings
+from ..orm.user import user_cache
+
+
+class CachedPage(typing.NamedTuple):
+    """A cached rendered page."""
+    body: bytes
+    media_type: str
+    etag: str
+
+
+class MemoryResponseCache():
+    """Per-process response cache backend."""
+
+    def __init__(self, maxsize:int):
+        self.cache = LRUCache(maxsize=maxsize)
+
+    def get(self, key:str) -> typing.Optional[CachedPage]:
+        return self.cache.get(key)
+
+    def set(self, key:str, page:CachedPage, ttl:float):
+        self.cache.set(key, page, ttl=ttl)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+
+class RedisResponseCache():
+    """Response cache backend shared by all processes through redis. Requires
+    the redis package.
+    """
+
+    prefix = 'webster:page:'
+
+    def __init__(self, url:str):
+        try:
+            import redis # type: ignore # pylint:disable=import-outside-toplevel
+        except ImportError as e:
+            raise ImportError(
+                'The redis response cache backend requires the redis package'
+            ) from e
+        self.client = redis.Redis.from_url(url)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key:str) -> typing.Optional[CachedPage]:
+        data = self.client.get(self.prefix + key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return CachedPage(*pickle.loads(data))
+
+    def set(self, key:str, page:CachedPage, ttl:float):
+        self.client.set(self.prefix + key, pickle.dumps(tuple(page)),
+            ex=max(1, int(ttl)))
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+def get_backend():
+    """Create the response cache backend selected in settings."""
+    if settings.RESPONSE_CACHE_BACKEND == 'memory':
+        return MemoryResponseCache(settings.RESPONSE_CACHE_SIZE)
+    if settings.RESPONSE_CACHE_BACKEND == 'redis':
+        return RedisResponseCache(settings.RESPONSE_CACHE_REDIS_URL)
+    raise ValueError(
+        f'Invalid response cache backend: {settings.RESPONSE_CACHE_BACKEND}')
+
+
+response_cache = get_backend()
+
+
+def _vary_user(request:Request):
+    """The user id and its user cache version, which changes when the user is
+    saved, so that pages showing user data are not served stale.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return None
+    return (user.id, user_cache.version(user.id))
+
+
+def _vary_superuser(request:Request):
+    return bool(getattr(request.user, 'is_superuser', False))
+
+
+VARY_KEYS:typing.Dict[str, typing.Callable[[Request], typing.Any]] = {
+    'user': _vary_user,
+    'superuser': _vary_superuser,
+}
+
+
+def has_messages(request:Request) -> bool:
+    """True if the session has messages waiting to be shown."""
+    session = request.scope.get('session') or {}
+    return any(value for key, value in session.items()
+        if key == 'messages' or key.startswith('messages__'))
+
+
+def _etag(body:bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def _page_response(request:Request, page:CachedPage) -> Response:
+    headers = {'etag': page.etag, 'cache-control': 'private, no-cache'}
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match and page.etag in [
+            tag.strip() for tag in if_none_match.split(',')]:
+        return Response(status_code=304, headers=headers)
+    return Response(page.body, media_type=page.media_type, headers=headers)
+
+
+def cached_response(vary:typing.Sequence[str]=('user',),
+        ttl:typing.Optional[float]=None,
+        cache_if:typing.Optional[typing.Callable[[Request], bool]]=None):
+    """Cache the rendered page of a view.
+
+    vary: names of VARY_KEYS the page depends on, besides the base url, path
+          and query
+    ttl: seconds to cache pages. Defaults to RESPONSE_CACHE_TTL_SECONDS.
+    cache_if: called with the request. If it returns False, the view is
+              called as usual and its response is not cached.
+    """
+    for name in vary:
+        if name not in VARY_KEYS:
+            raise ValueError(f'Unknown vary key: {name}')
+    if ttl is None:
+        ttl = settings.RESPONSE_CACHE_TTL_SECONDS
+
+    def decorator(f):
+        @functools.wraps(f)
+        async def wrapped_f(request:Request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') \
+                    or has_messages(request) \
+                    or cache_if is not None and not cache_if(request):
+                return await f(request, *args, **kwargs)
+            # pages hold absolute urls, so the scheme and host are part of
+            # the key
+            parts = [f.__module__, f.__qualname__, str(request.base_url),
+                request.url.path, request.url.query]
+            parts.extend(repr(VARY_KEYS[name](request)) for name in vary)
+            key = hashlib.blake2b('\0'.join(parts).encode(),
+                digest_size=16).hexdigest()
+            page = response_cache.get(key)
+            if page is None:
+                response = await f(request, *args, **kwargs)
+                if response.status_code != 200 or has_messages(request):
+                    return response
+                page = CachedPage(response.body, response.media_type,
+                    _etag(response.body))
+                response_cache.set(key, page, ttl)
+            return _page_response(request, page)
+        return wrapped_f
+    return decorator
+
+
+fragment_cache = LRUCache(maxsize=settings.FRAGMENT_CACHE_SIZE,
+    ttl=settings.RESPONSE_CACHE_TTL_SECONDS)
+
+
+class FragmentCacheExtension(Extension):
+    """Jinja extension adding a cache tag that caches the rendered block by
+    the values of its arguments.
+    """
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_cache_support', [nodes.List(args)]),
+            [], [], body).set_lineno(lineno)
+
+    def _cache_support(self, key, caller):
+        key = (self.environment, tuple(str(part) for part in key))
+        rv = fragment_cache.get(key)
+        if rv is None:
+            rv = caller()
+            fragment_cache.set(key, rv)
+        return rv
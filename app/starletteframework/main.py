@@ -3,18 +3,42 @@ from ..wiring import do_wiring
 do_wiring()
 
 from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from .api.clients import build_documents
 from .middleware import setup_middleware
 from .routing import routes
+from .tasks import start_tasks, stop_tasks
+from .templates import templates
+from ..auth import password_hasher, random_keys, HashQueueFull
 from ..config import settings
+from ..orm import OAUTH2_ACCESS_TOKEN_BYTES, OAUTH2_REFRESH_TOKEN_BYTES
 
 
 def startup():
     print(f'{settings.PROJECT_NAME} startup.')
+    templates.precompile()
+    build_documents()
+    if settings.RANDOM_KEY_POOL_SIZE:
+        random_keys.prefill(OAUTH2_ACCESS_TOKEN_BYTES,
+            OAUTH2_REFRESH_TOKEN_BYTES)
+    start_tasks()
+
+
+async def shutdown():
+    await stop_tasks()
+    password_hasher.shutdown()
+
+
+async def hash_queue_full(request, exc):
+    return PlainTextResponse('Service busy', status_code=503,
+        headers={'Retry-After': '1'})
 
 
 app = Starlette(
     debug=True,
     routes=routes,
-    on_startup=[startup])
+    exception_handlers={HashQueueFull: hash_queue_full},
+    on_startup=[startup],
+    on_shutdown=[shutdown])
 
 setup_middleware(app)
@@ -1,33 +1,176 @@
 """
 Middleware configurations.
 """
+import hashlib
+import logging
+import time
 from starlette.middleware.authentication import AuthenticationMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 from starlette.middleware.trustedhost import TrustedHostMiddleware
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection, Request
+from .. import containers
+from ..cache import Cache
 from ..config import settings
-from . import backends
+from ..containers import Container, RequestQueries, request_queries
+from ..containers import request_sessions
+from . import backends, ratelimit, sessions
+from .sessions import ServerSessionMiddleware
+from .templates import current_request
 
 
-class CustomMiddleware(BaseHTTPMiddleware):
-    """From: https://github.com/encode/starlette/blob/7f8cd041734be3b290cdb178e99c37e1d5a19b41/tests/middleware/test_base.py#L11
+logger = logging.getLogger(__name__)
 
-    Example of Custom Middleware. Add to app below with `add_middleware` if
-    implemented. Here for documentation purposes.
+
+class CustomMiddleware():
+    """Example of Custom Middleware, written as a pure ASGI callable. Add to
+    app below with `add_middleware` if implemented. Here for documentation
+    purposes.
+
+    Prefer this to starlette's BaseHTTPMiddleware, which runs the rest of the
+    app in a separate task and re-streams the response through a queue.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                headers = MutableHeaders(scope=message)
+                headers.append('Custom-Header', 'Example')
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class ProjectMiddleware():
+    """Set up per-request project state: the settings as
+    request.state.settings, and the request in templates.current_request for
+    code that is not passed it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        scope.setdefault('state', {})['settings'] = settings
+        token = current_request.set(Request(scope, receive))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_request.reset(token)
+
+
+"""
+Credentials (hashed) of requests that wrote to the database within the last
+SQLALCHEMY_READ_YOUR_WRITES_SECONDS, so that with read replicas, the next
+requests of the same client read from the primary.
+"""
+recent_writers = Cache('recent_writers', Container.cache_backend,
+    maxsize=10000, ttl=settings.SQLALCHEMY_READ_YOUR_WRITES_SECONDS)
+
+
+def writer_key(scope) -> str:
+    """The hash of the credentials of a request: its Authorization header or
+    session cookie. Empty for anonymous requests.
+    """
+    connection = HTTPConnection(scope)
+    credentials = connection.headers.get('authorization') \
+        or connection.cookies.get(settings.SESSION_COOKIE)
+    if not credentials:
+        return ''
+    return hashlib.blake2b(credentials.encode(), digest_size=16).hexdigest()
+
+
+class DBSessionMiddleware():
+    """Share one sync and one async database session across everything that
+    handles a request: the auth backend, the handler and the ORM calls it
+    makes. The sessions are committed before the response starts, rolled back
+    if the request fails, and closed when it is done.
+
+    With read replicas, a request that wrote is remembered in recent_writers
+    before its response starts, and the next requests with the same
+    credentials read from the primary.
     """
-    async def dispatch(self, request, call_next):
-        response = await call_next(request)
-        response.headers["Custom-Header"] = "Example"
-        return response
 
+    def __init__(self, app):
+        self.app = app
 
-class ProjectMiddleware(BaseHTTPMiddleware):
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        sessions = Container.request_sessions()
+        token = request_sessions.set(sessions)
+        writer = writer_key(scope) if containers.replicas is not None else ''
+        if writer and recent_writers.get(writer):
+            containers.pin_primary()
+        pinned = sessions.primary_until
 
-    async def dispatch(self, request, call_next):
-        request.state.settings = settings
-        response = await call_next(request)
-        return response
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                await sessions.commit()
+                if writer and sessions.primary_until != pinned:
+                    recent_writers.set(writer, True, ttl=
+                        sessions.primary_until - time.monotonic())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except:
+            await sessions.rollback()
+            raise
+        finally:
+            request_sessions.reset(token)
+            await sessions.close()
+
+
+class QueryInstrumentationMiddleware():
+    """Count and time the SQL statements of each request into a
+    containers.RequestQueries. Adds them to the response as a Server-Timing
+    header if SQL_SERVER_TIMING is set, and logs statements that were
+    repeated SQL_REPEATED_QUERY_THRESHOLD times or more, which usually means
+    an N+1 query pattern.
+
+    Add outside DBSessionMiddleware, so that the commit of the request's
+    sessions is included.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        queries = RequestQueries(scope)
+        token = request_queries.set(queries)
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start' \
+                    and settings.SQL_SERVER_TIMING:
+                headers = MutableHeaders(scope=message)
+                headers.append('Server-Timing', queries.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_queries.reset(token)
+            for statement, n in queries.repeated(
+                    settings.SQL_REPEATED_QUERY_THRESHOLD):
+                logger.warning(
+                    'Statement executed %d times in %s, possible N+1: %s',
+                    n, queries.route, statement)
 
 
 def setup_middleware(app):
@@ -45,13 +188,32 @@ def setup_middleware(app):
             allow_headers=["*"],
         )
     app.add_middleware(ProjectMiddleware)
+    limiter = ratelimit.get_backend() if settings.RATE_LIMIT_ENABLED else None
+    if limiter is not None:
+        app.add_middleware(ratelimit.RateLimitMiddleware, limiter=limiter)
     app.add_middleware(
         AuthenticationMiddleware,
         backend=backends.SessionAuthBackend())
-    app.add_middleware(
-        SessionMiddleware,
-        secret_key=settings.SECRET_KEY,
-        session_cookie=settings.SESSION_COOKIE,
-        max_age=settings.SESSION_EXPIRE_SECONDS,
-        same_site=settings.SESSION_SAME_SITE,
-        https_only=False)
+    if settings.SESSION_BACKEND == 'cookie':
+        app.add_middleware(
+            SessionMiddleware,
+            secret_key=settings.SECRET_KEY,
+            session_cookie=settings.SESSION_COOKIE,
+            max_age=settings.SESSION_EXPIRE_SECONDS,
+            same_site=settings.SESSION_SAME_SITE,
+            https_only=False)
+    else:
+        app.add_middleware(
+            ServerSessionMiddleware,
+            backend=sessions.get_backend(),
+            session_cookie=settings.SESSION_COOKIE,
+            max_age=settings.SESSION_EXPIRE_SECONDS,
+            same_site=settings.SESSION_SAME_SITE,
+            https_only=False)
+    if settings.REQUEST_SCOPED_DB_SESSIONS:
+        app.add_middleware(DBSessionMiddleware)
+    if settings.SQL_INSTRUMENTATION:
+        app.add_middleware(QueryInstrumentationMiddleware)
+    if limiter is not None:
+        # outermost, so that it runs before any session or token lookup
+        app.add_middleware(ratelimit.IPRateLimitMiddleware, limiter=limiter)
@@ -0,0 +1,251 @@
+"""
+Rate limiting of the API.
+
+Requests under /v0.1, except the docs, are limited with token buckets: a
+bucket holds up to burst tokens, refills at a rate of per_minute tokens per
+minute, and each request takes one token. A request finding its bucket empty
+is answered with 429 Too Many Requests and a Retry-After header giving the
+seconds until a token is available.
+
+Requests are limited by:
+
+ * the OAuth2 client of the bearer token, at the client's
+   rate_limit_per_minute and rate_limit_burst, or RATE_LIMIT_PER_MINUTE and
+   RATE_LIMIT_BURST where those are not set.
+ * the user, for requests authenticated by the session, at
+   RATE_LIMIT_PER_MINUTE and RATE_LIMIT_BURST.
+ * the client IP address, for the token endpoints and unauthenticated
+   requests, at RATE_LIMIT_IP_PER_MINUTE and RATE_LIMIT_IP_BURST.
+
+Before authentication, IPRateLimitMiddleware limits all requests of an IP
+address at RATE_LIMIT_ADDRESS_PER_MINUTE and RATE_LIMIT_ADDRESS_BURST, and
+the token endpoints at the IP limits above, so that floods of requests with
+invalid credentials do not reach the token and session lookups. The other
+limits are applied after authentication by RateLimitMiddleware.
+
+Behind a proxy, the server must take the address from the proxy headers (e.g.
+uvicorn --proxy-headers), or all requests share the proxy's buckets.
+
+Backends:
+
+ * memory: per-process buckets in an LRU. Each worker allows the full limit,
+   so with n workers a client gets up to n times its limit.
+ * redis: buckets shared by all processes through redis. Requires the redis
+   package.
+"""
+import math
+import threading
+import time
+import typing
+from ..cache import LRUCache
+from ..config import settings
+from ..orm.oauth2client import OAuth2Client
+from .responses import ORJSONResponse
+
+
+PREFIX = '/v0.1'
+EXEMPT_PREFIX = PREFIX + '/docs/'
+TOKEN_PREFIX = PREFIX + '/token'
+
+
+class Limit(typing.NamedTuple):
+    """A token bucket size and refill rate."""
+    per_minute: int
+    burst: int
+
+
+class MemoryRateLimiter():
+    """Per-process rate limiter. Each bucket is kept as its tokens and the
+    time they were counted, and expires once it would be full again.
+
+    clock: monotonic time in seconds, replaceable in tests
+    """
+
+    def __init__(self, maxsize:int,
+            clock:typing.Optional[typing.Callable[[], float]]=None):
+        self.buckets = LRUCache(maxsize=maxsize)
+        self.clock = clock or time.monotonic
+        self._lock = threading.Lock()
+
+    def acquire(self, key:str, limit:Limit) -> float:
+        """Take a token from the bucket of key. Returns 0 if a token was
+        taken, or the seconds until one is available.
+        """
+        if limit.per_minute <= 0 or limit.burst <= 0:
+            return 60.0
+        rate = limit.per_minute / 60
+        now = self.clock()
+        with self._lock:
+            tokens, updated = self.buckets.get(key) or (limit.burst, now)
+            tokens = min(limit.burst, tokens + (now - updated) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            self.buckets.set(key, (tokens, now),
+                ttl=(limit.burst - tokens) / rate)
+        return wait
+
+
+class RedisRateLimiter():
+    """Rate limiter shared by all processes through redis. Requires the redis
+    package. Buckets are updated by a script, so that concurrent requests of
+    a client do not both take the last token, and timed by the redis server
+    clock, so that clock skew between hosts does not matter.
+    """
+
+    prefix = 'webster:ratelimit:'
+    script = """
+local burst = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 1)
+return tostring(wait)
+"""
+
+    def __init__(self, url:str):
+        try:
+            import redis # type: ignore # pylint:disable=import-outside-toplevel
+        except ImportError as e:
+            raise ImportError(
+                'The redis rate limit backend requires the redis package'
+            ) from e
+        self.client = redis.Redis.from_url(url)
+        self._acquire = self.client.register_script(self.script)
+
+    def acquire(self, key:str, limit:Limit) -> float:
+        """Take a token from the bucket of key. Returns 0 if a token was
+        taken, or the seconds until one is available.
+        """
+        if limit.per_minute <= 0 or limit.burst <= 0:
+            return 60.0
+        return float(self._acquire(keys=[self.prefix + key],
+            args=[limit.burst, limit.per_minute / 60]))
+
+
+def get_backend():
+    """Create the rate limit backend selected in settings."""
+    if settings.RATE_LIMIT_BACKEND == 'memory':
+        return MemoryRateLimiter(settings.RATE_LIMIT_SIZE)
+    if settings.RATE_LIMIT_BACKEND == 'redis':
+        return RedisRateLimiter(settings.RATE_LIMIT_REDIS_URL)
+    raise ValueError(
+        f'Invalid rate limit backend: {settings.RATE_LIMIT_BACKEND}')
+
+
+# Limits of OAuth2 clients by primary key. Changes to a client's limits take
+# effect within the ttl.
+client_limits = LRUCache(maxsize=settings.OAUTH2_TOKEN_CACHE_SIZE, ttl=60)
+
+
+async def client_limit(client_id:int) -> Limit:
+    """The limit of an OAuth2 client, defaulting to the settings."""
+    limit = client_limits.get(client_id)
+    if limit is None:
+        per_minute, burst = await OAuth2Client.objects.aget_rate_limit(
+            client_id)
+        limit = Limit(
+            settings.RATE_LIMIT_PER_MINUTE if per_minute is None
+                else per_minute,
+            settings.RATE_LIMIT_BURST if burst is None else burst)
+        client_limits.set(client_id, limit)
+    return limit
+
+
+def is_limited(scope) -> bool:
+    """Whether a request is subject to rate limits."""
+    path = scope.get('path', '')
+    return scope['type'] == 'http' and path.startswith(PREFIX) \
+        and not path.startswith(EXEMPT_PREFIX)
+
+
+def client_ip(scope) -> str:
+    client = scope.get('client')
+    return client[0] if client else 'unknown'
+
+
+def ip_limit() -> Limit:
+    return Limit(settings.RATE_LIMIT_IP_PER_MINUTE,
+        settings.RATE_LIMIT_IP_BURST)
+
+
+async def too_many_requests(wait:float, scope, receive, send):
+    response = ORJSONResponse(
+        {'msg': 'Too many requests', 'status': 429},
+        status_code=429,
+        headers={'retry-after': str(max(1, math.ceil(wait)))})
+    await response(scope, receive, send)
+
+
+class IPRateLimitMiddleware():
+    """Limit the rate of API requests per IP address before authentication,
+    so that requests with invalid credentials are refused without looking
+    them up. Must run outside AuthenticationMiddleware and the session
+    middleware.
+    """
+
+    def __init__(self, app, limiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if not is_limited(scope):
+            await self.app(scope, receive, send)
+            return
+        ip = client_ip(scope)
+        wait = self.limiter.acquire(f'address:{ip}', Limit(
+            settings.RATE_LIMIT_ADDRESS_PER_MINUTE,
+            settings.RATE_LIMIT_ADDRESS_BURST))
+        if not wait and scope['path'].startswith(TOKEN_PREFIX):
+            wait = self.limiter.acquire(f'ip:{ip}', ip_limit())
+        if wait:
+            await too_many_requests(wait, scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+class RateLimitMiddleware():
+    """Limit the rate of API requests per client, user, or, for anonymous
+    requests, IP address. Must run inside AuthenticationMiddleware, which
+    sets the token and user of the request. The token endpoints are limited
+    by IPRateLimitMiddleware only.
+    """
+
+    def __init__(self, app, limiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if not is_limited(scope) or scope['path'].startswith(TOKEN_PREFIX):
+            await self.app(scope, receive, send)
+            return
+        key, limit = await self.key_and_limit(scope)
+        wait = self.limiter.acquire(key, limit)
+        if wait:
+            await too_many_requests(wait, scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    async def key_and_limit(scope) -> typing.Tuple[str, Limit]:
+        """The bucket key and limit of a request."""
+        token = scope.get('token')
+        if token is not None:
+            return (f'client:{token.client_id}',
+                await client_limit(token.client_id))
+        user = scope.get('user')
+        if user is not None and user.is_authenticated:
+            return (f'user:{user.id}', Limit(
+                settings.RATE_LIMIT_PER_MINUTE, settings.RATE_LIMIT_BURST))
+        return f'ip:{client_ip(scope)}', ip_limit()
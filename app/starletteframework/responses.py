@@ -0,0 +1,169 @@
+"""
+JSON responses encoded with orjson, and precomputed static documents.
+"""
+import gzip
+import hashlib
+import typing
+from pydantic import BaseModel
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from ..serialization import Serializer, dumps
+
+try:
+    import brotli # type: ignore
+except ImportError: # optional
+    brotli = None
+
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse encoded with orjson, which also encodes datetimes, UUIDs
+    and dataclasses.
+
+    content may also be a pydantic model, which is encoded without a round
+    trip through JSON. The content is kept as the content attribute, so that
+    response validation need not decode the body again.
+    """
+
+    def __init__(self, content:typing.Any=None, *args, **kwargs):
+        self.content = content
+        super().__init__(content, *args, **kwargs)
+
+    def render(self, content:typing.Any) -> bytes:
+        if isinstance(content, BaseModel):
+            content = content.dict(by_alias=True)
+        return dumps(content)
+
+
+class JSONListStreamingResponse(StreamingResponse):
+    """Stream a JSON object with a list member, encoding the list items in
+    chunks as the response is sent rather than building the whole document
+    first.
+
+    key: name of the list member
+    items: objects of the list
+    serialize: converts an item to a JSON-encodable value
+    extra: other members of the object
+    """
+
+    media_type = 'application/json'
+    chunk_size = 100
+
+    def __init__(self, key:str, items:typing.Iterable[typing.Any],
+            serialize:Serializer, extra:typing.Optional[dict]=None,
+            status_code:int=200, headers:typing.Optional[dict]=None):
+        self.key = key
+        self.items = items
+        self.serialize = serialize
+        self.extra = extra or {}
+        super().__init__(self.iter_chunks(), status_code=status_code,
+            headers=headers or {}, media_type=self.media_type)
+
+    def iter_chunks(self) -> typing.Iterator[bytes]:
+        yield b'{' + dumps(self.key) + b':['
+        chunk = []
+        first = True
+        for item in self.items:
+            chunk.append(dumps(self.serialize(item)))
+            if len(chunk) >= self.chunk_size:
+                yield (b'' if first else b',') + b','.join(chunk)
+                first = False
+                chunk = []
+        if chunk:
+            yield (b'' if first else b',') + b','.join(chunk)
+        if self.extra:
+            yield b'],' + dumps(self.extra)[1:]
+        else:
+            yield b']}'
+
+    @property
+    def content(self) -> dict:
+        """The document as a dict, for callers such as response validation
+        that need it at once. Requires items to be re-iterable.
+
+        Not named body: Response.init_headers reads body to set the
+        content-length, which would build the whole document up front.
+        """
+        return {self.key: [self.serialize(item) for item in self.items],
+            **self.extra}
+
+
+def accepted_encodings(header:str) -> typing.Dict[str, float]:
+    """Parse an Accept-Encoding header into the q-value of each coding.
+    Codings without a q-value have q=1; invalid q-values count as 0.
+    """
+    accepted = {}
+    for part in header.split(','):
+        coding, *params = part.split(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = min(max(float(value), 0.0), 1.0)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+class StaticDocument():
+    """A document that does not change while the app runs (e.g. the OpenAPI
+    spec), encoded and compressed once and served with a strong ETag and
+    long-lived cache headers.
+
+    Variants are precompressed with gzip and, if the brotli package is
+    installed, brotli. Each variant has its own ETag, derived from the
+    document's hash.
+    """
+
+    def __init__(self, body:bytes, media_type:str, max_age:int=86400):
+        self.media_type = media_type
+        self.max_age = max_age
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.variants:typing.Dict[str, typing.Tuple[bytes, str]] = {
+            'identity': (body, f'"{digest}"'),
+            'gzip': (gzip.compress(body, compresslevel=9),
+                f'"{digest}-gzip"'),
+        }
+        if brotli is not None:
+            self.variants['br'] = (brotli.compress(body), f'"{digest}-br"')
+        self.etags = {etag for _, etag in self.variants.values()}
+
+    def encoding_for(self, request:Request) -> str:
+        """The best encoding of the document accepted by the request: the
+        one with the highest q-value, preferring br over gzip over identity
+        on ties. Encodings with q=0 are not used, and * matches encodings not
+        listed. identity is used if nothing else is acceptable.
+        """
+        accepted = accepted_encodings(
+            request.headers.get('accept-encoding', ''))
+        default = accepted.get('*', 0.0)
+        best, best_q = 'identity', 0.0
+        for encoding in ('br', 'gzip', 'identity'):
+            if encoding not in self.variants:
+                continue
+            q = accepted.get(encoding,
+                1.0 if encoding == 'identity' and '*' not in accepted
+                else default)
+            if q > best_q:
+                best, best_q = encoding, q
+        return best
+
+    def response(self, request:Request) -> Response:
+        """Respond with the document, or 304 if the client has it."""
+        encoding = self.encoding_for(request)
+        body, etag = self.variants[encoding]
+        headers = {
+            'etag': etag,
+            'cache-control': f'public, max-age={self.max_age}',
+            'vary': 'Accept-Encoding',
+        }
+        if encoding != 'identity':
+            headers['content-encoding'] = encoding
+        if_none_match = request.headers.get('if-none-match', '')
+        if any(tag.strip() in self.etags for tag in if_none_match.split(',')):
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type=self.media_type, headers=headers)
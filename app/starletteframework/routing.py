@@ -16,11 +16,13 @@ a decorator for db session management and only injecting into the decorator
 from starlette.routing import Route, Mount
 from starlette.staticfiles import StaticFiles
 from . import user, auth, oauth2, admin
+from .caching import cached_response
 from .templates import render
 from .api import clients
 
 
-def docs(request):
+@cached_response(vary=('user',))
+async def docs(request):
     return render('docs.html', {})
 
 
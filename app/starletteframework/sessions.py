@@ -0,0 +1,331 @@
+"""
+Server-side sessions.
+
+starlette's SessionMiddleware keeps the whole session in a signed cookie,
+which is parsed, verified and re-signed on every request and grows with the
+session. ServerSessionMiddleware keeps the session data in a backend instead,
+and the cookie carries only an opaque session id.
+
+Sessions are lazy: the data is loaded from the backend the first time the
+session is accessed, and written back only if the session was modified. Only
+assignment and deletion of keys mark the session modified, so mutable values
+must be reassigned rather than changed in place:
+
+```
+request.session['messages'] = request.session.get('messages', []) + [msg]
+```
+
+The session id is replaced, and the old session deleted, whenever the
+session's user_id is set or removed (at login and logout), so that a session
+id planted before login does not become authenticated (session fixation).
+
+The sql and sqlite backends block, so their calls run in the threadpool:
+the session is loaded there by the authentication backend, through
+LazySession.aload, and written there when the response starts.
+
+Sessions expire SESSION_EXPIRE_SECONDS after they were last written. A
+session that is used without being modified is written again once half of
+that time has passed, so active sessions do not expire.
+
+Backends:
+
+ * memory: per-process LRU with expiry. Sessions are not shared between
+   workers, so use only with a single worker or sticky sessions.
+ * sql: the web_sessions table, through the request's database session.
+ * sqlite: an sqlite file in WAL mode, shared by the processes of one host.
+"""
+import datetime
+import random
+import secrets
+import sqlite3
+import threading
+import time
+import typing
+from collections.abc import MutableMapping
+import orjson
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+from ..cache import LRUCache
+from ..config import settings
+from ..containers import SessionLocal
+from ..orm.db import session_scope
+from ..orm.websession import WebSession
+
+
+SessionData = typing.Dict[str, typing.Any]
+# A stored session: its data and expiry as a unix timestamp.
+Record = typing.Tuple[SessionData, float]
+
+SESSION_ID_BYTES = 32
+# Keys whose change replaces the session id.
+AUTH_KEYS = frozenset(['user_id'])
+
+
+class MemorySessionBackend():
+    """Per-process session backend."""
+
+    blocking = False
+
+    def __init__(self, maxsize:int=100000):
+        self.cache = LRUCache(maxsize=maxsize)
+
+    def load(self, sid:str) -> typing.Optional[Record]:
+        record = self.cache.get(sid)
+        if record is None:
+            return None
+        data, expires = record
+        return dict(data), expires
+
+    def save(self, sid:str, data:SessionData, expires:float):
+        self.cache.set(sid, (dict(data), expires), ttl=expires - time.time())
+
+    def delete(self, sid:str):
+        self.cache.invalidate(sid)
+
+
+class SQLSessionBackend():
+    """Session backend on the web_sessions table. Expired sessions are
+    deleted on roughly one in purge_every saves.
+
+    Calls run in the threadpool, so each uses its own database session
+    rather than the request's.
+    """
+
+    blocking = True
+    purge_every = 1000
+
+    def load(self, sid:str) -> typing.Optional[Record]:
+        with session_scope(db=SessionLocal()) as db:
+            row = db.get(WebSession, sid)
+            if row is None:
+                return None
+            expires = row.expires_at.replace(
+                tzinfo=datetime.timezone.utc).timestamp()
+            if expires <= time.time():
+                return None
+            return orjson.loads(row.data), expires
+
+    def save(self, sid:str, data:SessionData, expires:float):
+        with session_scope(db=SessionLocal()) as db:
+            db.merge(WebSession(id=sid, data=orjson.dumps(data).decode(),
+                expires_at=datetime.datetime.utcfromtimestamp(expires)))
+            if random.randrange(self.purge_every) == 0:
+                db.query(WebSession).filter(
+                    WebSession.expires_at < datetime.datetime.utcnow()
+                ).delete(synchronize_session=False)
+
+    def delete(self, sid:str):
+        with session_scope(db=SessionLocal()) as db:
+            db.query(WebSession).filter(WebSession.id == sid).delete(
+                synchronize_session=False)
+
+
+class SQLiteSessionBackend():
+    """Session backend on an sqlite file in WAL mode, so that the processes of
+    a host can share it: readers do not block the writer, and writers wait
+    up to timeout seconds for each other. Each thread uses its own
+    connection. Expired sessions are deleted on roughly one in purge_every
+    saves.
+    """
+
+    blocking = True
+    purge_every = 1000
+
+    def __init__(self, path:str, timeout:float=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS sessions ('
+                'id TEXT PRIMARY KEY, data BLOB NOT NULL, '
+                'expires REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS sessions_expires '
+                'ON sessions (expires)')
+
+    def _connect(self) -> sqlite3.Connection:
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.timeout,
+                isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def load(self, sid:str) -> typing.Optional[Record]:
+        row = self._connect().execute(
+            'SELECT data, expires FROM sessions WHERE id = ?',
+            (sid,)).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return orjson.loads(row[0]), row[1]
+
+    def save(self, sid:str, data:SessionData, expires:float):
+        db = self._connect()
+        db.execute('INSERT OR REPLACE INTO sessions (id, data, expires) '
+            'VALUES (?, ?, ?)', (sid, orjson.dumps(data), expires))
+        if random.randrange(self.purge_every) == 0:
+            db.execute('DELETE FROM sessions WHERE expires <= ?',
+                (time.time(),))
+
+    def delete(self, sid:str):
+        self._connect().execute('DELETE FROM sessions WHERE id = ?', (sid,))
+
+
+def get_backend():
+    """Create the session backend selected in settings."""
+    if settings.SESSION_BACKEND == 'memory':
+        return MemorySessionBackend()
+    if settings.SESSION_BACKEND == 'sql':
+        return SQLSessionBackend()
+    if settings.SESSION_BACKEND == 'sqlite':
+        return SQLiteSessionBackend(settings.SESSION_SQLITE_PATH)
+    raise ValueError(f'Invalid session backend: {settings.SESSION_BACKEND}')
+
+
+class LazySession(MutableMapping):
+    """Session mapping that loads from the backend on first access and
+    records whether it was modified.
+    """
+
+    def __init__(self, backend, sid:typing.Optional[str]):
+        self._backend = backend
+        self._sid = sid
+        self._data:typing.Optional[SessionData] = None
+        self._expires:typing.Optional[float] = None
+        self._modified = False
+        self._regenerate = False
+
+    def _load(self) -> SessionData:
+        if self._data is None:
+            record = self._backend.load(self._sid) if self._sid else None
+            if record is None:
+                self._data, self._expires = {}, None
+            else:
+                self._data, self._expires = record
+        return self._data
+
+    async def aload(self):
+        """Load the session now, in the threadpool if the backend blocks,
+        rather than on the event loop at first access.
+        """
+        if self._data is None and self._sid and self._backend.blocking:
+            await run_in_threadpool(self._load)
+        else:
+            self._load()
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __setitem__(self, key, value):
+        data = self._load()
+        if key in AUTH_KEYS and data.get(key) != value:
+            self._regenerate = True
+        data[key] = value
+        self._modified = True
+
+    def __delitem__(self, key):
+        del self._load()[key]
+        if key in AUTH_KEYS:
+            self._regenerate = True
+        self._modified = True
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __contains__(self, key):
+        return key in self._load()
+
+    def clear(self):
+        data = self._load()
+        if data:
+            if AUTH_KEYS.intersection(data):
+                self._regenerate = True
+            data.clear()
+            self._modified = True
+
+    def regenerate(self):
+        """Replace the session id when the session is written, deleting the
+        session stored under the old one.
+        """
+        self._load()
+        self._regenerate = True
+        self._modified = True
+
+    @property
+    def loaded(self) -> bool:
+        return self._data is not None
+
+
+class ServerSessionMiddleware():
+    """Provide request.session from a server-side session backend."""
+
+    def __init__(self, app, backend, session_cookie:str='session',
+            max_age:int=14 * 24 * 60 * 60, same_site:str='lax',
+            https_only:bool=False):
+        self.app = app
+        self.backend = backend
+        self.session_cookie = session_cookie
+        self.max_age = max_age
+        self.security_flags = 'httponly; samesite=' + same_site
+        if https_only:
+            self.security_flags += '; secure'
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] not in ('http', 'websocket'):
+            await self.app(scope, receive, send)
+            return
+        connection = HTTPConnection(scope)
+        sid = connection.cookies.get(self.session_cookie)
+        session = LazySession(self.backend, sid)
+        scope['session'] = session
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                if session.loaded and self.backend.blocking:
+                    cookie = await run_in_threadpool(self.commit, session)
+                else:
+                    cookie = self.commit(session)
+                if cookie is not None:
+                    headers = MutableHeaders(scope=message)
+                    headers.append('Set-Cookie', cookie)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    def commit(self, session:LazySession) -> typing.Optional[str]:
+        """Write the session back if needed. Returns a Set-Cookie value if
+        the cookie must change.
+        """
+        if not session.loaded:
+            return None
+        now = time.time()
+        if session._modified:
+            old = session._sid
+            if session._regenerate:
+                session._sid = None
+            if old is not None and (session._regenerate or not session._data):
+                self.backend.delete(old)
+            if not session._data:
+                return self.cookie('null', expires=True) if old else None
+            if session._sid is None or session._expires is None:
+                session._sid = secrets.token_urlsafe(SESSION_ID_BYTES)
+            self.backend.save(session._sid, session._data, now + self.max_age)
+            return self.cookie(session._sid)
+        if session._sid is not None and session._expires is not None \
+                and session._expires - now < self.max_age / 2:
+            self.backend.save(session._sid, session._data, now + self.max_age)
+            return self.cookie(session._sid)
+        return None
+
+    def cookie(self, value:str, expires:bool=False) -> str:
+        cookie = f'{self.session_cookie}={value}; path=/; '
+        if expires:
+            cookie += 'expires=Thu, 01 Jan 1970 00:00:00 GMT; '
+        else:
+            cookie += f'Max-Age={self.max_age}; '
+        return cookie + self.security_flags
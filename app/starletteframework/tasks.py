@@ -0,0 +1,57 @@
+"""
+Background tasks run for the lifetime of the application. Start from the
+Starlette startup handler and stop from the shutdown handler.
+"""
+import asyncio
+import logging
+from ..config import settings
+from ..orm.oauth2token import OAuth2Token
+
+logger = logging.getLogger(__name__)
+
+_tasks = []
+
+
+async def reap_tokens(batch_size:int, batches_per_second:float):
+    """Delete expired and revoked tokens in rate limited batches until none
+    remain. Returns the number of tokens deleted. batches_per_second of 0 or
+    less does not pause between batches.
+    """
+    total = 0
+    while True:
+        deleted = await OAuth2Token.objects.areap_batch(batch_size)
+        total += deleted
+        if not deleted or deleted < batch_size:
+            return total
+        if batches_per_second > 0:
+            await asyncio.sleep(1 / batches_per_second)
+
+
+async def token_reaper():
+    """Periodically reap expired and revoked tokens."""
+    while True:
+        try:
+            deleted = await reap_tokens(
+                settings.OAUTH2_TOKEN_REAPER_BATCH_SIZE,
+                settings.OAUTH2_TOKEN_REAPER_BATCHES_PER_SECOND)
+            if deleted:
+                logger.info('Reaped %d expired or revoked tokens', deleted)
+        except asyncio.CancelledError:
+            raise
+        except Exception: # pylint:disable=broad-except
+            logger.exception('Token reaper failed')
+        await asyncio.sleep(settings.OAUTH2_TOKEN_REAPER_INTERVAL_SECONDS)
+
+
+def start_tasks():
+    """Start the configured background tasks."""
+    if settings.OAUTH2_TOKEN_REAPER_ENABLED:
+        _tasks.append(asyncio.ensure_future(token_reaper()))
+
+
+async def stop_tasks():
+    """Cancel background tasks and wait for them to finish."""
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
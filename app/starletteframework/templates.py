@@ -1,16 +1,59 @@
 """
-Custom template renderer that injects the request object into the context and
-sets a clear_messages function on the request for session message handling.
+Custom template renderer that takes the request from the request context
+rather than requiring it in the template context, and provides a
+clear_messages global for session message handling.
+
+The request is set in the current_request contextvar by
+middleware.ProjectMiddleware. Templates are compiled once and, outside of
+DEBUG, are not checked for changes on each render.
 """
-import inspect
-import types
+import time
+import typing
+from contextvars import ContextVar
+import jinja2 # type: ignore
 from starlette.requests import Request
 from starlette.templating import Jinja2Templates
+from ..config import settings
 from ..messages import clear_messages
+from ..metrics import Histogram
+from .caching import FragmentCacheExtension
+
+
+current_request:ContextVar[typing.Optional[Request]] = ContextVar(
+    'current_request', default=None)
+
+
+@jinja2.contextfunction
+def _clear_messages(context:dict, key:typing.Optional[str]=None) -> str:
+    """Template global: clear the session messages of the request."""
+    return clear_messages(context['request'], key=key)
 
 
 class Templates(Jinja2Templates):
-    """Custom Template handler."""
+    """Custom Template handler.
+
+    render_hooks: callables of (template name, seconds) called after each
+                  render, e.g. to export render timings
+    """
+
+    def __init__(self, directory:str):
+        super().__init__(directory)
+        self.render_time:typing.Dict[str, Histogram] = {}
+        self.render_hooks:typing.List[typing.Callable[[str, float], None]] = []
+
+    def get_env(self, directory:str) -> jinja2.Environment:
+        env = super().get_env(directory)
+        env.auto_reload = settings.DEBUG
+        env.add_extension(FragmentCacheExtension)
+        env.globals['clear_messages'] = _clear_messages
+        return env
+
+    def precompile(self):
+        """Compile all templates into the environment cache, so that the
+        first render of each page does not pay for it.
+        """
+        for name in self.env.list_templates():
+            self.env.get_template(name)
 
     def TemplateResponse(
         self,
@@ -20,25 +63,28 @@ class Templates(Jinja2Templates):
     ):
         """Render a template response.
 
-        If it exists and is not already set in the context, injects the
-        request object from the calling scope into the template context.
-
-        Adds a clear_request method to the request instance.
-        """ 
-        if 'request' in context:
-            req = context['request']
-            if isinstance(req, Request):
-                req.clear_messages = types.MethodType(clear_messages, req)
-        else:
-            frame = inspect.currentframe()
-            try:
-                _locals = frame.f_back.f_locals
-                req = _locals.get('request')
-                if req is not None and isinstance(req, Request):
-                    context['request'] = req
-                    req.clear_messages = types.MethodType(clear_messages, req)
-            finally:
-                del frame
-        return super().TemplateResponse(name, context, **kwargs)
-    
-render = Templates(directory='templates').TemplateResponse
+        If it is not already set in the context, injects the current request
+        into the template context.
+        """
+        if 'request' not in context:
+            request = current_request.get()
+            if request is not None:
+                context['request'] = request
+        start = time.perf_counter()
+        response = super().TemplateResponse(name, context, **kwargs)
+        elapsed = time.perf_counter() - start
+        histogram = self.render_time.get(name)
+        if histogram is None:
+            histogram = self.render_time.setdefault(name, Histogram())
+        histogram.observe(elapsed)
+        for hook in self.render_hooks:
+            hook(name, elapsed)
+        return response
+
+    def stats(self) -> dict:
+        """Render time histograms by template name."""
+        return {name: h.snapshot() for name, h in self.render_time.items()}
+
+
+templates = Templates(directory='templates')
+render = templates.TemplateResponse
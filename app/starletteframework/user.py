@@ -2,9 +2,14 @@ from starlette.authentication import requires
 from starlette.responses import RedirectResponse
 from .. import messages
 from ..forms import UserForm, PasswordForm, LoginForm
+from ..orm.user import User
+from .caching import cached_response
 from .templates import render
 
 
+# The login form carries a CSRF token, so only the signed in page is cached.
+@cached_response(vary=('user',),
+    cache_if=lambda request: request.user.is_authenticated)
 async def homepage(request):
     data = await request.form()
     login_form = LoginForm(request, meta={ 'csrf_context': request.session })
@@ -26,15 +31,20 @@ async def profile(request):
                 meta={ 'csrf_context': request.session })
             valid = user_form.validate()
             if valid:
-                user_form.populate_obj(user) 
-                user.save()
+                target = await User.objects.aget(user.id)
+                user_form.populate_obj(target)
+                try:
+                    await target.asave()
+                except User.Exists:
+                    user_form.email.errors.append(
+                        'Email address already in use')
+                    valid = False
         elif 'password-change' in data:
             password_form = PasswordForm(user, formdata=data,
                 meta={ 'csrf_context': request.session })
-            valid = password_form.validate() and user.change_password(
-                password_form.current_password.data,
-                password_form.new_password.data)
+            valid = await password_form.avalidate()
             if valid:
+                await user.aset_password(password_form.new_password.data)
                 messages.add(request, 'Password changed', classes=['info'])
         if valid:
             return RedirectResponse(url=request.url.path, status_code=302)
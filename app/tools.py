@@ -2,10 +2,19 @@ from .wiring import do_wiring
 
 do_wiring()
 
+import csv
+import json
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
 import click
 from . import orm, schemas
+from .auth import create_random_key, get_password_hash
+from .orm.base import Conflict, iter_chunks
 from .orm.db import session_scope
-from .orm.user import User
+from .orm.oauth2token import OAuth2Token
+from .orm.user import User, AUTO_PASSWORD_BYTES
 #from fastapi.encoders import jsonable_encoder
 
 from .containers import SessionLocal
@@ -53,6 +62,145 @@ def update_user(email, password):
     #user = User.objects.update(db_obj=user, obj_in=obj_in, db=session)
 
 
+def _read_users(f, fmt):
+    """Stream user rows from a CSV (with header) or JSON lines file."""
+    if fmt == 'csv':
+        yield from csv.DictReader(f)
+    else:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _flag(value, default):
+    if value is None or value == '':
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y', 't')
+    return bool(value)
+
+
+# Input fields an upsert updates, and their columns.
+UPSERT_COLUMNS = {
+    'full_name': 'full_name',
+    'password': 'hashed_password',
+    'is_active': 'is_active',
+    'is_superuser': 'is_superuser',
+}
+
+
+def _update_columns(row) -> Tuple[str, ...]:
+    """The columns an upsert of an input row updates on an existing user:
+    only those of fields given in the row. Generated passwords, flag
+    defaults and user_data never overwrite existing values.
+    """
+    return tuple(column for field, column in UPSERT_COLUMNS.items()
+        if row.get(field) not in (None, ''))
+
+
+def _with_email(rows, rejected:List[Conflict]):
+    """Yield the rows that have an email, adding the others to rejected."""
+    for i, row in enumerate(rows):
+        if row.get('email'):
+            yield row
+        else:
+            rejected.append(Conflict(i, row, 'missing email'))
+
+
+def _report_rejected(rejected:List[Conflict]) -> int:
+    """Report and clear the rows rejected before insert. Returns their
+    number.
+    """
+    for conflict in rejected:
+        click.echo(f'Rejected row {conflict.position + 1}: {conflict.error}',
+            err=True)
+    count = len(rejected)
+    rejected.clear()
+    return count
+
+
+def _hashed_chunks(rows, pool, chunk_size):
+    """Yield chunks of user rows with passwords hashed in the process pool,
+    as (input rows, user rows). Hashing of the next chunk overlaps with the
+    caller's insert of the current one.
+    """
+    pending = None
+    for chunk in iter_chunks(rows, chunk_size):
+        passwords = [r.get('password') or create_random_key(AUTO_PASSWORD_BYTES)
+            for r in chunk]
+        futures = [pool.submit(get_password_hash, pw) for pw in passwords]
+        if pending:
+            yield _resolve(*pending)
+        pending = (chunk, futures)
+    if pending:
+        yield _resolve(*pending)
+
+
+def _resolve(chunk, futures):
+    return chunk, [{
+        'full_name': r.get('full_name'),
+        'email': r['email'],
+        'hashed_password': f.result(),
+        'is_active': _flag(r.get('is_active'), True),
+        'is_superuser': _flag(r.get('is_superuser'), False),
+        'user_data': {},
+    } for r, f in zip(chunk, futures)]
+
+
+@click.command()
+@click.argument('filename', type=click.File('r'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']),
+    default=None, help='Defaults to the file extension.')
+@click.option('--chunk-size', default=1000, show_default=True)
+@click.option('--workers', default=None, type=int,
+    help='Password hashing processes. Defaults to the cpu count.')
+@click.option('--upsert', is_flag=True, default=False,
+    help='Update existing users matched by email.')
+def import_users(filename, fmt, chunk_size, workers, upsert):
+    """Import users from a CSV or JSON lines file with email, full_name,
+    password, is_active and is_superuser fields. Users without a password get
+    a random one. With --upsert, existing users are updated with the fields
+    given in the file only.
+    """
+    if fmt is None:
+        fmt = 'jsonl' if filename.name.endswith(('.jsonl', '.json')) else 'csv'
+    rejected:List[Conflict] = []
+    rows = _with_email(_read_users(filename, fmt), rejected)
+    written = 0
+    conflicts = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool, \
+            session_scope() as db:
+        for inputs, chunk in _hashed_chunks(rows, pool, chunk_size):
+            if upsert:
+                # rows that update the same columns are upserted together
+                groups = defaultdict(list)
+                for row, user in zip(inputs, chunk):
+                    groups[_update_columns(row)].append(user)
+                results = [User.objects.bulk_upsert(group,
+                    index_elements=['email'], update_columns=columns,
+                    chunk_size=chunk_size, db=db)
+                    for columns, group in groups.items()]
+            else:
+                results = [User.objects.bulk_create(chunk,
+                    chunk_size=chunk_size, db=db)]
+            for result in results:
+                for conflict in result.conflicts:
+                    click.echo(f'Rejected {conflict.row["email"]}: '
+                        f'{conflict.error}', err=True)
+                written += result.written
+                conflicts += len(result.conflicts)
+            conflicts += _report_rejected(rejected)
+            elapsed = time.perf_counter() - start
+            click.echo(f'{written} users written, {conflicts} rejected, '
+                f'{written / elapsed:.0f} users/s', err=True)
+    conflicts += _report_rejected(rejected)
+    elapsed = time.perf_counter() - start
+    click.echo(f'Imported {written} users in {elapsed:.1f}s '
+        f'({written / elapsed if elapsed else 0:.0f} users/s), '
+        f'{conflicts} rejected')
+
+
 @click.command()
 @click.argument('email')
 @click.option('--create', is_flag=True)
@@ -71,6 +219,46 @@ def create_client(email, create):
 users.add_command(create_user, 'create')
 users.add_command(update_user, 'update')
 users.add_command(create_client, 'client')
+users.add_command(import_users, 'import')
+
+# tokens group
+
+@click.group()
+def tokens():
+    pass
+
+
+@click.command()
+@click.option('--batch-size', default=1000, show_default=True,
+    type=click.IntRange(min=1))
+@click.option('--rate', default=5.0, show_default=True,
+    help='Maximum batches per second. 0 for no limit.')
+@click.option('--max-batches', default=None, type=int)
+def reap_tokens(batch_size, rate, max_batches):
+    """Delete expired and revoked tokens in batches."""
+    total = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        deleted = OAuth2Token.objects.reap_batch(batch_size)
+        total += deleted
+        batches += 1
+        if deleted < batch_size:
+            break
+        if rate > 0:
+            time.sleep(1 / rate)
+    click.echo(f'Deleted {total} tokens in {batches} batches')
+
+
+tokens.add_command(reap_tokens, 'reap')
+
+# openapi
+
+@click.command()
+@click.argument('output', type=click.File('wb'), default='-')
+def openapi(output):
+    """Write the OpenAPI spec, e.g. for OPENAPI_SPEC_FILE."""
+    from .starletteframework.api.clients import spec_bytes
+    output.write(spec_bytes())
 
 # main cli group
 
@@ -79,6 +267,8 @@ def cli():
     pass
 
 cli.add_command(users)
+cli.add_command(tokens)
+cli.add_command(openapi)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,9 @@
+"""
+Micro-benchmarks. Run modules from the project root with the application
+environment (WEBSTER_ settings) set, e.g.:
+
+```
+python -m benchmarks.middleware
+python -m benchmarks.hotpath
+```
+"""
@@ -0,0 +1,403 @@
+"""
+Latency of the application's hot paths, driven in-process through the full
+ASGI app (middleware, routing, database) without a server:
+
+ * token: POST /v0.1/token with client credentials
+ * token_refresh: POST /v0.1/token-refresh, each with the refresh token
+   returned by the one before
+ * clients_list: GET /v0.1/clients with a bearer token
+ * page_home, page_profile: pages rendered for a session cookie
+ * admin_users: the admin user list
+
+Every scenario is run at each user count given with --users, after seeding
+the users table up to that count. For each, the results have p50/p99/mean
+latency, sequential requests per second, and database queries and pool
+checkouts per request. Results are written as JSON, by default to
+benchmarks/results/<commit>.json, and --compare prints the changes from an
+earlier results file.
+
+```
+python -m benchmarks.hotpath [-n REQUESTS] [--users 10000,100000]
+    [--database URL] [-o FILE] [--compare FILE]
+```
+
+By default the app runs against a new SQLite database in a temporary
+directory. --database runs it against another database, e.g. a local
+PostgreSQL. The database must be dedicated to the benchmark: its tables are
+dropped and created again.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import re
+import subprocess
+import tempfile
+import time
+import typing
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+from .middleware import make_receive
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+PASSWORD = 'benchmark'
+
+
+class Response(typing.NamedTuple):
+    status: int
+    headers: typing.Dict[str, str]
+    body: bytes
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class ASGIClient():
+    """In-process HTTP client for an ASGI app, keeping cookies."""
+
+    def __init__(self, app):
+        self.app = app
+        self.cookies:typing.Dict[str, str] = {}
+
+    async def request(self, method:str, url:str, headers:dict=None,
+            form:dict=None) -> Response:
+        parts = urlsplit(url)
+        body = b''
+        raw_headers = [(b'host', b'testserver')]
+        if form is not None:
+            body = urlencode(form).encode()
+            raw_headers.append(
+                (b'content-type', b'application/x-www-form-urlencoded'))
+        for name, value in (headers or {}).items():
+            raw_headers.append((name.lower().encode(), value.encode()))
+        if self.cookies:
+            raw_headers.append((b'cookie', '; '.join(
+                f'{k}={v}' for k, v in self.cookies.items()).encode()))
+        scope = {
+            'type': 'http',
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'server': ('testserver', 80),
+            'client': ('127.0.0.1', 50000),
+            'root_path': '',
+            'path': parts.path,
+            'raw_path': parts.path.encode(),
+            'query_string': parts.query.encode(),
+            'headers': raw_headers,
+        }
+        status = 0
+        response_headers = {}
+        chunks = []
+
+        async def send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                for name, value in message['headers']:
+                    name, value = name.decode(), value.decode()
+                    if name == 'set-cookie':
+                        self._set_cookie(value)
+                    response_headers[name] = value
+            elif message['type'] == 'http.response.body':
+                chunks.append(message.get('body', b''))
+
+        await self.app(scope, make_receive(body), send)
+        return Response(status, response_headers, b''.join(chunks))
+
+    def _set_cookie(self, header:str):
+        for name, morsel in SimpleCookie(header).items():
+            if morsel['expires'] or morsel.value == 'null':
+                self.cookies.pop(name, None)
+            else:
+                self.cookies[name] = morsel.value
+
+    async def get(self, url:str, **kwargs) -> Response:
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url:str, **kwargs) -> Response:
+        return await self.request('POST', url, **kwargs)
+
+
+### queries ###
+
+query_count = 0
+
+
+def count_queries(*engines):
+    def before_cursor_execute(*args):
+        global query_count
+        query_count += 1
+    from sqlalchemy import event
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+### setup ###
+
+def configure(database:typing.Optional[str], workdir:str):
+    """Set the application environment. Must run before the app is
+    imported.
+    """
+    if database is None:
+        database = f'sqlite:///{os.path.join(workdir, "benchmark.db")}'
+    os.environ['WEBSTER_SQLALCHEMY_DATABASE_URI'] = database
+    os.environ.setdefault('WEBSTER_SERVER_NAME', 'benchmark')
+    os.environ.setdefault('WEBSTER_PROJECT_NAME', 'Webster')
+    os.environ.setdefault('WEBSTER_ALLOWED_HOSTS', '["testserver"]')
+    os.environ.setdefault('WEBSTER_SESSION_SQLITE_PATH',
+        os.path.join(workdir, 'sessions.sqlite'))
+    # Every request comes from one address and client, and would soon be
+    # rate limited.
+    os.environ.setdefault('WEBSTER_RATE_LIMIT_ENABLED', 'false')
+
+
+def create_tables():
+    from app.containers import engine
+    from app.orm.base import ModelBase
+    ModelBase.metadata.drop_all(engine)
+    ModelBase.metadata.create_all(engine)
+
+
+def seed_users(count:int):
+    """Add users until the users table has count rows. They share one
+    password hash, since hashing each would take far longer than the
+    benchmark.
+    """
+    from sqlalchemy import func, select
+    from app.auth import get_password_hash
+    from app.orm.db import session_scope
+    from app.orm.user import User
+    with session_scope() as db:
+        existing = db.execute(select(func.count(User.id))).scalar()
+    hashed_password = get_password_hash(PASSWORD)
+    rows = ({
+        'full_name': f'Benchmark User {i}',
+        'email': f'user{i}@benchmark.example.com',
+        'hashed_password': hashed_password,
+        'is_active': True,
+        'is_superuser': False,
+        'user_data': {},
+    } for i in range(existing, count))
+    User.objects.bulk_create(rows)
+
+
+def create_fixtures():
+    """A superuser and an OAuth2 client of theirs."""
+    from app.orm.oauth2client import OAuth2Client
+    from app.orm.user import User
+    admin = User.objects.create({
+        'full_name': 'Benchmark Admin',
+        'email': 'admin@benchmark.example.com',
+        'password': PASSWORD,
+        'is_superuser': True,
+    })
+    client = OAuth2Client.objects.create({
+        'user_id': admin.id, 'name': 'benchmark'})
+    return admin, client
+
+
+async def login(client:ASGIClient, email:str):
+    """Sign in through the login form, so that the client has a session
+    cookie.
+    """
+    page = await client.get('/auth/login')
+    csrf_token = re.search(rb'name="csrf_token"[^>]*value="([^"]+)"',
+        page.body).group(1).decode()
+    response = await client.post('/auth/login', form={
+        'email': email, 'password': PASSWORD, 'csrf_token': csrf_token})
+    if response.status != 302:
+        raise RuntimeError(f'Login failed: {response.status}')
+
+
+### scenarios ###
+
+Request = typing.Callable[[], typing.Awaitable[Response]]
+
+
+async def scenarios(app, oauth2_client) -> typing.Dict[str, Request]:
+    """Requests for each scenario, by name. Each call makes one request."""
+    api = ASGIClient(app)
+    credentials = {
+        'grant_type': 'client_credentials',
+        'client_id': oauth2_client.client_id,
+        'client_secret': oauth2_client.client_secret,
+    }
+    token = (await api.post('/v0.1/token', form=credentials)).json()
+    bearer = {'authorization': f'Bearer {token["access_token"]}'}
+    refresh_token = (await api.post('/v0.1/token', form=credentials)
+        ).json()['refresh_token']
+    browser = ASGIClient(app)
+    await login(browser, 'admin@benchmark.example.com')
+
+    async def token_refresh():
+        nonlocal refresh_token
+        response = await api.post('/v0.1/token-refresh', form={
+            'grant_type': 'refresh_token', 'refresh_token': refresh_token})
+        if response.status == 200:
+            refresh_token = response.json()['refresh_token']
+        return response
+
+    return {
+        'token': lambda: api.post('/v0.1/token', form=credentials),
+        'token_refresh': token_refresh,
+        'clients_list': lambda: api.get('/v0.1/clients', headers=bearer),
+        'page_home': lambda: browser.get('/'),
+        'page_profile': lambda: browser.get('/profile'),
+        'admin_users': lambda: browser.get('/admin/users'),
+    }
+
+
+def percentile(values:typing.List[float], p:float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    index = max(0, min(len(values) - 1, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+async def measure(request:Request, n:int, warmup:int) -> dict:
+    from app import containers
+    for _ in range(warmup):
+        await request()
+    latencies = []
+    queries, checkouts = query_count, containers.checkout_count
+    start = time.perf_counter()
+    for _ in range(n):
+        t = time.perf_counter()
+        response = await request()
+        latencies.append(time.perf_counter() - t)
+        if response.status >= 400:
+            raise RuntimeError(f'Request failed: {response.status}')
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests': n,
+        'p50_ms': percentile(latencies, 50) * 1e3,
+        'p99_ms': percentile(latencies, 99) * 1e3,
+        'mean_ms': sum(latencies) / n * 1e3,
+        'requests_per_second': n / elapsed,
+        'queries_per_request': (query_count - queries) / n,
+        'checkouts_per_request': (containers.checkout_count - checkouts) / n,
+    }
+
+
+async def run(user_counts:typing.List[int], n:int, warmup:int) -> dict:
+    """Results by '<scenario>@<users>'."""
+    from app.containers import async_engine, engine
+    from app.starletteframework.main import app
+    count_queries(engine, async_engine.sync_engine)
+    create_tables()
+    _, oauth2_client = create_fixtures()
+    await app.router.startup()
+    results = {}
+    try:
+        for count in sorted(user_counts):
+            seed_users(count)
+            for name, request in (await scenarios(app, oauth2_client)).items():
+                results[f'{name}@{count}'] = await measure(request, n, warmup)
+    finally:
+        await app.router.shutdown()
+    return results
+
+
+### reporting ###
+
+def git_commit() -> typing.Tuple[str, bool]:
+    """The current commit and whether the tree has changes."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, check=True, text=True,
+            cwd=os.path.dirname(__file__)).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain'],
+            capture_output=True, check=True, text=True,
+            cwd=os.path.dirname(__file__)).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, dirty
+
+
+def print_results(results:dict):
+    print(f'{"scenario":<26} {"p50 ms":>8} {"p99 ms":>8} {"req/s":>8} '
+        f'{"queries":>8} {"checkouts":>10}')
+    for key, r in results.items():
+        print(f'{key:<26} {r["p50_ms"]:>8.2f} {r["p99_ms"]:>8.2f} '
+            f'{r["requests_per_second"]:>8.0f} {r["queries_per_request"]:>8.2f} '
+            f'{r["checkouts_per_request"]:>10.2f}')
+
+
+def print_comparison(base:dict, results:dict):
+    """Changes from base, in percent, of the scenarios in both."""
+    print(f'\nChange from {base["meta"]["commit"]}:')
+    print(f'{"scenario":<26} {"p50":>8} {"p99":>8} {"req/s":>8} '
+        f'{"queries":>8} {"checkouts":>10}')
+    fields = ('p50_ms', 'p99_ms', 'requests_per_second',
+        'queries_per_request', 'checkouts_per_request')
+    for key, r in results.items():
+        old = base['results'].get(key)
+        if old is None:
+            continue
+        changes = []
+        for field in fields:
+            if old[field]:
+                changes.append(f'{(r[field] / old[field] - 1) * 100:+.1f}%')
+            else:
+                changes.append('-' if not r[field] else 'new')
+        print(f'{key:<26} {changes[0]:>8} {changes[1]:>8} {changes[2]:>8} '
+            f'{changes[3]:>8} {changes[4]:>10}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-n', type=int, default=1000,
+        help='requests per scenario')
+    parser.add_argument('--warmup', type=int, default=50,
+        help='untimed requests per scenario')
+    parser.add_argument('--users', default='10000,100000',
+        help='comma separated user counts')
+    parser.add_argument('--database', default=None,
+        help='database URL (default: a temporary SQLite database)')
+    parser.add_argument('-o', '--output', default=None,
+        help='results file (default: benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', default=None,
+        help='earlier results file to compare with')
+    args = parser.parse_args()
+    user_counts = [int(count) for count in args.users.split(',')]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure(args.database, workdir)
+        results = asyncio.get_event_loop().run_until_complete(
+            run(user_counts, args.n, args.warmup))
+
+    from app.containers import engine
+    commit, dirty = git_commit()
+    document = {
+        'meta': {
+            'commit': commit,
+            'dirty': dirty,
+            'created': datetime.datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'database': engine.dialect.name,
+            'requests': args.n,
+            'warmup': args.warmup,
+        },
+        'results': results,
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR,
+            f'{commit}{"-dirty" if dirty else ""}.json')
+    with open(output, 'w') as f:
+        json.dump(document, f, indent=2)
+    print_results(results)
+    print(f'\nWrote {output}')
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
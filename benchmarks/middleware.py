@@ -0,0 +1,127 @@
+"""
+Per-layer overhead of the middleware stack built by setup_middleware.
+
+Requests are sent directly to the ASGI stack, without a server, to a bare
+endpoint. Each layer's overhead is the time per request of the stack from
+that layer inward, less that of the stack from the next layer inward. A no-op
+BaseHTTPMiddleware layer is measured for reference.
+
+```
+python -m benchmarks.middleware [-n REQUESTS]
+```
+"""
+import argparse
+import asyncio
+import time
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+
+
+async def endpoint(scope, receive, send):
+    await send({'type': 'http.response.start', 'status': 200,
+        'headers': [(b'content-type', b'text/plain')]})
+    await send({'type': 'http.response.body', 'body': b'ok'})
+
+
+class NoopBaseHTTPMiddleware(BaseHTTPMiddleware):
+
+    async def dispatch(self, request, call_next):
+        return await call_next(request)
+
+
+def make_scope():
+    return {
+        'type': 'http',
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'server': ('testserver', 80),
+        'client': ('127.0.0.1', 50000),
+        'root_path': '',
+        'path': '/',
+        'raw_path': b'/',
+        'query_string': b'',
+        'headers': [(b'host', b'testserver')],
+        # Set by SessionMiddleware, but needed by the inner layers when they
+        # are timed without it.
+        'session': {},
+    }
+
+
+def make_receive(body:bytes=b''):
+    """The request body, then wait as a server does until the client
+    disconnects.
+    """
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Future() # cancelled when the response is done
+    return receive
+
+
+async def send(message):
+    pass
+
+
+async def time_app(app, n:int) -> float:
+    """Mean seconds per request to app."""
+    for _ in range(min(n, 100)): # warm up
+        await app(make_scope(), make_receive(), send)
+    start = time.perf_counter()
+    for _ in range(n):
+        await app(make_scope(), make_receive(), send)
+    return (time.perf_counter() - start) / n
+
+
+def stack_layers():
+    """The (name, class, options) of the app's middleware, outermost first."""
+    from app.starletteframework.middleware import setup_middleware
+    app = Starlette()
+    setup_middleware(app)
+    return [(m.cls.__name__, m.cls, m.options) for m in app.user_middleware]
+
+
+def build(layers, inner=endpoint):
+    app = inner
+    for _, cls, options in reversed(layers):
+        app = cls(app=app, **options)
+    return app
+
+
+async def run(n:int) -> list:
+    """Time the stack. Returns a row per layer, outermost first, and a
+    reference row for BaseHTTPMiddleware.
+    """
+    layers = stack_layers()
+    times = [await time_app(build(layers[i:]), n)
+        for i in range(len(layers) + 1)]
+    rows = []
+    for i, (name, _, _) in enumerate(layers):
+        rows.append({'layer': name,
+            'overhead_us': (times[i] - times[i + 1]) * 1e6,
+            'cumulative_us': (times[i] - times[-1]) * 1e6})
+    reference = await time_app(NoopBaseHTTPMiddleware(endpoint), n)
+    rows.append({'layer': 'NoopBaseHTTPMiddleware (reference)',
+        'overhead_us': (reference - times[-1]) * 1e6,
+        'cumulative_us': None})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-n', type=int, default=5000,
+        help='requests per measurement')
+    args = parser.parse_args()
+    rows = asyncio.get_event_loop().run_until_complete(run(args.n))
+    print(f'{"layer":<40} {"overhead us":>12} {"cumulative us":>14}')
+    for row in rows:
+        cumulative = '' if row['cumulative_us'] is None \
+            else f'{row["cumulative_us"]:.1f}'
+        print(f'{row["layer"]:<40} {row["overhead_us"]:>12.1f} '
+            f'{cumulative:>14}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Check that a refresh token is single use under concurrency: of two refreshes
+with the same refresh token at once, one succeeds and the other is rejected.
+
+Each round issues a token and refreshes it twice at once, through the sync
+path (OAuth2Token.refresh, in two threads) and the async path
+(OAuth2Token.arefresh, gathered), each call in its own database session as
+in a request. The check fails if a round has other than one success and one
+rejection (DoesNotExist, Revoked or Expired).
+
+```
+python -m benchmarks.refresh [-n ROUNDS] [--database URL]
+```
+
+By default it runs against a new SQLite database in a temporary directory.
+As with benchmarks.hotpath, --database runs it against another database,
+e.g. a local PostgreSQL, whose tables are dropped and created again.
+"""
+import argparse
+import asyncio
+import collections
+import sys
+import tempfile
+import threading
+import typing
+from .hotpath import configure, create_fixtures, create_tables
+
+
+def outcome(error:typing.Optional[BaseException]) -> str:
+    """'refreshed', 'rejected' or the name of an unexpected exception."""
+    from app.orm.oauth2token import OAuth2Token
+    if error is None:
+        return 'refreshed'
+    if isinstance(error, (OAuth2Token.DoesNotExist, OAuth2Token.Revoked,
+            OAuth2Token.Expired)):
+        return 'rejected'
+    return type(error).__name__
+
+
+def new_refresh_token(oauth2_client) -> str:
+    from app.orm.db import session_scope
+    from app.orm.oauth2token import OAuth2Token
+    with session_scope() as db:
+        token = OAuth2Token.objects.create_for_client('client_credentials',
+            oauth2_client.client_id, oauth2_client.client_secret, db=db)
+    return token.refresh_token
+
+
+def sync_round(oauth2_client) -> typing.List[str]:
+    """Two refreshes in threads, released together."""
+    from app.orm.db import session_scope
+    from app.orm.oauth2token import OAuth2Token
+    refresh_token = new_refresh_token(oauth2_client)
+    barrier = threading.Barrier(2)
+    outcomes:typing.List[str] = []
+
+    def refresh():
+        error = None
+        try:
+            with session_scope() as db:
+                barrier.wait()
+                OAuth2Token.objects.refresh('refresh_token', refresh_token,
+                    db=db)
+        except Exception as e:
+            error = e
+        outcomes.append(outcome(error))
+
+    threads = [threading.Thread(target=refresh) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+async def async_round(oauth2_client) -> typing.List[str]:
+    """Two refreshes on the event loop at once."""
+    from app.orm.oauth2token import OAuth2Token
+    refresh_token = new_refresh_token(oauth2_client)
+    results = await asyncio.gather(*(
+        OAuth2Token.objects.arefresh('refresh_token', refresh_token)
+        for _ in range(2)), return_exceptions=True)
+    return [outcome(r if isinstance(r, BaseException) else None)
+        for r in results]
+
+
+def check(rounds:int) -> typing.Dict[str, collections.Counter]:
+    """Counts of the outcomes of each path's rounds, e.g.
+    {'sync': Counter({('refreshed', 'rejected'): 20})}.
+    """
+    from app.starletteframework.main import app # wires the container
+    create_tables()
+    _, oauth2_client = create_fixtures()
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(app.router.startup())
+    results:typing.Dict[str, collections.Counter] = {
+        'sync': collections.Counter(), 'async': collections.Counter()}
+    try:
+        for _ in range(rounds):
+            results['sync'][tuple(sorted(sync_round(oauth2_client)))] += 1
+            results['async'][tuple(sorted(loop.run_until_complete(
+                async_round(oauth2_client))))] += 1
+    finally:
+        loop.run_until_complete(app.router.shutdown())
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-n', type=int, default=20,
+        help='rounds per path')
+    parser.add_argument('--database', default=None,
+        help='database URL (default: a temporary SQLite database)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure(args.database, workdir)
+        results = check(args.n)
+        from app.containers import engine
+        database = engine.dialect.name
+
+    expected = ('refreshed', 'rejected')
+    failed = False
+    for path, counts in results.items():
+        for outcomes, count in counts.items():
+            ok = outcomes == expected
+            failed = failed or not ok
+            print(f'{database} {path:<5} {" + ".join(outcomes):<24} '
+                f'{count:>4} {"ok" if ok else "FAIL"}')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()